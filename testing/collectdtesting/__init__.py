@@ -3,3 +3,4 @@ Utilities for doing integration testing with collectd plugins
 """
 from .collectd import run_collectd, run_collectd_with_config  # noqa
 from .containers import run_container, container_ip  # noqa
+from .inprocess import run_collectd_in_process  # noqa
@@ -62,6 +62,8 @@ def has_datapoint_with_metric_name(fake_ingest, metric_name):
     Returns True if the fake_ingest has any datapoints that have the given
     metric_name
     """
+    if hasattr(fake_ingest, "query_datapoints"):
+        return len(fake_ingest.query_datapoints(metric=metric_name, limit=1)) > 0
     for datapoint in fake_ingest.datapoints:
         if datapoint.metric == metric_name:
             return True
@@ -79,6 +81,8 @@ def has_datapoint_with_all_dims(fake_ingest, dims):
     """
     Tests if any datapoints has all of the given dimensions
     """
+    if hasattr(fake_ingest, "query_datapoints"):
+        return len(fake_ingest.query_datapoints(dims=dims, limit=1)) > 0
     for datapoint in fake_ingest.datapoints:
         if has_all_dims(datapoint, dims):
             return True
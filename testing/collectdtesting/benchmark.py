@@ -0,0 +1,243 @@
+"""
+Throughput and latency benchmark of the collectd -> metricproxy -> ingest
+pipeline.
+
+A synthetic load generator plugin built on collectdutil.metrics dispatches a
+configurable number of series every interval.  The fake ingest timestamps the
+datapoints as they arrive, and the harness reports the end-to-end lag,
+datapoints per second, drops and collectd's write queue stats, and writes them
+to a JSON file so that runs can be compared between plugin releases:
+
+    python -m collectdtesting.benchmark --series 10000 --interval 10 --duration 120 --output results.json
+
+The collectdutil package must be importable locally, as it is copied into the
+collectd container along with the plugin.
+"""
+from contextlib import contextmanager
+import argparse
+import json
+import os
+import shutil
+import string
+import tempfile
+import time
+
+from .collectd import run_collectd_with_config, DEFAULT_COLLECTD_IMAGE
+
+PLUGIN_DIR = "/opt/collectd-plugin"
+
+LOAD_GENERATOR_PLUGIN = """
+import collectd
+
+from collectdutil.config import Config
+from collectdutil.metrics import Metric, MetricBatch
+
+descriptors = {
+    'Series': ('series', 1000, int),
+    'Reads': ('reads', 0, int),
+}
+
+sent = [0]
+reads = [0]
+
+
+def read(cfg):
+    # Stop after `reads` reads, so that nothing is sent while the harness waits for the last datapoints
+    if cfg.reads and reads[0] >= cfg.reads:
+        return
+    reads[0] += 1
+    batch = MetricBatch(plugin='load_generator')
+    for i in range(cfg.series):
+        batch.add('bench.series', 'gauge', i, dimensions=dict(series=str(i)))
+    sent[0] += cfg.series + 1
+    batch.add_metric(Metric('bench.sent', 'gauge', sent[0], plugin='load_generator_stats'))
+    batch.dispatch()
+
+
+def configure(conf):
+    cfg = Config(conf, descriptors=descriptors)
+    collectd.register_read(read, data=cfg)
+
+
+collectd.register_config(configure)
+"""
+
+BENCHMARK_COLLECTD_CONFIG = string.Template("""
+TypesDB "/usr/share/collectd/types.db"
+
+Hostname "benchmark-collectd"
+
+Interval $interval
+Timeout 20
+ReadThreads 5
+WriteQueueLimitHigh $write_queue_limit_high
+WriteQueueLimitLow  $write_queue_limit_low
+CollectInternalStats true
+
+LoadPlugin logfile
+<Plugin logfile>
+        LogLevel "info"
+        File "stdout"
+        Timestamp true
+        PrintSeverity true
+</Plugin>
+
+<LoadPlugin python>
+  Globals true
+</LoadPlugin>
+
+<Plugin python>
+  ModulePath "$plugin_dir"
+  Import "load_generator"
+  <Module load_generator>
+    Series $series
+    Reads $reads
+  </Module>
+</Plugin>
+""")
+
+
+@contextmanager
+def load_generator_dir():
+    """
+    Creates a temporary plugin directory with the load generator plugin and a
+    copy of the local collectdutil package
+    """
+    try:
+        import collectdutil
+    except ImportError:
+        raise ImportError("The benchmark needs the collectdutil package installed locally")
+
+    plugin_dir = tempfile.mkdtemp(dir="/tmp")
+    try:
+        shutil.copytree(os.path.dirname(collectdutil.__file__), os.path.join(plugin_dir, "collectdutil"),
+                        ignore=shutil.ignore_patterns("*.pyc", "__pycache__"))
+        with open(os.path.join(plugin_dir, "load_generator.py"), "w") as plugin_file:
+            plugin_file.write(LOAD_GENERATOR_PLUGIN)
+        yield plugin_dir
+    finally:
+        shutil.rmtree(plugin_dir, ignore_errors=True)
+
+
+def latest_sent(ingest):
+    """
+    Returns the number of datapoints the load generator reported having sent
+    """
+    sent = ingest.query_datapoints(dims={"plugin": "load_generator_stats"}, remote=True)
+    return max((dp.value.doubleValue or dp.value.intValue for dp in sent), default=0)
+
+
+def load_generator_received(stats):
+    """
+    Returns the number of load generator datapoints in the fake ingest stats
+    """
+    by_plugin = stats["datapoints_by_plugin"]
+    return by_plugin.get("load_generator", 0) + by_plugin.get("load_generator_stats", 0)
+
+
+def write_queue_stats(ingest):
+    """
+    Summarizes collectd's internal stats (write queue length, dropped values,
+    cache size) by metric name and plugin instance as their max and last
+    values
+    """
+    summary = {}
+    for datapoint in ingest.query_datapoints(dims={"plugin": "collectd"}, remote=True):
+        dims = {d.key: d.value for d in datapoint.dimensions}
+        name = datapoint.metric
+        if dims.get("plugin_instance"):
+            name = dims["plugin_instance"] + "." + name
+        value = datapoint.value.doubleValue or datapoint.value.intValue
+        stats = summary.setdefault(name, {"max": value, "last": value})
+        stats["max"] = max(stats["max"], value)
+        stats["last"] = value
+    return summary
+
+
+def run_benchmark(series=1000, interval=10, duration=60, write_queue_limit_high=500000,
+                  write_queue_limit_low=400000, image=DEFAULT_COLLECTD_IMAGE, output=None):
+    """
+    Runs the load generator with `series` series every `interval` seconds for
+    `duration` seconds against a threaded fake ingest behind metricproxy.  The
+    load generator then stops, and the harness waits up to three intervals for
+    the datapoints still in flight.
+
+    Returns the results as a dict, and writes them as JSON to `output` if
+    given.  `drops` is the number of datapoints the load generator sent that
+    never arrived.
+    """
+    config = BENCHMARK_COLLECTD_CONFIG.substitute(
+        interval=interval, series=series, reads=max(1, duration // interval), plugin_dir=PLUGIN_DIR,
+        write_queue_limit_high=write_queue_limit_high, write_queue_limit_low=write_queue_limit_low)
+
+    with load_generator_dir() as plugin_dir:
+        with run_collectd_with_config(config, [(plugin_dir, PLUGIN_DIR)], image, threaded_ingest=True) \
+                as (ingest, _):
+            start = time.time()
+            timeline = []
+            while time.time() - start < duration:
+                time.sleep(min(interval, max(0, duration - (time.time() - start))))
+                stats = ingest.stats
+                timeline.append({
+                    "elapsed": time.time() - start,
+                    "datapoints_received": stats["datapoints_received"],
+                    "in_flight": stats["in_flight"],
+                })
+
+            # Wait for the load generator to stop, which it has once its sent
+            # count holds for an interval, and for what it sent to arrive
+            settle_deadline = time.time() + 3 * interval
+            sent = None
+            while True:
+                previous_sent, sent = sent, latest_sent(ingest)
+                stats = ingest.stats
+                received = load_generator_received(stats)
+                if (sent == previous_sent and received >= sent) or time.time() >= settle_deadline:
+                    break
+                time.sleep(interval if sent != previous_sent else 1)
+
+            queue_stats = write_queue_stats(ingest)
+
+    arrival_span = (stats["last_arrival"] or 0) - (stats["first_arrival"] or 0)
+    results = {
+        "config": {
+            "series": series,
+            "interval": interval,
+            "duration": duration,
+            "write_queue_limit_high": write_queue_limit_high,
+            "write_queue_limit_low": write_queue_limit_low,
+            "image": image,
+        },
+        "datapoints_sent": sent,
+        "datapoints_received": received,
+        "drops": max(0, sent - received),
+        "datapoints_per_second": received / arrival_span if arrival_span > 0 else None,
+        "lag": {name: stats["lag_" + name] for name in ("p50", "p90", "p99", "max")},
+        "ingest": stats,
+        "write_queue": queue_stats,
+        "timeline": timeline,
+    }
+    if output:
+        with open(output, "w") as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the collectd -> metricproxy -> ingest pipeline")
+    parser.add_argument("--series", type=int, default=1000, help="series dispatched every interval")
+    parser.add_argument("--interval", type=int, default=10, help="collectd read interval in seconds")
+    parser.add_argument("--duration", type=int, default=60, help="length of the run in seconds")
+    parser.add_argument("--write-queue-limit-high", type=int, default=500000)
+    parser.add_argument("--write-queue-limit-low", type=int, default=400000)
+    parser.add_argument("--image", default=DEFAULT_COLLECTD_IMAGE, help="collectd image to run")
+    parser.add_argument("--output", default="benchmark-results.json", help="path of the JSON results file")
+    args = parser.parse_args()
+    results = run_benchmark(args.series, args.interval, args.duration, args.write_queue_limit_high,
+                            args.write_queue_limit_low, args.image, args.output)
+    print(json.dumps({k: results[k] for k in ("datapoints_sent", "datapoints_received", "drops",
+                                              "datapoints_per_second", "lag")}, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -81,13 +81,13 @@ def run_collectd(extra_config, plugin_dir, interval=10, image=DEFAULT_COLLECTD_I
 
 
 @contextmanager
-def ingest_running():
+def ingest_running(threaded=False):
     """
     Starts up the fake ingest/metricproxy combo and also adds a write_http
     config to use that.  Yields the final config with write_http configured and
     the ingest interface
     """
-    with fake_backend.run_all() as (ingest, mp_url):
+    with fake_backend.run_all(threaded=threaded) as (ingest, mp_url):
         def render_config(config):
             return config + "\n" + WRITE_HTTP_TEMPLATE.substitute(url=mp_url)
 
@@ -95,7 +95,7 @@ def ingest_running():
 
 
 @contextmanager
-def run_collectd_with_config(config, files=None, image=DEFAULT_COLLECTD_IMAGE):
+def run_collectd_with_config(config, files=None, image=DEFAULT_COLLECTD_IMAGE, threaded_ingest=False):
     """
     Runs collectd with the given config content as the main collectd.conf file.
 
@@ -103,7 +103,7 @@ def run_collectd_with_config(config, files=None, image=DEFAULT_COLLECTD_IMAGE):
     datapoints and events, and `collectd` is an object that has some helpful
     methods and attributes for interacting with collectd.
     """
-    with ingest_running() as (render_config, ingest):
+    with ingest_running(threaded=threaded_ingest) as (render_config, ingest):
         with tempfile.NamedTemporaryFile(dir="/tmp") as conf_file:
             conf_file.write(render_config(config).encode('utf-8'))
             conf_file.flush()
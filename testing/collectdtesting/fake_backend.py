@@ -8,6 +8,7 @@ from io import BytesIO
 import os
 import string
 import tempfile
+from threading import Lock
 
 from signalfx.generated_protocol_buffers \
     import signal_fx_protocol_buffers_pb2 as sf_pbuf
@@ -15,6 +16,7 @@ import requests
 
 from .assertions import wait_for
 from .containers import container_ip, get_docker_client, run_container, is_container_port_open
+from .fake_ingest import DatapointStore
 
 INGEST_DOCKERFILE = """
 FROM python:3.6
@@ -22,17 +24,20 @@ FROM python:3.6
 WORKDIR /opt/lib
 RUN pip install 'signalfx>=1.0' 'docker>=3.0.0'
 
-ENTRYPOINT [ "python", "-u", "-c", "from collectdtesting import fake_ingest; fake_ingest.run_fake_ingest()" ]
+ENTRYPOINT [ "python", "-u", "-c", "from collectdtesting import fake_ingest; fake_ingest.main()" ]
 """
 
 
 @contextmanager
-def run_ingest():
+def run_ingest(threaded=False):
     """
     Starts up a new fake ingest that will run on a random port.  The returned
     object will have properties on it for datapoints and events. The fake
     server will be stopped once the context manager block is exited.
 
+    With `threaded`, the fake ingest handles connections concurrently with
+    keep-alive, for load tests with many writers.
+
     This is actually implemented by running the run_fake_ingest function in the
     fake_ingest.py module in a separate docker container so that this will work
     transparently when this function is executed on a Mac, since it is very
@@ -51,7 +56,8 @@ def run_ingest():
 
     with run_container(test_code_image.id,
                        [(test_package_dir, "/opt/lib/collectdtesting")],
-                       ports={"8080/tcp": None}) as ingest_cont:
+                       ports={"8080/tcp": None},
+                       command=["--threaded"] if threaded else []) as ingest_cont:
 
         local_port = ingest_cont.attrs["NetworkSettings"]["Ports"]["8080/tcp"][0]["HostPort"]
         assert wait_for(p(is_container_port_open, ingest_cont, 8080)), "fake ingest didn't start"
@@ -65,12 +71,51 @@ def run_ingest():
             url = "http://%s:%d" % (host, port)
             local_url = "http://127.0.0.1:%s" % (local_port,)
 
+            def __init__(self):
+                self._datapoints = DatapointStore()
+                self._cursor = 0
+                self._sync_lock = Lock()
+
+            def sync(self):
+                """
+                Fetch only the datapoints received since the last sync into the
+                local view and return them
+                """
+                with self._sync_lock:
+                    resp = requests.get(self.local_url + "/datapoints", params={"since": self._cursor})
+                    dp_message = sf_pbuf.DataPointUploadMessage()
+                    dp_message.ParseFromString(resp.content)
+                    self._datapoints.extend(dp_message.datapoints)
+                    self._cursor = int(resp.headers["X-Cursor"])
+                    return dp_message.datapoints
+
             @property
             def datapoints(self):
                 """
-                Fetch the datapoints from the fake ingest and deserialize them
+                All of the datapoints received by the fake ingest, fetching
+                only the new ones since the last access
+                """
+                self.sync()
+                return self._datapoints.query()[0]
+
+            def query_datapoints(self, metric=None, dims=None, limit=None, remote=False):
+                """
+                Return the datapoints that have the given metric name and all
+                of the given dimensions, from the indexed local view after
+                fetching the new datapoints.  With `remote`, only the matches
+                are fetched from the fake ingest's indexes, without syncing
+                the local view.
                 """
-                resp = requests.get(self.local_url + "/datapoints")
+                if not remote:
+                    self.sync()
+                    return self._datapoints.query(metric, dims, limit)[0]
+
+                params = [("dim", "%s:%s" % (k, v)) for k, v in (dims or {}).items()]
+                if metric is not None:
+                    params.append(("metric", metric))
+                if limit is not None:
+                    params.append(("limit", limit))
+                resp = requests.get(self.local_url + "/datapoints", params=params)
                 dp_message = sf_pbuf.DataPointUploadMessage()
                 dp_message.ParseFromString(resp.content)
                 return dp_message.datapoints
@@ -85,6 +130,13 @@ def run_ingest():
                 event_message.ParseFromString(resp.content)
                 return event_message.events
 
+            @property
+            def stats(self):
+                """
+                Fetch the fake ingest's own request counts, latency and backlog
+                """
+                return requests.get(self.local_url + "/stats").json()
+
         yield FakeBackend()
 
 
@@ -133,12 +185,12 @@ def run_metric_proxy(ingest_url):
 
 
 @contextmanager
-def run_all():
+def run_all(threaded=False):
     """
     Runs the fake ingest server and metric proxy wired up to it so that
     collectd can post to metric proxy but we can assert against the final
     datapoints that would be seen by ingest
     """
-    with run_ingest() as fake_ingest:
+    with run_ingest(threaded=threaded) as fake_ingest:
         with run_metric_proxy(fake_ingest.url) as mp_url:
             yield fake_ingest, mp_url
@@ -1,84 +1,491 @@
 """
 This is meant to be a standalone module that can be run in a base python:3
 docker container that runs a simple fake ingest server that collects datapoints
-and spits them back out upon request.
+and spits them back out upon request.  It can also handle connections
+concurrently (`--threaded`) to stand in for ingest in throughput benchmarks.
 """
+from collections import deque
 from http.server import HTTPServer, BaseHTTPRequestHandler
-import gzip
+from socketserver import ThreadingMixIn
+from threading import Lock
+from urllib.parse import parse_qs, urlsplit
+import argparse
+import json
+import re
+import time
+import zlib
 from google.protobuf import json_format
+from google.protobuf.message import DecodeError
 
 from signalfx.generated_protocol_buffers \
     import signal_fx_protocol_buffers_pb2 as sf_pbuf
 
 
-def run_fake_ingest():
+DEFAULT_MAX_DATAPOINTS = 1000000
+
+
+class DatapointStore:
     """
-    Fake the /v2/datapoint and /v2/event endpoints and just stick everything in
-    lists that get dumped in the protobuf format upon GET requests to the server.
+    Holds the most recent `max_datapoints` datapoints with inverted indexes by
+    metric name and by dimension key/value, so that queries only look at the
+    datapoints that can match instead of scanning everything received.
+    """
+
+    def __init__(self, max_datapoints=DEFAULT_MAX_DATAPOINTS):
+        self.max_datapoints = max_datapoints
+        self._entries = {}  # id -> (datapoint, dims dict)
+        self._next_id = 0
+        self._first_id = 0
+        self._by_metric = {}  # metric -> deque of ids, oldest first
+        self._by_dim = {}  # (key, value) -> deque of ids, oldest first
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def extend(self, datapoints):
+        with self._lock:
+            for datapoint in datapoints:
+                dims = {d.key: d.value for d in datapoint.dimensions}
+                dp_id = self._next_id
+                self._next_id += 1
+                self._entries[dp_id] = (datapoint, dims)
+                self._by_metric.setdefault(datapoint.metric, deque()).append(dp_id)
+                for dim in dims.items():
+                    self._by_dim.setdefault(dim, deque()).append(dp_id)
+            while len(self._entries) > self.max_datapoints:
+                self._evict_oldest()
+
+    def _evict_oldest(self):
+        datapoint, dims = self._entries.pop(self._first_id)
+        # Ids are appended in order, so the evicted one is at the head of each of its postings
+        self._pop_posting(self._by_metric, datapoint.metric)
+        for dim in dims.items():
+            self._pop_posting(self._by_dim, dim)
+        self._first_id += 1
+
+    @staticmethod
+    def _pop_posting(index, key):
+        posting = index[key]
+        posting.popleft()
+        if not posting:
+            del index[key]
+
+    def query(self, metric=None, dims=None, limit=None, since=None):
+        """
+        Returns (datapoints, cursor): the datapoints, oldest first, that have
+        the given metric name (if not None) and all of the given dimensions,
+        at most `limit` of them.
+
+        Every datapoint gets a sequence number on ingest.  With `since`, only
+        datapoints whose sequence number is at least `since` are considered.
+        The returned cursor is the `since` to use next to get only the
+        datapoints that were not considered by this query.
+        """
+        dims = dims or {}
+        with self._lock:
+            since = max(since or 0, self._first_id)
+            postings = []
+            if metric is not None:
+                postings.append(self._by_metric.get(metric, ()))
+            postings.extend(self._by_dim.get(dim, ()) for dim in dims.items())
+
+            if postings:
+                candidates = _ids_since(min(postings, key=len), since)
+            else:
+                candidates = range(since, self._next_id)
+
+            matches = []
+            cursor = self._next_id
+            for dp_id in candidates:
+                if limit is not None and len(matches) >= limit:
+                    cursor = dp_id
+                    break
+                datapoint, dp_dims = self._entries[dp_id]
+                if metric is not None and datapoint.metric != metric:
+                    continue
+                if not dims.items() <= dp_dims.items():
+                    continue
+                matches.append(datapoint)
+            return matches, cursor
+
+
+def _ids_since(posting, since):
+    """
+    Returns the ids of an ordered posting that are at least `since`, walking
+    it from its newest end so that polling for new datapoints stays cheap.
+    """
+    ids = []
+    for dp_id in reversed(posting):
+        if dp_id < since:
+            break
+        ids.append(dp_id)
+    ids.reverse()
+    return ids
+
+
+def parse_query(query):
+    """
+    Parses the `metric`, `dim` (as `key:value`, repeatable), `limit` and
+    `since` parameters of a datapoint query string.  Raises ValueError if
+    `limit` or `since` is not an integer, or `limit` is less than 1.
+    """
+    params = parse_qs(query)
+    metric = params.get("metric", [None])[-1]
+    dims = dict(dim.split(":", 1) for dim in params.get("dim", []) if ":" in dim)
+    limit = int(params["limit"][-1]) if "limit" in params else None
+    since = int(params["since"][-1]) if "since" in params else None
+    if limit is not None and limit < 1:
+        raise ValueError("limit must be at least 1")
+    return metric, dims, limit, since
+
+
+class IngestStats:
+    """
+    Request counts, in-flight requests (the backlog being worked on) and the
+    latency of the most recent requests, as measured by the fake ingest itself.
+
+    Datapoint arrivals are timestamped too, giving the number of datapoints
+    received (in total and by `plugin` dimension), the time of the first and
+    last arrivals, and the lag between each datapoint's timestamp and its
+    arrival.
+    """
+
+    def __init__(self, max_samples=10000):
+        self.requests = 0
+        self.errors = 0
+        self.bytes_received = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.datapoints_received = 0
+        self.datapoints_by_plugin = {}
+        self.first_arrival = None
+        self.last_arrival = None
+        self._latencies = deque(maxlen=max_samples)
+        self._lags = deque(maxlen=max_samples)
+        self._lock = Lock()
+
+    def start(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return time.perf_counter()
+
+    def finish(self, started, bytes_received=0, failed=False):
+        latency = time.perf_counter() - started
+        with self._lock:
+            self.in_flight -= 1
+            self.requests += 1
+            self.errors += failed
+            self.bytes_received += bytes_received
+            self._latencies.append(latency)
+
+    def record_datapoints(self, datapoints):
+        arrival = time.time()
+        lags = []
+        by_plugin = {}
+        for datapoint in datapoints:
+            if datapoint.timestamp:
+                lags.append(arrival - datapoint.timestamp / 1000.0)
+            plugin = next((d.value for d in datapoint.dimensions if d.key == "plugin"), "")
+            by_plugin[plugin] = by_plugin.get(plugin, 0) + 1
+        with self._lock:
+            self.datapoints_received += len(datapoints)
+            for plugin, count in by_plugin.items():
+                self.datapoints_by_plugin[plugin] = self.datapoints_by_plugin.get(plugin, 0) + count
+            if self.first_arrival is None:
+                self.first_arrival = arrival
+            self.last_arrival = arrival
+            self._lags.extend(lags)
+
+    def to_dict(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            lags = sorted(self._lags)
+            stats = {
+                "requests": self.requests,
+                "errors": self.errors,
+                "bytes_received": self.bytes_received,
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "datapoints_received": self.datapoints_received,
+                "datapoints_by_plugin": dict(self.datapoints_by_plugin),
+                "first_arrival": self.first_arrival,
+                "last_arrival": self.last_arrival,
+            }
+        for name, quantile in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0)):
+            stats["latency_" + name] = latencies[int(quantile * (len(latencies) - 1))] if latencies else None
+            stats["lag_" + name] = lags[int(quantile * (len(lags) - 1))] if lags else None
+        return stats
+
+
+def iter_body(rfile, headers, chunk_size=65536):
+    """
+    Yields the raw request body in chunks as it is read, for both
+    Content-Length delimited and chunked transfer encoded requests
+    """
+    if "chunked" in headers.get("Transfer-Encoding", ""):
+        while True:
+            size = int(rfile.readline().split(b";", 1)[0].strip(), 16)
+            if size == 0:
+                while rfile.readline() not in (b"\r\n", b"\n", b""):  # trailers
+                    pass
+                return
+            yield rfile.read(size)
+            rfile.readline()
+    else:
+        remaining = int(headers.get("Content-Length", 0))
+        while remaining > 0:
+            chunk = rfile.read(min(chunk_size, remaining))
+            if not chunk:
+                raise ValueError("request body ended early")
+            remaining -= len(chunk)
+            yield chunk
+
+
+def gunzip_stream(chunks):
+    """
+    Decompresses gzip data (possibly several members) chunk by chunk
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        while chunk:
+            yield decompressor.decompress(chunk)
+            if decompressor.eof:
+                chunk = decompressor.unused_data
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            else:
+                chunk = b""
+    yield decompressor.flush()
+
+
+def parse_upload(upload, body, is_json):
+    """
+    Parses a JSON or protobuf upload body into the given upload message
+    """
+    if is_json:
+        json_format.Parse(body, upload)
+    else:
+        upload.ParseFromString(body)
+    return upload
+
+
+COLLECTD_METRIC_TYPES = {
+    "gauge": sf_pbuf.GAUGE,
+    "derive": sf_pbuf.CUMULATIVE_COUNTER,
+    "counter": sf_pbuf.CUMULATIVE_COUNTER,
+    "absolute": sf_pbuf.COUNTER,
+}
+
+_dims_re = re.compile(r"^(.*?)\[(.*)\](.*)$")
+
+
+def split_dimensions(name):
+    """
+    Splits a collectd name with encoded dimensions, like
+    `instance[key=value,key2=value2]`, into the name and its dimensions
     """
+    match = _dims_re.match(name)
+    if not match:
+        return name, {}
+    dims = dict(pair.split("=", 1) for pair in match.group(2).split(",") if "=" in pair)
+    return match.group(1) + match.group(3), dims
 
+
+def collectd_json_to_datapoints(value_lists):
+    """
+    Converts the value lists posted by collectd's write_http plugin in JSON
+    format to datapoints, the way metricproxy does: the metric is named
+    `type.type_instance` (plus `.dsname` for multi-value types), host, plugin,
+    plugin_instance and dsname become dimensions, and so do the dimensions
+    encoded in brackets in the host, plugin_instance and type_instance
+    """
     datapoints = []
+    for value_list in value_lists:
+        host, dims = split_dimensions(value_list.get("host", ""))
+        plugin_instance, instance_dims = split_dimensions(value_list.get("plugin_instance", ""))
+        type_instance, type_instance_dims = split_dimensions(value_list.get("type_instance", ""))
+        dims.update(instance_dims)
+        dims.update(type_instance_dims)
+        dims["host"] = host
+        dims["plugin"] = value_list["plugin"]
+        if plugin_instance:
+            dims["plugin_instance"] = plugin_instance
+
+        values = value_list["values"]
+        for value, dstype, dsname in zip(values, value_list["dstypes"], value_list["dsnames"]):
+            if value is None:  # NaN
+                continue
+            datapoint = sf_pbuf.DataPoint()
+            datapoint.metric = value_list["type"]
+            if type_instance:
+                datapoint.metric += "." + type_instance
+            if len(values) > 1:
+                datapoint.metric += "." + dsname
+            datapoint.timestamp = int(value_list["time"] * 1000)
+            datapoint.metricType = COLLECTD_METRIC_TYPES.get(dstype, sf_pbuf.GAUGE)
+            if isinstance(value, int):
+                datapoint.value.intValue = value
+            else:
+                datapoint.value.doubleValue = value
+            for key, dim_value in sorted(dict(dims, dsname=dsname).items()):
+                dim = datapoint.dimensions.add()
+                dim.key = key
+                dim.value = dim_value
+            datapoints.append(datapoint)
+    return datapoints
+
+
+class ThreadingIngestServer(ThreadingMixIn, HTTPServer):
+    """
+    Handles each connection on its own thread so that many writers can post
+    concurrently and keep their connections alive
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def make_fake_ingest(host="0.0.0.0", port=8080, max_datapoints=DEFAULT_MAX_DATAPOINTS, threaded=False):
+    """
+    Create the fake ingest server without starting it.  The server has
+    `datapoints`, `events` and `stats` attributes with what it received.
+
+    In threaded mode, connections are handled concurrently, and kept alive
+    between requests (HTTP/1.1).  Request bodies are always decompressed
+    while they are read instead of after.
+    """
+
+    datapoints = DatapointStore(max_datapoints)
     events = []
+    stats = IngestStats()
 
     class FakeIngest(BaseHTTPRequestHandler):
         """
         Simulates ingest for POST and implements a GET handler that allows
         querying sent datapoints/events
         """
+        protocol_version = "HTTP/1.1" if threaded else "HTTP/1.0"
+
+        def log_message(self, *args):
+            # Logging every request to stderr serializes the threads under load
+            if not threaded:
+                super().log_message(*args)
+
+        def respond(self, status, body=b"", content_type="text/ascii", headers=None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", len(body))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
         def do_GET(self):
             """
             Dump out the received datapoints and events in a pickled byte
-            encoding.
+            encoding, or the ingest's own stats as JSON.
             """
             obj = None
-            if 'datapoint' in self.path:
+            headers = {}
+            url = urlsplit(self.path)
+            if 'datapoint' in url.path:
+                try:
+                    metric, dims, limit, since = parse_query(url.query)
+                except ValueError as e:
+                    self.respond(400, str(e).encode("utf-8"))
+                    return
+                matches, headers["X-Cursor"] = datapoints.query(metric, dims, limit, since)
                 obj = sf_pbuf.DataPointUploadMessage()
-                obj.datapoints.extend(datapoints)
-            elif 'event' in self.path:
+                obj.datapoints.extend(matches)
+            elif 'event' in url.path:
                 obj = sf_pbuf.EventUploadMessage()
                 obj.events.extend(events)
+            elif url.path == '/stats':
+                self.respond(200, json.dumps(stats.to_dict()).encode("utf-8"), "application/json")
+                return
             else:
-                self.send_response(404)
-                self.end_headers()
+                self.respond(404)
                 return
 
-            out = obj.SerializeToString()
-            self.send_response(200)
-            self.send_header("Content-Type", "application/octet-stream")
-            self.send_header("Content-Length", len(out))
-            self.end_headers()
-            self.wfile.write(out)
+            self.respond(200, obj.SerializeToString(), "application/octet-stream", headers)
 
         def do_POST(self):
-            body = self.rfile.read(int(self.headers.get('Content-Length')))
-            is_json = "application/json" in self.headers.get("Content-Type")
-
-            if "gzip" in self.headers.get("Content-Encoding", ""):
-                body = gzip.decompress(body)
-
-            if 'datapoint' in self.path:
-                dp_upload = sf_pbuf.DataPointUploadMessage()
-                if is_json:
-                    json_format.Parse(body, dp_upload)
-                else:
-                    dp_upload.ParseFromString(body)
-                datapoints.extend(dp_upload.datapoints)
-            elif 'event' in self.path:
-                event_upload = sf_pbuf.EventUploadMessage()
-                if is_json:
-                    json_format.Parse(body, event_upload)
-                else:
-                    event_upload.ParseFromString(body)
-                events.extend(event_upload.events)
-            else:
-                self.send_response(404)
-                self.end_headers()
-                return
+            started = stats.start()
+            received = 0
+            failed = True
+            try:
+                is_json = "application/json" in self.headers.get("Content-Type", "")
+
+                def counted(chunks):
+                    nonlocal received
+                    for chunk in chunks:
+                        received += len(chunk)
+                        yield chunk
+
+                chunks = counted(iter_body(self.rfile, self.headers))
+                if "gzip" in self.headers.get("Content-Encoding", ""):
+                    chunks = gunzip_stream(chunks)
+                try:
+                    body = b"".join(chunks)
+                except (ValueError, zlib.error):
+                    self.close_connection = True
+                    self.respond(400)
+                    return
+
+                try:
+                    if 'collectd' in self.path:
+                        store, items = datapoints, collectd_json_to_datapoints(json.loads(body.decode("utf-8")))
+                    elif 'datapoint' in self.path:
+                        upload = parse_upload(sf_pbuf.DataPointUploadMessage(), body, is_json)
+                        store, items = datapoints, upload.datapoints
+                    elif 'event' in self.path:
+                        upload = parse_upload(sf_pbuf.EventUploadMessage(), body, is_json)
+                        store, items = events, upload.events
+                    else:
+                        self.respond(404)
+                        return
+                except (ValueError, KeyError, TypeError, json_format.ParseError, DecodeError):
+                    self.respond(400)
+                    return
+                store.extend(items)
+                if store is datapoints:
+                    stats.record_datapoints(items)
+
+                self.respond(200, "\"OK\"".encode("utf-8"))
+                failed = False
+            finally:
+                stats.finish(started, received, failed)
+
+    server_class = ThreadingIngestServer if threaded else HTTPServer
+    server = server_class((host, port), FakeIngest)
+    server.datapoints = datapoints
+    server.events = events
+    server.stats = stats
+    return server
+
+
+def run_fake_ingest(max_datapoints=DEFAULT_MAX_DATAPOINTS, threaded=False):
+    """
+    Fake the /v2/datapoint and /v2/event endpoints and just stick everything in
+    a datapoint store and an event list that get dumped in the protobuf format
+    upon GET requests to the server.
+
+    `GET /datapoints?metric=<name>&dim=<key>:<value>&limit=<n>` returns only
+    the matching datapoints, and only the most recent `max_datapoints` are
+    kept.  Datapoint responses have an `X-Cursor` header that can be passed
+    back as `since=<cursor>` to only get the datapoints received since.
+    `GET /stats` returns the ingest's own request latency and backlog.
+
+    Collectd's write_http JSON can be posted to `/post-collectd` directly, in
+    which case the fake ingest converts it to datapoints like metricproxy.
+    """
+    return make_fake_ingest(max_datapoints=max_datapoints, threaded=threaded).serve_forever()
 
-            self.send_response(200)
-            self.send_header("Content-Type", "text/ascii")
-            self.send_header("Content-Length", "4")
-            self.end_headers()
-            self.wfile.write("\"OK\"".encode("utf-8"))
 
-    return HTTPServer(('0.0.0.0', 8080), FakeIngest).serve_forever()
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake SignalFx ingest server on port 8080")
+    parser.add_argument("--threaded", action="store_true", help="handle connections concurrently with keep-alive")
+    parser.add_argument("--max-datapoints", type=int, default=DEFAULT_MAX_DATAPOINTS,
+                        help="number of most recent datapoints to keep")
+    args = parser.parse_args()
+    run_fake_ingest(max_datapoints=args.max_datapoints, threaded=args.threaded)
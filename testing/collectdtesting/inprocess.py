@@ -0,0 +1,216 @@
+"""
+Runs plugin tests in process, without Docker.
+
+The fake ingest runs on a local thread and decodes collectd's write_http JSON
+itself in place of metricproxy, and the plugin runs on collectdutil's
+fauxllectd instead of collectd, with a write callback that posts what it
+dispatches in write_http's format.  The yielded ingest has the same interface
+as the fake backend of run_collectd, so the assertion helpers work with both:
+
+    with run_collectd_in_process('Host "localhost"', "my_plugin", plugin_dir="/path/to/plugin") \
+            as (ingest, collectd):
+        collectd.run_reads(intervals=3)
+        assert has_datapoint_with_metric_name(ingest, "gauge.my.metric")
+
+Reads run on fauxllectd's simulated clock, so datapoint timestamps are
+simulated too.  Since fauxllectd has no types.db, every value is sent with a
+data source type taken from its type name (gauge, derive, counter or absolute,
+and gauge otherwise) and named `value`, or `value<n>` for multi-value types.
+"""
+from contextlib import contextmanager
+from http.client import HTTPConnection
+from threading import Lock, Thread
+import importlib
+import json
+import logging
+import sys
+
+from .fake_ingest import make_fake_ingest
+
+DS_TYPES = ("gauge", "derive", "counter", "absolute")
+
+
+class WriteHttpWriter:
+    """
+    A fauxllectd write callback that buffers values and posts them as
+    write_http JSON once `buffer_size` of them are buffered or on flush
+    """
+
+    def __init__(self, runtime, host, port, path="/post-collectd", buffer_size=1000):
+        self.runtime = runtime
+        self.path = path
+        self.buffer_size = buffer_size
+        self._conn = HTTPConnection(host, port, timeout=10)
+        self._buffer = []
+        self._lock = Lock()
+
+    def write(self, values):
+        count = len(values.values)
+        ds_type = values.type if values.type in DS_TYPES else "gauge"
+        value_list = {
+            "values": list(values.values),
+            "dstypes": [ds_type] * count,
+            "dsnames": ["value"] if count == 1 else ["value%d" % i for i in range(count)],
+            "time": values.time or self.runtime.now(),
+            "interval": values.interval or self.runtime.interval,
+            "host": values.host,
+            "plugin": values.plugin,
+            "plugin_instance": values.plugin_instance,
+            "type": values.type,
+            "type_instance": values.type_instance,
+        }
+        with self._lock:
+            self._buffer.append(value_list)
+            if len(self._buffer) < self.buffer_size:
+                return
+        self.flush()
+
+    def flush(self, *args):
+        with self._lock:
+            buffered, self._buffer = self._buffer, []
+            if not buffered:
+                return
+            self._conn.request("POST", self.path, json.dumps(buffered).encode("utf-8"),
+                               {"Content-Type": "application/json"})
+            resp = self._conn.getresponse()
+            resp.read()
+            if resp.status != 200:
+                raise RuntimeError("fake ingest rejected %d values with status %d" % (len(buffered), resp.status))
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+
+class InProcessBackend:
+    """
+    The fake ingest running on a local thread, with the same interface as the
+    FakeBackend of run_ingest but reading its store directly
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.host, self.port = server.server_address[:2]
+        self.url = "http://%s:%d" % (self.host, self.port)
+        self.local_url = self.url
+
+    @property
+    def datapoints(self):
+        return self.server.datapoints.query()[0]
+
+    def query_datapoints(self, metric=None, dims=None, limit=None, remote=False):
+        return self.server.datapoints.query(metric, dims, limit)[0]
+
+    @property
+    def events(self):
+        return list(self.server.events)
+
+    @property
+    def stats(self):
+        return self.server.stats.to_dict()
+
+
+class _LogCapture(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+@contextmanager
+def run_collectd_in_process(config, plugin_module, plugin_dir=None, buffer_size=1000):
+    """
+    Runs the plugin module `plugin_module` (imported from `plugin_dir`, like
+    the python plugin's ModulePath, if given) on fauxllectd, configured with
+    `config`, the content of its <Module> block.  Nothing is read until
+    `collectd.run_reads` is called.
+
+    Yields (ingest, collectd) like run_collectd_with_config, where `ingest` is
+    an InProcessBackend and `collectd` an object for driving fauxllectd.
+    """
+    try:
+        from collectdutil import fauxllectd
+        from collectdutil.utils import ParsedConfig
+    except ImportError:
+        raise ImportError("The in-process mode needs the collectdutil package installed locally")
+
+    server = make_fake_ingest("127.0.0.1", 0, threaded=True)
+    server_thread = Thread(target=server.serve_forever, name="fake-ingest")
+    server_thread.daemon = True
+    server_thread.start()
+
+    previous_collectd = sys.modules.get("collectd")
+    sys.modules["collectd"] = fauxllectd
+    if plugin_dir is not None:
+        sys.path.insert(0, plugin_dir)
+    log_capture = _LogCapture()
+    log_level = fauxllectd.log.level
+    fauxllectd.log.setLevel(logging.DEBUG)
+    fauxllectd.log.addHandler(log_capture)
+    writer = WriteHttpWriter(fauxllectd, "127.0.0.1", server.server_address[1], buffer_size=buffer_size)
+
+    def start(plugin_config):
+        fauxllectd.reset()
+        fauxllectd.register_write(writer.write)
+        fauxllectd.register_flush(writer.flush)
+        # Reloading makes the plugin register its callbacks with the fresh runtime
+        if plugin_module in sys.modules:
+            importlib.reload(sys.modules[plugin_module])
+        else:
+            importlib.import_module(plugin_module)
+        fauxllectd.configure(ParsedConfig(plugin_config))
+        fauxllectd.init()
+
+    class Collectd:
+        """
+        A shell class that holds some attribute and methods useful for
+        interacting with fauxllectd.
+        """
+        runtime = fauxllectd
+
+        def run_reads(self, duration=None, intervals=1):
+            """
+            Run the read callbacks for `duration` seconds or `intervals`
+            intervals of the simulated clock, and flush what they dispatched
+            to the fake ingest.  Returns the number of read calls.
+            """
+            calls = fauxllectd.run_reads(duration, intervals)
+            writer.flush()
+            return calls
+
+        def logs(self):
+            """
+            Return what the plugin logged through the collectd module
+            """
+            return "\n".join(log_capture.lines)
+
+        def reconfig(self, new_config):
+            """
+            Shut the plugin down and start it again with a new config
+            """
+            fauxllectd.shutdown()
+            writer.flush()
+            start(new_config)
+
+    try:
+        start(config)
+        yield InProcessBackend(server), Collectd()
+    finally:
+        try:
+            fauxllectd.shutdown()
+            writer.close()
+        finally:
+            fauxllectd.reset()
+            fauxllectd.log.removeHandler(log_capture)
+            fauxllectd.log.setLevel(log_level)
+            if plugin_dir is not None:
+                sys.path.remove(plugin_dir)
+            if previous_collectd is None:
+                sys.modules.pop("collectd", None)
+            else:
+                sys.modules["collectd"] = previous_collectd
+            server.shutdown()
+            server.server_close()
@@ -12,5 +12,9 @@ setup(
         'docker>=3.0.0',
         'signalfx>=1.0',
     ],
+    extras_require={
+        'benchmark': ['collectdutil'],
+        'inprocess': ['collectdutil'],
+    },
     python_requires='>=3.5',
 )
@@ -0,0 +1,80 @@
+from collectdtesting.benchmark import LOAD_GENERATOR_PLUGIN, latest_sent, load_generator_received, \
+    write_queue_stats
+from collectdtesting.fake_ingest import collectd_json_to_datapoints, make_fake_ingest
+from collectdtesting.inprocess import InProcessBackend, run_collectd_in_process
+
+
+def value_list(plugin, type_, value, plugin_instance="", type_instance=""):
+    return {
+        "values": [value],
+        "dstypes": [type_],
+        "dsnames": ["value"],
+        "time": 1500000000.0,
+        "interval": 10.0,
+        "host": "benchmark-collectd",
+        "plugin": plugin,
+        "plugin_instance": plugin_instance,
+        "type": type_,
+        "type_instance": type_instance,
+    }
+
+
+def backend_with(value_lists):
+    server = make_fake_ingest("127.0.0.1", 0)
+    datapoints = collectd_json_to_datapoints(value_lists)
+    server.datapoints.extend(datapoints)
+    server.stats.record_datapoints(datapoints)
+    return server, InProcessBackend(server)
+
+
+def test_latest_sent():
+    server, ingest = backend_with([
+        value_list("load_generator_stats", "gauge", 11, type_instance="bench.sent"),
+        value_list("load_generator_stats", "gauge", 33.0, type_instance="bench.sent"),
+        value_list("load_generator_stats", "gauge", 22, type_instance="bench.sent"),
+        value_list("load_generator", "gauge", 1000, type_instance="bench.series"),
+    ])
+    try:
+        assert latest_sent(ingest) == 33
+        assert load_generator_received(ingest.stats) == 4
+    finally:
+        server.server_close()
+
+
+def test_latest_sent_without_datapoints():
+    server, ingest = backend_with([])
+    try:
+        assert latest_sent(ingest) == 0
+        assert load_generator_received(ingest.stats) == 0
+    finally:
+        server.server_close()
+
+
+def test_write_queue_stats():
+    server, ingest = backend_with([
+        value_list("collectd", "gauge", 5, plugin_instance="write_queue", type_instance="queue_length"),
+        value_list("collectd", "gauge", 9, plugin_instance="write_queue", type_instance="queue_length"),
+        value_list("collectd", "gauge", 2, plugin_instance="write_queue", type_instance="queue_length"),
+        value_list("collectd", "derive", 3, plugin_instance="write_queue", type_instance="dropped"),
+        value_list("collectd", "gauge", 40.5, plugin_instance="cache", type_instance="cache_size"),
+        value_list("collectd", "gauge", 7, type_instance="uptime"),
+        value_list("load_generator", "gauge", 1, type_instance="bench.series"),
+    ])
+    try:
+        assert write_queue_stats(ingest) == {
+            "write_queue.gauge.queue_length": {"max": 9, "last": 2},
+            "write_queue.derive.dropped": {"max": 3, "last": 3},
+            "cache.gauge.cache_size": {"max": 40.5, "last": 40.5},
+            "gauge.uptime": {"max": 7, "last": 7},
+        }
+    finally:
+        server.server_close()
+
+
+def test_load_generator_stops_after_its_reads(tmp_path):
+    (tmp_path / "load_generator.py").write_text(LOAD_GENERATOR_PLUGIN)
+    with run_collectd_in_process("Series 5\nReads 3", "load_generator", plugin_dir=str(tmp_path)) \
+            as (ingest, collectd):
+        collectd.run_reads(intervals=6)
+        assert latest_sent(ingest) == 18
+        assert load_generator_received(ingest.stats) == 18
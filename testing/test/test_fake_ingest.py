@@ -0,0 +1,186 @@
+from http.client import HTTPConnection
+from threading import Thread
+import gzip
+import io
+import socket
+
+import pytest
+import requests
+from signalfx.generated_protocol_buffers import signal_fx_protocol_buffers_pb2 as sf_pbuf
+
+from collectdtesting.fake_ingest import DatapointStore, gunzip_stream, iter_body, make_fake_ingest, parse_query
+
+
+def datapoint(metric, **dims):
+    dp = sf_pbuf.DataPoint()
+    dp.metric = metric
+    dp.value.intValue = 1
+    for key, value in sorted(dims.items()):
+        dim = dp.dimensions.add()
+        dim.key = key
+        dim.value = value
+    return dp
+
+
+@pytest.fixture
+def ingest():
+    server = make_fake_ingest("127.0.0.1", 0, threaded=True)
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server, "http://127.0.0.1:%d" % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def test_store_queries_by_metric_and_dims():
+    store = DatapointStore()
+    store.extend([datapoint("a", host="1"), datapoint("b", host="1"), datapoint("a", host="2", x="y")])
+    assert [dp.metric for dp in store.query("a")[0]] == ["a", "a"]
+    assert [dp.metric for dp in store.query(dims={"host": "1"})[0]] == ["a", "b"]
+    assert [dp.metric for dp in store.query("a", {"host": "2", "x": "y"})[0]] == ["a"]
+    assert store.query("a", {"host": "3"})[0] == []
+    assert store.query("c")[0] == []
+    assert len(store.query()[0]) == 3
+
+
+def test_store_evicts_oldest_and_its_index_entries():
+    store = DatapointStore(max_datapoints=2)
+    store.extend([datapoint("a", host="1"), datapoint("b", host="1"), datapoint("b", host="2")])
+    assert len(store) == 2
+    assert store.query("a")[0] == []
+    assert [dp.metric for dp in store.query(dims={"host": "1"})[0]] == ["b"]
+    assert [dp.metric for dp in store.query()[0]] == ["b", "b"]
+
+
+def test_store_limit():
+    store = DatapointStore()
+    store.extend([datapoint("a", n=str(i)) for i in range(5)])
+    matches, _ = store.query("a", limit=2)
+    assert [dp.dimensions[0].value for dp in matches] == ["0", "1"]
+    assert store.query("a", limit=0)[0] == []
+
+
+def test_parse_query():
+    assert parse_query("metric=m&dim=a:b:c&dim=k:v&limit=2&since=5") == ("m", {"a": "b:c", "k": "v"}, 2, 5)
+    assert parse_query("") == (None, {}, None, None)
+    for query in ("limit=abc", "since=x", "limit=0"):
+        with pytest.raises(ValueError):
+            parse_query(query)
+
+
+def test_query_endpoint(ingest):
+    server, url = ingest
+    server.datapoints.extend([datapoint("a", host="1"), datapoint("b", host="1"), datapoint("a", host="2")])
+    resp = requests.get(url + "/datapoints", params=[("metric", "a"), ("dim", "host:2")])
+    message = sf_pbuf.DataPointUploadMessage()
+    message.ParseFromString(resp.content)
+    assert [(dp.metric, dp.dimensions[0].value) for dp in message.datapoints] == [("a", "2")]
+
+    for params in ({"limit": "abc"}, {"since": "x"}, {"limit": "0"}):
+        assert requests.get(url + "/datapoints", params=params).status_code == 400
+
+
+def test_store_cursor_returns_only_new_datapoints():
+    store = DatapointStore(max_datapoints=3)
+    store.extend([datapoint("a"), datapoint("b")])
+    matches, cursor = store.query(since=0)
+    assert (len(matches), cursor) == (2, 2)
+    assert store.query(since=cursor) == ([], 2)
+
+    store.extend([datapoint("a"), datapoint("a")])
+    matches, cursor = store.query("a", since=cursor)
+    assert (len(matches), cursor) == (2, 4)
+
+    # A cursor older than the retained datapoints starts at the oldest one kept
+    matches, cursor = store.query(since=0)
+    assert ([dp.metric for dp in matches], cursor) == (["b", "a", "a"], 4)
+
+    # A limited query resumes where it stopped
+    matches, cursor = store.query("a", limit=1, since=0)
+    assert (len(matches), cursor) == (1, 3)
+    matches, cursor = store.query("a", limit=1, since=cursor)
+    assert (len(matches), cursor) == (1, 4)
+
+
+def test_cursor_header(ingest):
+    server, url = ingest
+    server.datapoints.extend([datapoint("a"), datapoint("b")])
+    resp = requests.get(url + "/datapoints", params={"since": 1})
+    message = sf_pbuf.DataPointUploadMessage()
+    message.ParseFromString(resp.content)
+    assert [dp.metric for dp in message.datapoints] == ["b"]
+    assert resp.headers["X-Cursor"] == "2"
+
+
+def upload(*datapoints):
+    message = sf_pbuf.DataPointUploadMessage()
+    message.datapoints.extend(datapoints)
+    return message.SerializeToString()
+
+
+def test_iter_body_content_length():
+    rfile = io.BytesIO(b"0123456789next request")
+    assert list(iter_body(rfile, {"Content-Length": "10"}, chunk_size=4)) == [b"0123", b"4567", b"89"]
+    assert rfile.read() == b"next request"
+    assert list(iter_body(io.BytesIO(b""), {})) == []
+    with pytest.raises(ValueError):
+        list(iter_body(io.BytesIO(b"0123"), {"Content-Length": "10"}))
+
+
+def test_iter_body_chunked():
+    rfile = io.BytesIO(b"4\r\n0123\r\na;ext=1\r\n456789abcd\r\n0\r\nTrailer: x\r\n\r\nnext request")
+    assert list(iter_body(rfile, {"Transfer-Encoding": "chunked"})) == [b"0123", b"456789abcd"]
+    assert rfile.read() == b"next request"
+
+
+def test_gunzip_stream_multiple_members():
+    data = gzip.compress(b"first member, ") + gzip.compress(b"second member")
+    # Split so that a chunk holds the end of the first member and the start of the second
+    split = len(gzip.compress(b"first member, ")) - 3
+    chunks = [data[:split], data[split:split + 10], data[split + 10:]]
+    assert b"".join(gunzip_stream(chunks)) == b"first member, second member"
+    assert b"".join(gunzip_stream([data[i:i + 1] for i in range(len(data))])) == b"first member, second member"
+
+
+def test_post_gzip_and_chunked_on_one_connection(ingest):
+    server, url = ingest
+    conn = HTTPConnection("127.0.0.1", server.server_address[1], timeout=5)
+    try:
+        body = gzip.compress(upload(datapoint("a")))
+        conn.request("POST", "/v2/datapoint", body, {"Content-Encoding": "gzip",
+                                                     "Content-Type": "application/x-protobuf"})
+        resp = conn.getresponse()
+        assert (resp.status, resp.read()) == (200, b'"OK"')
+        sock = conn.sock
+
+        body = gzip.compress(upload(datapoint("b"))) + gzip.compress(upload(datapoint("c")))
+        conn.putrequest("POST", "/v2/datapoint")
+        conn.putheader("Content-Encoding", "gzip")
+        conn.putheader("Transfer-Encoding", "chunked")
+        conn.endheaders()
+        for i in range(0, len(body), 7):
+            chunk = body[i:i + 7]
+            conn.send(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        conn.send(b"0\r\n\r\n")
+        resp = conn.getresponse()
+        assert (resp.status, resp.read()) == (200, b'"OK"')
+        assert conn.sock is sock
+
+        conn.request("POST", "/v2/datapoint", b"not gzip", {"Content-Encoding": "gzip"})
+        resp = conn.getresponse()
+        resp.read()
+        assert resp.status == 400
+    finally:
+        conn.close()
+    assert [dp.metric for dp in server.datapoints.query()[0]] == ["a", "b", "c"]
+
+
+def test_post_truncated_body(ingest):
+    server, _ = ingest
+    with socket.create_connection(("127.0.0.1", server.server_address[1]), timeout=5) as sock:
+        sock.sendall(b"POST /v2/datapoint HTTP/1.1\r\nHost: localhost\r\nContent-Length: 100\r\n\r\n0123456789")
+        sock.shutdown(socket.SHUT_WR)
+        response = sock.makefile("rb").readline()
+    assert response.split()[1] == b"400"
+    assert len(server.datapoints) == 0
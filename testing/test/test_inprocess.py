@@ -0,0 +1,114 @@
+from threading import Thread
+import json
+
+import pytest
+import requests
+from signalfx.generated_protocol_buffers import signal_fx_protocol_buffers_pb2 as sf_pbuf
+
+from collectdtesting.assertions import has_datapoint_with_all_dims, has_datapoint_with_metric_name
+from collectdtesting.fake_ingest import collectd_json_to_datapoints, make_fake_ingest
+from collectdtesting.inprocess import run_collectd_in_process
+
+PLUGIN = '''
+import collectd
+
+from collectdutil.config import Config
+from collectdutil.metrics import Metric
+
+descriptors = {
+    'Name': ('name', 'default'),
+}
+
+
+def read(cfg):
+    Metric('queue.depth', 'gauge', 1.5, plugin='test_plugin', dimensions=dict(queue=cfg.name)).emit()
+    Metric('requests', 'derive', 7, plugin='test_plugin').emit()
+    collectd.info('read ' + cfg.name)
+
+
+def configure(conf):
+    collectd.register_read(read, data=Config(conf, descriptors=descriptors))
+
+
+collectd.register_config(configure)
+'''
+
+
+def dims_of(datapoint):
+    return {d.key: d.value for d in datapoint.dimensions}
+
+
+def test_collectd_json_to_datapoints():
+    payload = [{
+        "values": [1, 2.5, None],
+        "dstypes": ["derive", "gauge", "gauge"],
+        "dsnames": ["rx", "tx", "err"],
+        "time": 1500000000.5,
+        "interval": 10.0,
+        "host": "myhost[env=prod]",
+        "plugin": "interface",
+        "plugin_instance": "eth0[queue=q1,zone=a]",
+        "type": "if_octets",
+        "type_instance": "",
+    }]
+    rx, tx = collectd_json_to_datapoints(payload)
+    assert (rx.metric, tx.metric) == ("if_octets.rx", "if_octets.tx")
+    assert (rx.metricType, tx.metricType) == (sf_pbuf.CUMULATIVE_COUNTER, sf_pbuf.GAUGE)
+    assert (rx.value.intValue, tx.value.doubleValue) == (1, 2.5)
+    assert rx.timestamp == 1500000000500
+    assert dims_of(rx) == {"host": "myhost", "env": "prod", "plugin": "interface", "plugin_instance": "eth0",
+                           "queue": "q1", "zone": "a", "dsname": "rx"}
+
+    single = dict(payload[0], values=[3], dstypes=["gauge"], dsnames=["value"], type="gauge",
+                  type_instance="queue.depth", plugin_instance="")
+    datapoint, = collectd_json_to_datapoints([single])
+    assert datapoint.metric == "gauge.queue.depth"
+    assert "plugin_instance" not in dims_of(datapoint)
+
+
+def test_run_collectd_in_process(tmp_path):
+    (tmp_path / "test_plugin.py").write_text(PLUGIN)
+    with run_collectd_in_process('Name "first"', "test_plugin", plugin_dir=str(tmp_path)) as (ingest, collectd):
+        assert not has_datapoint_with_metric_name(ingest, "gauge.queue.depth")
+        assert collectd.run_reads(intervals=3) == 3
+        assert has_datapoint_with_metric_name(ingest, "gauge.queue.depth")
+        assert has_datapoint_with_metric_name(ingest, "derive.requests")
+        assert has_datapoint_with_all_dims(ingest, {"plugin": "test_plugin", "queue": "first"})
+        assert not has_datapoint_with_all_dims(ingest, {"queue": "second"})
+        assert len(ingest.datapoints) == 6
+        assert "read first" in collectd.logs()
+
+        collectd.reconfig('Name "second"')
+        collectd.run_reads()
+        assert has_datapoint_with_all_dims(ingest, {"plugin": "test_plugin", "queue": "second"})
+        assert ingest.stats["datapoints_by_plugin"] == {"test_plugin": 8}
+
+
+def test_writer_flushes_full_buffers(tmp_path):
+    (tmp_path / "test_plugin.py").write_text(PLUGIN)
+    with run_collectd_in_process('Name "first"', "test_plugin", plugin_dir=str(tmp_path), buffer_size=2) \
+            as (ingest, collectd):
+        collectd.runtime.run_reads(intervals=2)  # no explicit flush
+        assert len(ingest.datapoints) == 4
+
+
+@pytest.fixture
+def ingest_url():
+    server = make_fake_ingest("127.0.0.1", 0, threaded=True)
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield "http://127.0.0.1:%d" % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def test_post_collectd_json_and_stats(ingest_url):
+    payload = [{"values": [1], "dstypes": ["gauge"], "dsnames": ["value"], "time": 1500000000, "interval": 10,
+                "host": "h", "plugin": "p", "plugin_instance": "", "type": "gauge", "type_instance": "x"}]
+    assert requests.post(ingest_url + "/post-collectd", data=json.dumps(payload)).status_code == 200
+    assert requests.post(ingest_url + "/post-collectd", data=b"[{}]").status_code == 400
+    stats = requests.get(ingest_url + "/stats").json()
+    assert stats["requests"] == 2
+    assert stats["errors"] == 1
+    assert stats["datapoints_by_plugin"] == {"p": 1}
@@ -0,0 +1,125 @@
+"""
+Compares building Config objects with the previous Config constructor, which
+walked the descriptor and metric specifications on every build, against
+parsing with a ConfigSchema compiled once, and checks that both set the same
+attributes and that Config() is no slower than before.
+
+    PYTHONPATH=. python benchmarks/bench_config.py [descriptors] [repeat]
+"""
+import sys
+import timeit
+
+from collectdutil import fauxllectd
+
+sys.modules['collectd'] = fauxllectd
+
+from collectdutil.config import Config, ConfigSchema  # noqa: E402
+from collectdutil.utils import ParsedConfig  # noqa: E402
+
+
+class LegacyConfig(object):
+    """
+    The Config constructor that ConfigSchema replaced.
+    """
+
+    def __init__(self, config=None, descriptors=None, metrics=None):
+        descriptors = descriptors or {}
+        metrics = metrics or {}
+        # case insensitivity
+        self.descriptors = dict([(k.lower(), v) for k, v in descriptors.items()])
+        self.metrics = dict([(k.lower(), v) for k, v in metrics.items()])
+
+        self.extra_dimensions = {}
+
+        # Load defaults
+        for attr, val in self.descriptors.values():
+            setattr(self, attr, val)
+        for attr, val in self.metrics.items():
+            setattr(self, attr, val[2])
+        if not config:
+            return
+
+        seen = set()
+        for child in config.children:
+            descriptor = child.key.lower()
+            if descriptor == 'metric':
+                if not child.values:
+                    raise TypeError('Missing metric name provided in plugin config.')
+                metric = child.values[0].lower()
+                if metric not in self.metrics:
+                    fauxllectd.warning('Unsupported metric "{0}".'.format(metric))
+                    continue
+                if len(child.values) != 2:
+                    prefix = 'No boolean' if len(child.values) == 1 else 'Too many values'
+                    default = getattr(self, metric)
+                    fauxllectd.warning('{0} provided for Metric "{1}." Using default value {2}'
+                                       .format(prefix, metric, str(default).lower()))
+                else:
+                    setattr(self, metric, bool(child.values[1]))
+            else:
+                if descriptor == 'extradimension':
+                    if len(child.values) != 2:
+                        fauxllectd.warning('Invalid ExtraDimension values: {0}. Will not source.'
+                                           .format(str(child.values)))
+                        continue
+                    self.extra_dimensions[child.values[0]] = child.values[1]
+                    continue
+                if descriptor not in self.descriptors:
+                    fauxllectd.warning('Unsupported config descriptor "{0.key}".'.format(child))
+                    continue
+                attr = self.descriptors[descriptor][0]
+                if attr in seen:
+                    current = getattr(self, attr)
+                    current.append(child.values)
+                else:
+                    seen.add(attr)
+                    setattr(self, attr, [child.values])
+        for attr in seen:  # Single child values shouldn't be in lists
+            current = getattr(self, attr)
+            if len(current) == 1:
+                if len(current[0]) == 1:
+                    current = current[0]
+                setattr(self, attr, current[0])
+
+
+def build_specs(count):
+    descriptors = dict([('Descriptor{0}'.format(i), ('descriptor_{0}'.format(i), None)) for i in range(count)])
+    metrics = dict([('metric_{0}'.format(i), ('plugin.metric.{0}'.format(i), 'gauge', True)) for i in range(count)])
+    return descriptors, metrics
+
+
+def build_config(count):
+    lines = []
+    for i in range(count):
+        lines.append('Descriptor{0} "value_{0}" {0}'.format(i))
+        lines.append('Metric "metric_{0}" false'.format(i))
+        lines.append('ExtraDimension "dim_{0}" "value_{0}"'.format(i))
+    return ParsedConfig('\n'.join(lines))
+
+
+def main(specs=300, repeat=200):
+    descriptors, metrics = build_specs(specs)
+    conf = build_config(specs // 3)
+    schema = ConfigSchema(descriptors=descriptors, metrics=metrics)
+
+    legacy = LegacyConfig(conf, descriptors=descriptors, metrics=metrics)
+    parsed = schema.parse(conf)
+    attrs = [attr for attr, _ in legacy.descriptors.values()] + list(legacy.metrics) + ['extra_dimensions']
+    assert dict((a, getattr(parsed, a)) for a in attrs) == dict((a, getattr(legacy, a)) for a in attrs)
+
+    old = min(timeit.repeat(lambda: LegacyConfig(conf, descriptors=descriptors, metrics=metrics),
+                            number=repeat, repeat=3))
+    constructor = min(timeit.repeat(lambda: Config(conf, descriptors=descriptors, metrics=metrics),
+                                    number=repeat, repeat=3))
+    parse = min(timeit.repeat(lambda: schema.parse(conf), number=repeat, repeat=3))
+
+    print('{0} children, {1} descriptors, {1} metrics, {2} builds'.format(len(conf.children), specs, repeat))
+    print('previous Config():    {0:8.3f} ms/build'.format(old / repeat * 1000))
+    print('Config():             {0:8.3f} ms/build'.format(constructor / repeat * 1000))
+    print('ConfigSchema.parse(): {0:8.3f} ms/build'.format(parse / repeat * 1000))
+    print('speedup:              {0:8.2f}x (Config() {1:.2f}x)'.format(old / parse, old / constructor))
+    assert constructor <= old, 'Config() is slower than the previous constructor'
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
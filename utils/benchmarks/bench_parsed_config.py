@@ -0,0 +1,61 @@
+"""
+Compares ParsedConfig with the previous shlex-per-line implementation on a
+generated config, and checks that both produce the same values.
+
+    PYTHONPATH=. python benchmarks/bench_parsed_config.py [lines] [repeat]
+"""
+from shlex import shlex
+import sys
+import timeit
+
+from collectdutil.utils import ParsedConfig
+
+
+class ShlexChild(object):
+    """
+    The shlex based ParsedConfig.Child this replaced.
+    """
+
+    def __init__(self, properties_string):
+        boolean = dict(true=True, false=False)
+        sh = shlex(properties_string)
+        sh.whitespace_split = True
+        items = list(iter(sh.get_token, ''))
+        self.key = items[0]
+        self.values = items[1:]
+        for i, item in enumerate(self.values):
+            if '"' in item:
+                self.values[i] = item.replace('"', '')
+            elif item in ('true', 'false'):
+                self.values[i] = boolean[item]
+            else:
+                self.values[i] = float(item)
+
+
+def shlex_parse(config_string):
+    properties = [p.lstrip() for p in config_string.split('\n') if p.lstrip()]
+    return [ShlexChild(prop) for prop in properties]
+
+
+def build_config(lines):
+    templates = ('Host "host-{0}.example.com"', 'Port {0}', 'Enabled true', 'Databases "db{0}" "other {0}" false',
+                 'ExtraDimension "dim_{0}" "value_{0}"', 'Ratio -{0}.25')
+    return '\n'.join(['    ' + templates[i % len(templates)].format(i) for i in range(lines)])
+
+
+def main(lines=10000, repeat=5):
+    config_string = build_config(lines)
+    expected = [(c.key, c.values) for c in shlex_parse(config_string)]
+    assert [(c.key, c.values) for c in ParsedConfig(config_string).children] == expected
+
+    old = min(timeit.repeat(lambda: shlex_parse(config_string), number=repeat, repeat=3))
+    new = min(timeit.repeat(lambda: ParsedConfig(config_string), number=repeat, repeat=3))
+
+    print('{0} lines, {1} parses'.format(lines, repeat))
+    print('shlex:        {0:8.2f} ms/parse'.format(old / repeat * 1000))
+    print('ParsedConfig: {0:8.2f} ms/parse'.format(new / repeat * 1000))
+    print('speedup:      {0:8.2f}x'.format(old / new))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
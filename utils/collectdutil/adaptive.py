@@ -0,0 +1,170 @@
+"""
+Adaptive scheduling of the metric groups collected by one read callback.
+
+With a fixed read interval, expensive endpoints get polled as often as cheap
+ones.  An AdaptiveScheduler runs every group that changes on every interval,
+and samples groups that are slow-changing or costly less often, backing off
+up to `max_every` intervals between runs.
+
+metrics = {  # Config metrics spec, see collectdutil.config.Config
+    'heap_used': ('jvm.heap.used', 'gauge', True),
+    'gc_count': ('jvm.gc.count', 'counter', True),
+    'version': ('jvm.version', 'gauge', False),
+}
+
+def configure(conf):
+    cfg = Config(conf, metrics=metrics)
+    scheduler = AdaptiveScheduler(cfg, cost_budget=0.5)
+    scheduler.add_group('heap', fetch_heap_metrics, metrics=('heap_used', 'gc_count'))
+    scheduler.add_group('info', fetch_info_metrics, metrics=('version',), max_every=60)
+    scheduler.register(interval=10)
+"""
+from timeit import default_timer
+
+import collectd
+
+from .metrics import MetricBatch
+
+
+class MetricGroup(object):
+    """
+    A sub-collection of an AdaptiveScheduler along with its timing stats.
+    It runs once every `every` intervals.
+    """
+
+    def __init__(self, name, collect, metrics=(), min_every=1, max_every=16):
+        self.name = name
+        self.collect = collect
+        self.metrics = tuple([metric.lower() for metric in metrics])
+        self.min_every = min_every
+        self.max_every = max_every
+        self.every = min_every
+        self.countdown = 0
+        self.runs = 0
+        self.skips = 0
+        self.errors = 0
+        self.last_cost = 0.0
+        self.total_cost = 0.0
+        self.last_change = 0.0
+        self.last_values = {}
+
+    @property
+    def mean_cost(self):
+        return self.total_cost / self.runs if self.runs else 0.0
+
+    def __str__(self):
+        return ('MetricGroup(name={0}, every={1}, runs={2}, skips={3}, errors={4}, last_cost={5:.6f}, '
+                'mean_cost={6:.6f}, last_change={7:.2f})').format(self.name, self.every, self.runs, self.skips,
+                                                                  self.errors, self.last_cost, self.mean_cost,
+                                                                  self.last_change)
+
+    __repr__ = __str__
+
+
+class AdaptiveScheduler(object):
+    """
+    Runs metric groups from a single read callback at adaptive rates.
+
+    After each run of a group, the share of its series whose value changed
+    since its previous run is measured.  A group that changed more than
+    `change_threshold` and cost no more than `cost_budget` seconds goes back
+    to running every `min_every` intervals; otherwise its period doubles, up
+    to `max_every`.
+
+    If a Config is given, groups are declared with the names of its `metrics`
+    spec: a group whose metrics are all disabled is never run, and Metrics of
+    disabled metrics are not dispatched.
+
+    `timer` measures the cost of the groups and can be replaced by a fake
+    clock in tests.
+    """
+
+    def __init__(self, cfg=None, change_threshold=0.0, cost_budget=None, timer=default_timer):
+        self.cfg = cfg
+        self.change_threshold = change_threshold
+        self.cost_budget = cost_budget
+        self.timer = timer
+        self.groups = []
+
+    def add_group(self, name, collect, metrics=(), min_every=1, max_every=16):
+        """
+        Adds a group whose `collect()` returns an iterable of Metrics.
+        `metrics` are the names of the group's entries in the Config metrics
+        spec.
+        """
+        group = MetricGroup(name, collect, metrics, min_every, max_every)
+        self.groups.append(group)
+        return group
+
+    def _enabled(self, group):
+        if self.cfg is None or not group.metrics:
+            return True
+        return any(getattr(self.cfg, metric, False) for metric in group.metrics)
+
+    def _disabled_type_instances(self):
+        if self.cfg is None:
+            return frozenset()
+        return frozenset([spec[0] for metric, spec in self.cfg.metrics.items() if not getattr(self.cfg, metric)])
+
+    def read(self, *args):
+        """
+        The read callback: runs the groups that are due and dispatches their
+        Metrics in one batch.
+        """
+        disabled = self._disabled_type_instances()
+        batch = MetricBatch()
+        for group in self.groups:
+            if group.countdown > 0 or not self._enabled(group):
+                group.countdown -= 1
+                group.skips += 1
+                continue
+
+            start = self.timer()
+            try:
+                collected = list(group.collect())
+            except Exception as e:
+                group.errors += 1
+                group.countdown = group.every - 1
+                collectd.error('Failed collecting metric group {0}: {1!r}'.format(group.name, e))
+                continue
+            cost = self.timer() - start
+            group.runs += 1
+            group.last_cost = cost
+            group.total_cost += cost
+
+            values = {}
+            changed = 0
+            for metric in collected:
+                key = (metric.plugin_instance, metric.type, metric.type_instance, metric.encoded_dimensions)
+                values[key] = metric.value
+                if group.last_values.get(key) != metric.value:
+                    changed += 1
+                if metric.type_instance not in disabled:
+                    batch.add_metric(metric)
+            group.last_change = float(changed) / len(values) if values else 0.0
+            group.last_values = values
+
+            cheap = self.cost_budget is None or cost <= self.cost_budget
+            if group.last_change > self.change_threshold and cheap:
+                group.every = group.min_every
+            else:
+                group.every = min(group.every * 2, group.max_every)
+            group.countdown = group.every - 1
+        batch.dispatch()
+
+    def register(self, interval=None, name=None):
+        """
+        Registers read() as a collectd read callback.
+        """
+        kwargs = {}
+        if interval is not None:
+            kwargs['interval'] = interval
+        if name is not None:
+            kwargs['name'] = name
+        collectd.register_read(self.read, **kwargs)
+
+    def stats(self):
+        """
+        Returns the groups by name; see MetricGroup for their timing stats.
+        """
+        return dict([(group.name, group) for group in self.groups])
@@ -0,0 +1,124 @@
+"""
+Concurrent I/O for read callbacks using asyncio (Python 3 only).
+
+collectd's Python API is not async, so an event loop runs in a dedicated
+thread and read callbacks hand it coroutines, block until they have all
+finished or timed out, and dispatch the resulting Metrics themselves.  A read
+then takes about as long as its slowest target instead of the sum of all of
+them.
+
+collector = AsyncCollector(timeout=5)
+collectd.register_shutdown(collector.stop)
+
+def to_metrics(url, stats):
+    return [Metric('requests', 'counter', stats['requests'], dimensions=dict(url=url))]
+
+def read(conf):
+    fetches = dict([(url, fetch_stats(url)) for url in conf.urls])  # fetch_stats is a coroutine function
+    count, errors = collector.dispatch(fetches, to_metrics)
+"""
+import asyncio
+from concurrent.futures import Future
+from threading import Lock, Thread
+
+import collectd
+
+from .metrics import MetricBatch
+
+
+class AsyncCollector(object):
+
+    def __init__(self, timeout=None, name='collectdutil-asyncio'):
+        self.timeout = timeout
+        self.name = name
+        self._loop = None
+        self._thread = None
+        self._lock = Lock()
+
+    def start(self):
+        """
+        Starts the event loop thread.  This is done automatically by gather.
+        """
+        with self._lock:
+            if self._loop is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = Thread(target=self._run, args=(self._loop,), name=self.name)
+            self._thread.daemon = True
+            self._thread.start()
+
+    @staticmethod
+    def _run(loop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def stop(self, *args):
+        """
+        Stops the event loop thread.  Can be registered directly with
+        collectd.register_shutdown.
+        """
+        with self._lock:
+            loop, self._loop = self._loop, None
+            if loop is None:
+                return
+            loop.call_soon_threadsafe(loop.stop)
+            self._thread.join()
+            loop.close()
+
+    def gather(self, fetches, timeout=None):
+        """
+        Runs the coroutines in the `fetches` dict (target -> coroutine)
+        concurrently, each limited to `timeout` seconds (the collector's
+        timeout by default).  Blocks until all are done and returns
+        (results, errors) dicts keyed by target; targets that timed out have
+        an asyncio.TimeoutError in errors and their coroutine is cancelled.
+        """
+        self.start()
+        timeout = self.timeout if timeout is None else timeout
+        targets = list(fetches)
+        done = Future()
+
+        def finished(gathered):
+            try:
+                done.set_result(gathered.result())
+            except BaseException as e:
+                done.set_exception(e)
+
+        def schedule():
+            try:
+                gathered = asyncio.gather(*[asyncio.wait_for(fetches[target], timeout) for target in targets],
+                                          return_exceptions=True)
+            except BaseException as e:
+                done.set_exception(e)
+            else:
+                gathered.add_done_callback(finished)
+
+        self._loop.call_soon_threadsafe(schedule)
+        results = {}
+        errors = {}
+        for target, result in zip(targets, done.result()):
+            if isinstance(result, BaseException):
+                errors[target] = result
+            else:
+                results[target] = result
+        return results, errors
+
+    def dispatch(self, fetches, to_metrics, timeout=None):
+        """
+        Gathers the fetches, converts each result with
+        `to_metrics(target, result)`, which returns an iterable of Metrics,
+        and dispatches them from the calling thread in one MetricBatch.
+        Failed targets are logged.  Returns (dispatched count, errors).
+        """
+        results, errors = self.gather(fetches, timeout)
+        batch = MetricBatch()
+        for target, result in results.items():
+            for metric in to_metrics(target, result):
+                batch.add_metric(metric)
+        for target, error in errors.items():
+            if isinstance(error, asyncio.TimeoutError):
+                collectd.warning('Timed out fetching {0}'.format(target))
+            else:
+                collectd.warning('Failed fetching {0}: {1!r}'.format(target, error))
+        count, _ = batch.dispatch()
+        return count, errors
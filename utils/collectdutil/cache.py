@@ -0,0 +1,183 @@
+"""
+A TTL cache for expensive calls, such as the discovery of topics, databases or
+queues that many plugins repeat before fetching metrics on every read.
+
+Entries expire after a TTL (set per cache or per key).  An expired entry is
+still served for up to `max_stale` more seconds while a single background
+refresh runs (stale-while-revalidate).  Concurrent loads of the same key are
+deduplicated, so only one call is made and every caller gets its result.
+
+The cache can be configured from plugin config through descriptors:
+
+descriptors = dict(cache_descriptors('Discovery', ttl='5m'), **my_descriptors)
+
+def configure(conf):
+    cfg = Config(conf, descriptors=descriptors)
+    topics = TTLCache.from_config(cfg, 'Discovery')
+
+    def read():
+        for topic in topics.get('topics', list_topics):
+            ...
+"""
+from threading import Event, Lock, Thread
+import time as _time
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+import collectd
+
+from .config import to_duration, to_int
+
+
+def cache_descriptors(name, ttl=300, max_size=1024, max_stale=None):
+    """
+    Returns Config descriptor specs for the TTL, size and maximum staleness of
+    a cache called `name`, e.g. `DiscoveryTTL "5m"`, `DiscoveryCacheSize 100`
+    and `DiscoveryMaxStale "10m"` for 'Discovery'.
+    """
+    attr = name.lower()
+    return {
+        name + 'TTL': (attr + '_ttl', ttl, to_duration),
+        name + 'CacheSize': (attr + '_cache_size', max_size, to_int),
+        name + 'MaxStale': (attr + '_max_stale', max_stale, to_duration),
+    }
+
+
+class _Entry(object):
+    __slots__ = ('value', 'expires', 'refreshing')
+
+    def __init__(self, value, expires):
+        self.value = value
+        self.expires = expires
+        self.refreshing = False
+
+
+class _Flight(object):
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache(object):
+    """
+    A size-bounded LRU cache whose entries expire after `ttl` seconds.
+
+    get(key, loader) returns the cached value while it is fresh.  Once it has
+    expired it is still returned for up to `max_stale` seconds (the TTL by
+    default) while loader() runs once in the background to refresh it; after
+    that, or for a missing key, loader() is called in the caller's thread, and
+    concurrent callers for the same key wait for that single call.
+
+    `hits`, `stale_hits`, `misses`, `refreshes`, `errors` and `evictions`
+    count what happened, for sizing the cache and its TTLs.
+    """
+
+    def __init__(self, ttl=300, max_size=1024, max_stale=None, clock=_time.time):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_stale = ttl if max_stale is None else max_stale
+        self.clock = clock
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = Lock()
+
+    @classmethod
+    def from_config(cls, cfg, name, **kwargs):
+        """
+        Builds a cache from the attributes set by cache_descriptors(name).
+        """
+        attr = name.lower()
+        return cls(ttl=getattr(cfg, attr + '_ttl'), max_size=getattr(cfg, attr + '_cache_size'),
+                   max_stale=getattr(cfg, attr + '_max_stale'), **kwargs)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, loader, ttl=None):
+        """
+        Returns the value of `key`, calling `loader()` to load or refresh it
+        as needed.  `ttl` overrides the cache's TTL for this key.
+        """
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+                if now < entry.expires:
+                    self.hits += 1
+                    return entry.value
+                if now < entry.expires + self.max_stale:
+                    self.stale_hits += 1
+                    if not entry.refreshing:
+                        entry.refreshing = True
+                        self.refreshes += 1
+                        refresher = Thread(target=self._refresh, args=(key, loader, ttl, entry))
+                        refresher.daemon = True
+                        refresher.start()
+                    return entry.value
+
+            self.misses += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self.errors += 1
+            raise
+        else:
+            self._store(key, flight.value, ttl)
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.value
+
+    def _refresh(self, key, loader, ttl, entry):
+        try:
+            value = loader()
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+                entry.refreshing = False
+            collectd.warning('Failed refreshing cached {0!r}, serving the stale value: {1!r}'.format(key, e))
+            return
+        self._store(key, value, ttl)
+
+    def _store(self, key, value, ttl):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = _Entry(value, self.clock() + (self.ttl if ttl is None else ttl))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -4,6 +4,9 @@ Functions to help with collectd config objects.
 See https://collectd.org/documentation/manpages/collectd-python.5.shtml#config
 for a description of the config class passed into Python plugins by collectd.
 """
+import math
+import re
+
 import collectd
 
 
@@ -15,7 +18,8 @@ def simple_config_to_dict(conf):
     If a config key appears more than once, the value in the dict will be a
     list of all of its occurrances.
 
-    This does NOT support config instances with children config objects.
+    This does NOT support config instances with children config objects, use
+    config_to_dict for those.
     """
     out = {}
 
@@ -36,6 +40,215 @@ def simple_config_to_dict(conf):
     return out
 
 
+def config_to_dict(conf):
+    """
+    Converts a collectd config object, including any nested blocks, to a tree
+    of dictionaries.  Values are flattened like in simple_config_to_dict and
+    a key that appears more than once maps to a list of its occurrences.
+
+    A block becomes a dictionary of its own children.  Blocks with values, such
+    as `<Node "first">`, are grouped by those values under the block key:
+
+    Interval 10
+    <Node "first">
+      Host "one"
+    </Node>
+    <Node "second">
+      Host "two"
+    </Node>
+
+    assert config_to_dict(conf) == {
+        'Interval': 10,
+        'Node': {'first': {'Host': 'one'}, 'second': {'Host': 'two'}},
+    }
+
+    A labelled block without children becomes an empty dictionary.  Blocks
+    repeating a label are kept in a list under that label, with a warning.
+    """
+    out = {}
+    repeated = set()
+    duplicated = set()
+    labelled = _labelled_keys(conf.children)
+
+    for child in conf.children:
+        if child.key in labelled:
+            label = _flatten_values(child.values)
+            if isinstance(label, list):
+                label = tuple(label)
+            blocks = out.setdefault(child.key, {})
+            value = config_to_dict(child)
+            if label not in blocks:
+                blocks[label] = value
+                continue
+            collectd.warning('Duplicate <{0} {1!r}> block, keeping every instance in a list.'.format(child.key, label))
+            if (child.key, label) in duplicated:
+                blocks[label].append(value)
+            else:
+                blocks[label] = [blocks[label], value]
+                duplicated.add((child.key, label))
+            continue
+
+        if not child.children:
+            value = _flatten_values(child.values)
+        else:
+            value = config_to_dict(child)
+
+        if child.key not in out:
+            out[child.key] = value
+        elif child.key in repeated:
+            out[child.key].append(value)
+        else:
+            out[child.key] = [out[child.key], value]
+            repeated.add(child.key)
+
+    return out
+
+
+def _labelled_keys(children):
+    """
+    Returns the keys of the blocks grouped by label: every occurrence has
+    values and at least one has children.  Occurrences without children are
+    then empty blocks rather than plain values.
+    """
+    with_values = {}
+    with_children = set()
+    for child in children:
+        with_values[child.key] = with_values.get(child.key, True) and bool(child.values)
+        if child.children:
+            with_children.add(child.key)
+    return set([key for key in with_children if with_values[key]])
+
+
+def diff_config(previous, conf, depth=None):
+    """
+    Converts conf with config_to_dict and compares the result with the
+    previous tree.  Returns a (tree, changes) tuple where `changes` maps the
+    key path (a tuple) of every changed subtree to its new value, or to None
+    if it was removed.  Unchanged subtrees are left out.
+
+    Comparison descends into nested dictionaries, stopping at `depth` levels
+    if given, so on reload a plugin can restart only the instances that
+    changed:
+
+    tree, changes = diff_config(self.tree, conf, depth=2)
+    for (_, name), instance_conf in changes.items():  # e.g. ('Node', 'first')
+        restart_instance(name, instance_conf)
+    self.tree = tree
+    """
+    tree = config_to_dict(conf)
+    changes = {}
+    _diff_trees(previous or {}, tree, (), depth, changes)
+    return tree, changes
+
+
+def _flatten_values(values):
+    if len(values) == 1:
+        return values[0]
+    return list(values)
+
+
+def _diff_trees(old, new, path, depth, changes):
+    for key in set(old) | set(new):
+        key_path = path + (key,)
+        old_value = old.get(key)
+        new_value = new.get(key)
+        if (isinstance(old_value, dict) and isinstance(new_value, dict) and
+                (depth is None or len(key_path) < depth)):
+            _diff_trees(old_value, new_value, key_path, depth, changes)
+        elif key not in new:
+            changes[key_path] = None
+        elif key not in old or old_value != new_value:
+            changes[key_path] = new_value
+
+
+def to_int(value):
+    """
+    Coerces a config value to an int.  collectd passes numbers as floats, so
+    those are accepted as long as they are finite and have no fractional part.
+    """
+    number = float(value)
+    if math.isinf(number) or math.isnan(number):
+        raise ValueError('{0} is not a finite number'.format(value))
+    if number != int(number):
+        raise ValueError('{0} is not an integer'.format(value))
+    return int(number)
+
+
+def to_float(value):
+    """
+    Coerces a config value to a float.
+    """
+    return float(value)
+
+
+def to_bool(value):
+    """
+    Coerces a config value to a bool, accepting collectd booleans as well as
+    the usual string and numeric spellings.
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return value != 0
+    text = str(value).strip().lower()
+    if text in ('true', 'yes', 'on', '1'):
+        return True
+    if text in ('false', 'no', 'off', '0'):
+        return False
+    raise ValueError('{0} is not a boolean'.format(value))
+
+
+def to_str(value):
+    """
+    Coerces a config value to a string.
+    """
+    if isinstance(value, (list, tuple)):
+        raise ValueError('{0} is not a single value'.format(value))
+    return str(value)
+
+
+_duration_units = dict(ms=0.001, s=1, m=60, h=3600, d=86400)
+_duration_re = re.compile(r'^\s*(\d+(?:\.\d*)?|\.\d+)\s*(ms|s|m|h|d)?\s*$')
+
+
+def to_duration(value):
+    """
+    Coerces a config value to a number of seconds (float).  Accepts plain
+    numbers of seconds and strings such as "250ms", "10s", "5m", "1h" or "1d".
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    match = _duration_re.match(str(value))
+    if not match:
+        raise ValueError('{0} is not a duration'.format(value))
+    return float(match.group(1)) * _duration_units[match.group(2) or 's']
+
+
+def to_str_list(value):
+    """
+    Coerces a config value to a flat list of strings, so that `Key "a" "b"`,
+    repeated `Key "a"` lines and any mix of the two give the same shape.
+    """
+    if not isinstance(value, (list, tuple)):
+        return [str(value)]
+    out = []
+    for item in value:
+        out.extend(to_str_list(item))
+    return out
+
+
+def to_regex(value):
+    """
+    Coerces a config value to a compiled regular expression.
+    """
+    if hasattr(value, 'pattern'):
+        return value
+    return re.compile(to_str(value))
+
+
+_builtin_coercers = {int: to_int, float: to_float, bool: to_bool, str: to_str}
+
+
 class Config(object):
     """Defines behavior and metric default values and translates collectd plugin configurations to object attributes.
     Takes a collectd generated config object and descriptor and metric dictionary specifications of the form:
@@ -88,72 +301,179 @@ class Config(object):
     type_instance, metric_type = cfg.metrics['metric_one'][:-1]
 
     All descriptor and metric key values will be made lowercase for case insensitivity.
+
+    A descriptor specification can take a third item that coerces the configured value once, at config time, so read
+    callbacks get final typed values.  The builtins int, float, bool and str can be used, as well as to_duration,
+    to_str_list and to_regex.  Defaults are coerced the same way, and invalid values fall back to the default with a
+    warning:
+
+    <Module my_plugin>
+      Port "8080"
+      Timeout "1.5s"
+      Databases "one" "two"
+      Databases "three"
+      Include "^queue\\."
+    </Module>
+
+    descriptors = {
+        'Port': ('port', 80, int),
+        'Timeout': ('timeout', '10s', to_duration),
+        'Databases': ('databases', [], to_str_list),
+        'Include': ('include', '.*', to_regex),
+    }
+
+    cfg = Config(config, descriptors=descriptors)
+    assert cfg.port == 8080
+    assert cfg.timeout == 1.5
+    assert cfg.databases == ['one', 'two', 'three']
+    assert cfg.include.match('queue.depth')
+
+    The specifications are compiled into a ConfigSchema, which is cached for as long as the same, unchanged
+    specification dicts are passed.  ConfigSchema can also be used directly, see ConfigSchema.parse.
     """
 
     def __init__(self, config=None, descriptors=None, metrics=None):
+        _cached_schema(descriptors, metrics).populate(self, config)
+
+    def __str__(self):
+        descriptors = ['{0}: {1}'.format(v[0], getattr(self, v[0])) for v in self.descriptors.values()]
+        descriptors.sort()
+        cfg = 'Config: ' + '\n'.join(descriptors)
+        cfg += '\nMetrics: ' + '\n'.join(['{0}: {1}'.format(k, getattr(self, k)) for k in self.metrics])
+        return cfg
+
+    __repr__ = __str__
+
+
+# (id(descriptors), id(metrics)) to (descriptors, metrics, their copies, ConfigSchema) for Config()
+_schema_cache = {}
+_schema_cache_size = 32
+
+
+def _cached_schema(descriptors, metrics):
+    key = (id(descriptors), id(metrics))
+    entry = _schema_cache.get(key)
+    # The specs are kept so that their ids are not reused, and compared with their copies in case they were changed
+    if entry is not None and entry[0] is descriptors and entry[1] is metrics and entry[2] == descriptors \
+            and entry[3] == metrics:
+        return entry[4]
+    schema = ConfigSchema(descriptors, metrics)
+    if len(_schema_cache) >= _schema_cache_size:
+        _schema_cache.clear()
+    _schema_cache[key] = (descriptors, metrics, _copy(descriptors), _copy(metrics), schema)
+    return schema
+
+
+def _copy(specs):
+    return None if specs is None else dict(specs)
+
+
+class ConfigSchema(object):
+    """Compiles descriptor and metric specifications (see Config) once into a lookup table so that Config objects can
+    be built from collectd config objects in a single pass over the children.
+
+    schema = ConfigSchema(descriptors=descriptors, metrics=metrics)  # e.g. at module import
+
+    def configure(conf):
+        cfg = schema.parse(conf)  # same result as Config(conf, descriptors=descriptors, metrics=metrics)
+    """
+
+    def __init__(self, descriptors=None, metrics=None):
         descriptors = descriptors or {}
         metrics = metrics or {}
         # case insensitivity
         self.descriptors = dict([(k.lower(), v) for k, v in descriptors.items()])
         self.metrics = dict([(k.lower(), v) for k, v in metrics.items()])
 
-        self.extra_dimensions = {}
+        self._coercers = {}
+        self._defaults = []
+        for key, spec in self.descriptors.items():
+            attr, default = spec[:2]
+            if len(spec) > 2 and spec[2] is not None:
+                coercer = _builtin_coercers.get(spec[2], spec[2])
+                self._coercers[attr] = (key, coercer)
+                if default is not None:
+                    default = coercer(default)
+            self._defaults.append((attr, default))
+        self._defaults.extend([(attr, val[2]) for attr, val in self.metrics.items()])
+
+        self._handlers = dict([(key, (self._collect_descriptor, spec[0])) for key, spec in self.descriptors.items()])
+        self._handlers['metric'] = (self._parse_metric, None)
+        self._handlers['extradimension'] = (self._parse_extra_dimension, None)
+
+    def parse(self, config=None):
+        """
+        Returns a new Config built from the given collectd config object.
+        """
+        cfg = Config.__new__(Config)
+        self.populate(cfg, config)
+        return cfg
 
-        # Load defaults
-        for attr, val in self.descriptors.values():
-            setattr(self, attr, val)
-        for attr, val in self.metrics.items():
-            setattr(self, attr, val[2])
+    def populate(self, cfg, config=None):
+        """
+        Sets the defaults and the values from the collectd config object onto
+        an existing Config.
+        """
+        attrs = cfg.__dict__
+        attrs['descriptors'] = self.descriptors
+        attrs['metrics'] = self.metrics
+        attrs['extra_dimensions'] = {}
+        attrs.update(self._defaults)
         if not config:
             return
 
-        seen = set()
+        collected = {}
+        handlers = self._handlers
         for child in config.children:
-            descriptor = child.key.lower()
-            if descriptor == 'metric':
-                if not child.values:
-                    raise TypeError('Missing metric name provided in plugin config.')
-                metric = child.values[0].lower()
-                if metric not in self.metrics:
-                    collectd.warning('Unsupported metric "{0}".'.format(metric))
-                    continue
-                if len(child.values) != 2:
-                    prefix = 'No boolean' if len(child.values) == 1 else 'Too many values'
-                    default = getattr(self, metric)
-                    collectd.warning('{0} provided for Metric "{1}." Using default value {2}'
-                                     .format(prefix, metric, str(default).lower()))
-                else:
-                    setattr(self, metric, bool(child.values[1]))
-            else:
-                if descriptor == 'extradimension':
-                    if len(child.values) != 2:
-                        collectd.warning('Invalid ExtraDimension values: {0}. Will not source.'
-                                         .format(str(child.values)))
-                        continue
-                    self.extra_dimensions[child.values[0]] = child.values[1]
-                    continue
-                if descriptor not in self.descriptors:
-                    collectd.warning('Unsupported config descriptor "{0.key}".'.format(child))
-                    continue
-                attr = self.descriptors[descriptor][0]
-                if attr in seen:
-                    current = getattr(self, attr)
-                    current.append(child.values)
-                else:
-                    seen.add(attr)
-                    setattr(self, attr, [child.values])
-        for attr in seen:  # Single child values shouldn't be in lists
-            current = getattr(self, attr)
-            if len(current) == 1:
-                if len(current[0]) == 1:
-                    current = current[0]
-                setattr(self, attr, current[0])
+            handler = handlers.get(child.key.lower())
+            if handler is None:
+                collectd.warning('Unsupported config descriptor "{0.key}".'.format(child))
+                continue
+            handler[0](child, handler[1], attrs, collected)
 
-    def __str__(self):
-        descriptors = ['{0}: {1}'.format(v[0], getattr(self, v[0])) for v in self.descriptors.values()]
-        descriptors.sort()
-        cfg = 'Config: ' + '\n'.join(descriptors)
-        cfg += '\nMetrics: ' + '\n'.join(['{0}: {1}'.format(k, getattr(self, k)) for k in self.metrics])
-        return cfg
+        for attr, values in collected.items():  # Single child values shouldn't be in lists
+            if len(values) == 1:
+                values = values[0]
+                if len(values) == 1:
+                    values = values[0]
+            if attr in self._coercers:
+                values = self._coerce(attr, values, attrs[attr])
+            attrs[attr] = values
 
-    __repr__ = __str__
+    def _coerce(self, attr, value, default):
+        key, coercer = self._coercers[attr]
+        try:
+            return coercer(value)
+        except (TypeError, ValueError, OverflowError, re.error) as e:
+            collectd.warning('Invalid value {0} for descriptor "{1}": {2}. Using default value {3}'
+                             .format(value, key, e, default))
+            return default
+
+    @staticmethod
+    def _collect_descriptor(child, attr, attrs, collected):
+        values = collected.get(attr)
+        if values is None:
+            collected[attr] = [child.values]
+        else:
+            values.append(child.values)
+
+    def _parse_metric(self, child, _, attrs, collected):
+        if not child.values:
+            raise TypeError('Missing metric name provided in plugin config.')
+        metric = child.values[0].lower()
+        if metric not in self.metrics:
+            collectd.warning('Unsupported metric "{0}".'.format(metric))
+            return
+        if len(child.values) != 2:
+            prefix = 'No boolean' if len(child.values) == 1 else 'Too many values'
+            collectd.warning('{0} provided for Metric "{1}." Using default value {2}'
+                             .format(prefix, metric, str(attrs[metric]).lower()))
+        else:
+            attrs[metric] = bool(child.values[1])
+
+    @staticmethod
+    def _parse_extra_dimension(child, _, attrs, collected):
+        if len(child.values) != 2:
+            collectd.warning('Invalid ExtraDimension values: {0}. Will not source.'.format(str(child.values)))
+            return
+        attrs['extra_dimensions'][child.values[0]] = child.values[1]
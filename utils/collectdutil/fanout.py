@@ -0,0 +1,169 @@
+"""
+Fans a read callback's blocking work out over a shared, bounded thread pool.
+
+This is the simple alternative to collectdutil.aio for blocking client
+libraries: each target is fetched on a pool thread, the read waits until a
+deadline, stragglers are cancelled, and the results are merged in target order
+and dispatched in one batch from the read thread.
+
+pool = FanOut(max_workers=8, timeout=5)  # shut down by collectd's shutdown callbacks
+
+def to_metrics(host, stats):
+    return [Metric('connections', 'gauge', stats.connections, dimensions=dict(host=host))]
+
+def read(conf):
+    count, errors = pool.dispatch(fetch_stats, conf.hosts, to_metrics)
+    for host, stats in pool.stats.items():
+        ...  # stats.latency.percentile(99), stats.timeouts
+
+On Python 2 this needs the `futures` backport (the `fanout` extra).
+"""
+from threading import Lock
+from timeit import default_timer
+
+try:
+    from concurrent.futures import ThreadPoolExecutor, wait
+except ImportError:
+    raise ImportError('collectdutil.fanout needs the futures package on Python 2')
+
+import collectd
+
+from .histogram import DEFAULT_BUCKETS, Histogram
+from .metrics import MetricBatch
+
+
+class TimeoutExceeded(Exception):
+    """
+    The error reported for a target that did not finish before the deadline.
+    """
+
+
+class TargetStats(object):
+    __slots__ = ('calls', 'errors', 'timeouts', 'latency')
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.latency = Histogram(bounds)
+
+    def __str__(self):
+        return 'TargetStats(calls={0}, errors={1}, timeouts={2}, latency={3})'.format(
+            self.calls, self.errors, self.timeouts, self.latency)
+
+    __repr__ = __str__
+
+
+class FanOut(object):
+    """
+    A bounded pool of `max_workers` threads shared by any number of read
+    callbacks.  `timeout` is the default deadline, in seconds, of a run.
+    `stats` maps each target to its TargetStats.
+
+    The pool is created on first use, and its shutdown is registered with
+    collectd at the same time.
+    """
+
+    def __init__(self, max_workers=8, timeout=None, bounds=DEFAULT_BUCKETS):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.bounds = bounds
+        self.stats = {}
+        self._executor = None
+        self._pending = set()
+        self._lock = Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+                collectd.register_shutdown(self.shutdown)
+            return self._executor
+
+    def _target_stats(self, target):
+        stats = self.stats.get(target)
+        if stats is None:
+            stats = self.stats[target] = TargetStats(self.bounds)
+        return stats
+
+    def _call(self, func, target):
+        start = default_timer()
+        failed = True
+        try:
+            result = func(target)
+            failed = False
+            return result
+        finally:
+            elapsed = default_timer() - start
+            with self._lock:
+                stats = self._target_stats(target)
+                stats.calls += 1
+                stats.errors += failed
+                stats.latency.record(elapsed)
+
+    def run(self, func, targets, timeout=None):
+        """
+        Calls `func(target)` for every target on the pool and waits for them
+        until the deadline (`timeout` seconds, the pool's timeout by default).
+
+        Returns (results, errors): `results` is a list of (target, result)
+        tuples in the order of `targets`, and `errors` a dict of the exception
+        raised by each failed target.  Targets that missed the deadline get a
+        TimeoutExceeded error and are cancelled if they had not started yet;
+        ones already running finish in the background and are ignored.
+        """
+        executor = self._get_executor()
+        timeout = self.timeout if timeout is None else timeout
+        targets = list(targets)
+        futures = [executor.submit(self._call, func, target) for target in targets]
+        with self._lock:
+            self._pending.update(futures)
+        try:
+            wait(futures, timeout)
+        finally:
+            with self._lock:
+                self._pending.difference_update(futures)
+
+        results = []
+        errors = {}
+        for target, future in zip(targets, futures):
+            if not future.done():
+                future.cancel()
+                with self._lock:
+                    self._target_stats(target).timeouts += 1
+                errors[target] = TimeoutExceeded('{0} did not finish within {1} seconds'.format(target, timeout))
+            elif future.exception() is not None:
+                errors[target] = future.exception()
+            else:
+                results.append((target, future.result()))
+        return results, errors
+
+    def dispatch(self, func, targets, to_metrics, timeout=None):
+        """
+        Runs the targets, converts each result with `to_metrics(target,
+        result)`, which returns an iterable of Metrics, and dispatches them in
+        target order in one MetricBatch.  Failed targets are logged.  Returns
+        (dispatched count, errors).
+        """
+        results, errors = self.run(func, targets, timeout)
+        batch = MetricBatch()
+        for target, result in results:
+            for metric in to_metrics(target, result):
+                batch.add_metric(metric)
+        for target, error in errors.items():
+            collectd.warning('Failed fetching {0}: {1}'.format(target, error))
+        count, _ = batch.dispatch()
+        return count, errors
+
+    def shutdown(self, *args):
+        """
+        Cancels the queued work and stops the pool without waiting for calls
+        still running.  Registered with collectd.register_shutdown.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+            pending, self._pending = self._pending, set()
+        for future in pending:
+            future.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False)
@@ -3,41 +3,440 @@ from collectdutil import fauxllectd as collectd  # for any references in current
 import sys
 sys.modules['collectd'] = collectd
 
-Desired functionality beyond dummy functions TBD.
+This is a small in-process stand-in for the collectd runtime.  Registered
+callbacks are kept, dispatched Values are captured in a bounded ring buffer and
+read callbacks can be driven on a simulated clock, so a plugin's hot path can
+be exercised and timed without a real collectd:
+
+import my_plugin  # registers its config callback
+collectd.configure(ParsedConfig(config_string))
+collectd.init()
+collectd.run_reads(intervals=100)
+assert collectd.dispatch_count() > 0
+for name, stats in collectd.read_stats().items():
+    print(name, stats.calls, stats.elapsed / stats.calls)
+collectd.shutdown()
+collectd.reset()
 """
+from collections import deque, namedtuple
+from heapq import heappop, heappush
+from itertools import count
 import logging
+import random
+from threading import Condition, Lock, Thread
+from timeit import default_timer
+import time as _time
+
+from .histogram import DEFAULT_BUCKETS, Histogram
 
 
 log = logging.getLogger(__name__)
 
+# Default read interval in seconds, like collectd's global Interval option
+interval = 10.0
+
+Dispatched = namedtuple('Dispatched', 'host plugin plugin_instance type type_instance time interval values')
+
+
+class Callback(object):
+    """
+    A registered callback along with its user data.  Read callbacks also
+    track their schedule on the simulated clock and their call statistics.
+    """
+    __slots__ = ('name', 'function', 'data', 'interval', 'next_run', 'calls', 'errors', 'elapsed', 'max_elapsed')
+
+    def __init__(self, function, data=None, name=None, interval=None):
+        self.function = function
+        self.data = data
+        self.name = name or _callback_name(function)
+        self.interval = interval
+        self.next_run = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.elapsed = 0.0
+        self.max_elapsed = 0.0
+
+    def __call__(self, *args):
+        if self.data is not None:
+            args += (self.data,)
+        return self.function(*args)
+
+
+class _Runtime(object):
+
+    def __init__(self, buffer_size):
+        self.callbacks = dict([(kind, []) for kind in ('config', 'init', 'read', 'write', 'flush', 'shutdown',
+                                                       'log', 'notification')])
+        self.dispatched = deque(maxlen=buffer_size)
+        self.dispatch_count = 0
+        self.dispatch_lock = Lock()
+        self.clock = _time.time()
+
+
+_runtime = _Runtime(100000)
+
+
+def reset(buffer_size=100000, clock=None):
+    """
+    Drops every registered callback and captured value.  `buffer_size` is the
+    number of most recent dispatched values kept, and `clock` the starting time
+    of the simulated clock (defaults to now).
+    """
+    _runtime.__init__(buffer_size)
+    if clock is not None:
+        _runtime.clock = clock
+
+
+def now():
+    """
+    Returns the current time of the simulated clock.
+    """
+    return _runtime.clock
+
+
+def dispatched():
+    """
+    Returns the captured values, oldest first, as Dispatched tuples.
+    """
+    return list(_runtime.dispatched)
+
+
+def dispatch_count():
+    """
+    Returns the number of values dispatched since the last reset, including
+    those no longer in the ring buffer.
+    """
+    return _runtime.dispatch_count
+
+
+def clear_dispatched():
+    """
+    Empties the ring buffer and resets the dispatch count.
+    """
+    _runtime.dispatched.clear()
+    _runtime.dispatch_count = 0
+
 
 class Values(object):
+    _fields = ('type', 'values', 'plugin_instance', 'type_instance', 'plugin', 'host', 'time', 'interval', 'meta')
+
+    host = ''
+    plugin = ''
+    plugin_instance = ''
+    type = ''
+    type_instance = ''
+    time = 0
+    interval = 0
+    values = ()
+    meta = None
 
     def __init__(self, *args, **kwargs):
-        pass
+        for field, value in zip(self._fields, args):
+            setattr(self, field, value)
+        for field, value in kwargs.items():
+            setattr(self, field, value)
+
+    def dispatch(self, **kwargs):
+        if kwargs:
+            val = Values(**dict(self.__dict__, **kwargs))
+            return val.dispatch()
+
+        if not self.type:
+            raise RuntimeError('type not set')
+        with _runtime.dispatch_lock:
+            _runtime.dispatched.append(Dispatched(self.host, self.plugin, self.plugin_instance, self.type,
+                                                  self.type_instance, self.time or _runtime.clock, self.interval,
+                                                  tuple(self.values)))
+            _runtime.dispatch_count += 1
+        for callback in _runtime.callbacks['write']:
+            callback(self)
+
+    def write(self, **kwargs):
+        self.dispatch(**kwargs)
+
+    def __repr__(self):
+        return 'collectd.Values({0})'.format(', '.join(['{0}={1!r}'.format(field, getattr(self, field))
+                                                        for field in self._fields]))
+
+
+def _callback_name(function):
+    module = getattr(function, '__module__', None)
+    name = getattr(function, '__name__', None)
+    if module and name:
+        return 'python.{0}.{1}'.format(module, name)
+    return 'python.{0!r}'.format(function)
+
+
+def _register(kind, callback, data=None, name=None, **kwargs):
+    cb = Callback(callback, data, name, **kwargs)
+    _runtime.callbacks[kind].append(cb)
+    return cb.name
+
+
+def _unregister(kind, name_or_callback):
+    _runtime.callbacks[kind] = [cb for cb in _runtime.callbacks[kind]
+                                if name_or_callback not in (cb.name, cb.function)]
+
+
+def register_config(callback, data=None, name=None):
+    return _register('config', callback, data, name)
+
+
+def register_init(callback, data=None, name=None):
+    return _register('init', callback, data, name)
+
+
+def register_read(callback, interval=None, data=None, name=None):
+    name = _register('read', callback, data, name, interval=interval)
+    _runtime.callbacks['read'][-1].next_run = _runtime.clock
+    return name
+
+
+def register_write(callback, data=None, name=None):
+    return _register('write', callback, data, name)
+
+
+def register_flush(callback, data=None, name=None):
+    return _register('flush', callback, data, name)
+
 
-    def dispatch(self):
-        pass
+def register_shutdown(callback, data=None, name=None):
+    return _register('shutdown', callback, data, name)
 
 
-def register_config(*args, **kwargs):
-    pass
+def register_log(callback, data=None, name=None):
+    return _register('log', callback, data, name)
 
 
-def register_read(*args, **kwargs):
-    pass
+def register_notification(callback, data=None, name=None):
+    return _register('notification', callback, data, name)
 
 
-def register_flush(*args, **kwargs):
-    pass
+def unregister_config(name_or_callback):
+    _unregister('config', name_or_callback)
 
 
-def register_shutdown(*args, **kwargs):
-    pass
+def unregister_init(name_or_callback):
+    _unregister('init', name_or_callback)
 
 
-def register_log(*args, **kwargs):
-    pass
+def unregister_read(name_or_callback):
+    _unregister('read', name_or_callback)
+
+
+def unregister_write(name_or_callback):
+    _unregister('write', name_or_callback)
+
+
+def unregister_flush(name_or_callback):
+    _unregister('flush', name_or_callback)
+
+
+def unregister_shutdown(name_or_callback):
+    _unregister('shutdown', name_or_callback)
+
+
+def unregister_log(name_or_callback):
+    _unregister('log', name_or_callback)
+
+
+def unregister_notification(name_or_callback):
+    _unregister('notification', name_or_callback)
+
+
+def configure(config):
+    """
+    Passes a config object (e.g. a utils.ParsedConfig) to every registered
+    config callback, like collectd does for each <Module> block.
+    """
+    for callback in list(_runtime.callbacks['config']):
+        callback(config)
+
+
+def init():
+    for callback in list(_runtime.callbacks['init']):
+        callback()
+
+
+def run_reads(duration=None, intervals=1):
+    """
+    Advances the simulated clock by `duration` seconds, or by `intervals`
+    times the global interval, calling each read callback every time it is
+    due.  Callbacks are called in the order they become due and the wall time
+    they take is recorded (see read_stats).  Exceptions are logged and counted
+    like collectd does, without stopping the other callbacks.
+
+    Returns the number of read callback calls made.
+    """
+    if duration is None:
+        duration = intervals * interval
+    end = _runtime.clock + duration
+    calls = 0
+    while True:
+        reads = _runtime.callbacks['read']
+        if not reads:
+            break
+        callback = min(reads, key=lambda cb: cb.next_run)
+        if callback.next_run >= end:
+            break
+        _runtime.clock = max(_runtime.clock, callback.next_run)
+        callback.next_run += callback.interval or interval
+
+        start = default_timer()
+        try:
+            callback()
+        except Exception:
+            callback.errors += 1
+            log.exception('read-function of plugin `%s\' failed', callback.name)
+        elapsed = default_timer() - start
+        callback.calls += 1
+        callback.elapsed += elapsed
+        callback.max_elapsed = max(callback.max_elapsed, elapsed)
+        calls += 1
+    _runtime.clock = end
+    return calls
+
+
+def read_stats():
+    """
+    Returns the registered read Callbacks by name, which hold the `calls`,
+    `errors`, `elapsed` and `max_elapsed` statistics from run_reads.
+    """
+    return dict([(cb.name, cb) for cb in _runtime.callbacks['read']])
+
+
+class ReadStats(object):
+    """
+    Statistics for one read callback run by a ReadScheduler.  `missed` counts
+    the intervals that were skipped because the previous call ran past them,
+    and `timeouts` the calls that took longer than the scheduler's timeout.
+    """
+    __slots__ = ('calls', 'errors', 'timeouts', 'missed', 'latency')
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.missed = 0
+        self.latency = Histogram(bounds)
+
+    def __str__(self):
+        return 'ReadStats(calls={0}, errors={1}, timeouts={2}, missed={3}, latency={4})'.format(
+            self.calls, self.errors, self.timeouts, self.missed, self.latency)
+
+    __repr__ = __str__
+
+
+class ReadScheduler(object):
+    """
+    Runs the registered read callbacks in real time on a pool of threads, the
+    way collectd does with its `ReadThreads` option, so lock contention, GIL
+    behavior and reads that outlast their interval can be reproduced locally.
+
+    Like collectd, a callback is not run again until its previous call has
+    finished; if it finishes after its next due time, the skipped intervals
+    are counted as missed and it is rescheduled immediately.  Python code
+    cannot be interrupted, so a call exceeding `timeout` is only counted.
+
+    `jitter` delays every call by a random amount of up to that many seconds
+    without shifting the due times of the following calls, and `time_scale`
+    multiplies all intervals, e.g. 0.01 to run a plugin with 10 second
+    intervals every 100ms.
+
+    stats = ReadScheduler(read_threads=5, timeout=1).run(30)
+    for name, read in stats.items():
+        print(name, read.missed, read.latency.percentile(99))
+    """
+
+    def __init__(self, read_threads=5, jitter=0.0, timeout=None, time_scale=1.0, bounds=DEFAULT_BUCKETS,
+                 seed=None):
+        self.read_threads = read_threads
+        self.jitter = jitter
+        self.timeout = timeout
+        self.time_scale = time_scale
+        self.bounds = bounds
+        self._random = random.Random(seed)
+
+    def _jitter(self):
+        return self._random.uniform(0, self.jitter) if self.jitter else 0.0
+
+    def run(self, duration):
+        """
+        Runs the read callbacks for `duration` wall clock seconds and waits
+        for the calls still in progress.  Returns a dict of ReadStats by
+        callback name.
+        """
+        start = default_timer()
+        end = start + duration
+        sequence = count()
+        condition = Condition()
+        heap = []
+        stats = {}
+        for callback in _runtime.callbacks['read']:
+            stats[callback.name] = ReadStats(self.bounds)
+            heappush(heap, (start + self._jitter(), next(sequence), start, callback))
+
+        def work():
+            while True:
+                with condition:
+                    while True:
+                        now = default_timer()
+                        if now >= end:
+                            return
+                        if heap and heap[0][0] <= now:
+                            run_at, _, due, callback = heappop(heap)
+                            break
+                        condition.wait((heap[0][0] if heap and heap[0][0] < end else end) - now)
+
+                began = default_timer()
+                failed = False
+                try:
+                    callback()
+                except Exception:
+                    failed = True
+                    log.exception('read-function of plugin `%s\' failed', callback.name)
+                finished = default_timer()
+                elapsed = finished - began
+
+                read_interval = (callback.interval or interval) * self.time_scale
+                with condition:
+                    read = stats[callback.name]
+                    read.calls += 1
+                    read.errors += failed
+                    read.latency.record(elapsed)
+                    if self.timeout is not None and elapsed > self.timeout:
+                        read.timeouts += 1
+                        log.warning('read-function of plugin `%s\' took %.3f seconds, which is above its timeout',
+                                    callback.name, elapsed)
+                    next_run = due + read_interval
+                    # The jitter of this call does not count towards missing the next one
+                    late = finished - (run_at - due)
+                    if next_run < late:
+                        read.missed += int((late - next_run) / read_interval) + 1
+                        log.warning('read-function of plugin `%s\' took %.3f seconds, which is above its read '
+                                    'interval (%.3f)', callback.name, elapsed, read_interval)
+                        next_run = finished
+                    heappush(heap, (next_run + self._jitter(), next(sequence), next_run, callback))
+                    condition.notify()
+
+        workers = [Thread(target=work, name='reader#{0}'.format(i)) for i in range(self.read_threads)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+        _runtime.clock += duration
+        return stats
+
+
+def flush(timeout=-1, identifier=None):
+    for callback in list(_runtime.callbacks['flush']):
+        callback(timeout, identifier)
+
+
+def shutdown():
+    for callback in list(_runtime.callbacks['shutdown']):
+        callback()
 
 
 def debug(*args, **kwargs):
@@ -49,16 +448,12 @@ def info(*args, **kwargs):
 
 
 def notice(*args, **kwargs):
-    pass
+    log.info(*args, **kwargs)
 
 
 def warning(*args, **kwargs):
-    log.warn(*args, **kwargs)
+    log.warning(*args, **kwargs)
 
 
 def error(*args, **kwargs):
     log.error(*args, **kwargs)
-
-
-def register_notification(*args, **kwargs):
-    pass
@@ -0,0 +1,86 @@
+"""
+Fixed-bucket histograms for cheap latency tracking.
+
+Recording a value is a bisect over the bucket bounds plus a few additions, so
+it is cheap enough to sit on a plugin's hot path.  Percentiles are estimated
+from the bucket bounds, clipped to the smallest and largest recorded values.
+Histograms are not thread safe; guard them with a lock if they are shared.
+"""
+from bisect import bisect_left
+
+
+def exponential_buckets(start, factor, count):
+    """
+    Returns `count` bucket upper bounds starting at `start` and growing by
+    `factor` each time.
+    """
+    return [start * factor ** i for i in range(count)]
+
+
+# 100us to about 3.5 minutes, which covers any sensible read callback
+DEFAULT_BUCKETS = exponential_buckets(0.0001, 2, 22)
+
+
+class Histogram(object):
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """
+        Adds the counts of another histogram with the same bounds to this one.
+        """
+        if other.bounds != self.bounds:
+            raise ValueError('Cannot merge histograms with different buckets')
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percent):
+        """
+        Estimates the given percentile (0-100) as the upper bound of the bucket
+        it falls in.  Returns 0.0 if nothing was recorded.
+        """
+        if not self.count:
+            return 0.0
+        rank = percent / 100.0 * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if count and cumulative >= rank:
+                bound = self.bounds[i] if i < len(self.bounds) else self.max
+                return max(self.min, min(bound, self.max))
+        return self.max
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def __str__(self):
+        return 'Histogram(count={0}, mean={1:.6f}, p50={2:.6f}, p99={3:.6f}, max={4})'.format(
+            self.count, self.mean, self.percentile(50), self.percentile(99), self.max)
+
+    __repr__ = __str__
@@ -0,0 +1,235 @@
+"""
+Keep-alive HTTP connection pooling for plugins that poll HTTP endpoints.
+
+Opening a new connection per target per interval costs a TCP (and TLS)
+handshake every time.  A SessionManager keeps a bounded pool of keep-alive
+connections per host, evicts connections that sat idle for too long and checks
+that a pooled connection is still open before reusing it.
+
+sessions = SessionManager(max_per_host=4, idle_timeout=60, timeout=5)
+sessions.register()  # opened by collectd's init, closed by its shutdown
+
+def read(conf):
+    resp = sessions.get(conf.url + '/stats')
+    if resp.status == 200:
+        stats = json.loads(resp.body.decode('utf-8'))
+"""
+from collections import namedtuple
+import select
+from threading import BoundedSemaphore, Lock
+import time as _time
+
+try:
+    from http.client import HTTPConnection, HTTPException, HTTPSConnection
+except ImportError:
+    from httplib import HTTPConnection, HTTPException, HTTPSConnection
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+import collectd
+
+
+Response = namedtuple('Response', 'status reason headers body')
+
+
+class PoolTimeout(Exception):
+    """
+    No connection to the host became available in time.
+    """
+
+
+class _HostPool(object):
+
+    def __init__(self, max_size):
+        self.idle = []  # (connection, last used) tuples, most recently used last
+        self.slots = BoundedSemaphore(max_size)
+        self.lock = Lock()
+
+
+class SessionManager(object):
+    """
+    Pools keep-alive HTTP(S) connections per (scheme, host, port).
+
+    At most `max_per_host` connections to a host are in use at once; further
+    requests wait up to `timeout` seconds for one to be released.  Pooled
+    connections idle for more than `idle_timeout` seconds are closed, and one
+    the server has closed is detected before reuse and replaced.  A request on
+    a reused connection that fails because the server dropped it is retried
+    once on a new connection for idempotent methods.
+
+    `created`, `reused` and `evicted` count connections for sizing the pool.
+    """
+
+    idempotent_methods = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+    def __init__(self, max_per_host=4, idle_timeout=60, timeout=10, ssl_context=None):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+        self._pools = {}
+        self._lock = Lock()
+        self._closed = False
+
+    def register(self):
+        """
+        Registers the manager's open and close with collectd's init and
+        shutdown callbacks.
+        """
+        collectd.register_init(self.open)
+        collectd.register_shutdown(self.close)
+
+    def open(self, *args):
+        """
+        Allows connections to be pooled again after close.
+        """
+        self._closed = False
+
+    def close(self, *args):
+        """
+        Closes every idle connection.  Connections in use are closed when they
+        are released, until open is called again.
+        """
+        self._closed = True
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            with pool.lock:
+                idle, pool.idle = pool.idle, []
+            for conn, _ in idle:
+                conn.close()
+
+    def evict_idle(self, now=None):
+        """
+        Closes the pooled connections that were idle for more than
+        idle_timeout.  This also happens whenever a host's pool is used.
+        """
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            self._evict(pool, _time.time() if now is None else now)
+
+    def _evict(self, pool, now):
+        with pool.lock:
+            cutoff = now - self.idle_timeout
+            stale = [conn for conn, last_used in pool.idle if last_used < cutoff]
+            if stale:
+                pool.idle = [(conn, last_used) for conn, last_used in pool.idle if last_used >= cutoff]
+        for conn in stale:
+            conn.close()
+        self.evicted += len(stale)
+
+    def _pool(self, key):
+        pool = self._pools.get(key)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.setdefault(key, _HostPool(self.max_per_host))
+        return pool
+
+    @staticmethod
+    def _is_alive(conn):
+        sock = conn.sock
+        if sock is None:
+            return False
+        try:
+            # An idle keep-alive socket must not be readable: that means the
+            # server closed it or sent something unexpected.
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (ValueError, select.error):
+            return False
+        return not readable
+
+    def _new_connection(self, scheme, host, port):
+        self.created += 1
+        if scheme == 'https':
+            return HTTPSConnection(host, port, timeout=self.timeout, context=self.ssl_context)
+        return HTTPConnection(host, port, timeout=self.timeout)
+
+    def _acquire(self, pool, scheme, host, port):
+        self._evict(pool, _time.time())
+        while True:
+            with pool.lock:
+                if not pool.idle:
+                    break
+                conn, _ = pool.idle.pop()
+            if self._is_alive(conn):
+                self.reused += 1
+                return conn, True
+            conn.close()
+            self.evicted += 1
+        return self._new_connection(scheme, host, port), False
+
+    def _release(self, pool, conn):
+        if self._closed:
+            conn.close()
+            return
+        with pool.lock:
+            pool.idle.append((conn, _time.time()))
+
+    def request(self, method, url, body=None, headers=None):
+        """
+        Sends a request on a pooled connection and returns a Response with the
+        status, reason, headers (lowercased names) and the whole body.
+        """
+        parts = urlsplit(url)
+        scheme = parts.scheme or 'http'
+        if scheme not in ('http', 'https'):
+            raise ValueError('Unsupported URL scheme "{0}"'.format(scheme))
+        host = parts.hostname
+        port = parts.port or (443 if scheme == 'https' else 80)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        pool = self._pool((scheme, host, port))
+        if not _acquire_slot(pool.slots, self.timeout):
+            raise PoolTimeout('No connection to {0}:{1} available within {2} seconds'.format(host, port,
+                                                                                             self.timeout))
+        try:
+            conn, reused = self._acquire(pool, scheme, host, port)
+            while True:
+                try:
+                    conn.request(method, path, body, headers or {})
+                    resp = conn.getresponse()
+                    data = resp.read()
+                except (HTTPException, EnvironmentError):
+                    conn.close()
+                    if not reused or method.upper() not in self.idempotent_methods:
+                        raise
+                    # The server dropped a keep-alive connection, try once more on a fresh one
+                    conn, reused = self._new_connection(scheme, host, port), False
+                    continue
+                break
+
+            if resp.will_close:
+                conn.close()
+            else:
+                self._release(pool, conn)
+            return Response(resp.status, resp.reason, dict([(k.lower(), v) for k, v in resp.getheaders()]), data)
+        finally:
+            pool.slots.release()
+
+    def get(self, url, headers=None):
+        return self.request('GET', url, headers=headers)
+
+    def post(self, url, body, headers=None):
+        return self.request('POST', url, body=body, headers=headers)
+
+
+def _acquire_slot(semaphore, timeout):
+    if timeout is None:
+        return semaphore.acquire()
+    try:
+        return semaphore.acquire(timeout=timeout)
+    except TypeError:  # Python 2 has no acquire timeout
+        deadline = _time.time() + timeout
+        while not semaphore.acquire(False):
+            if _time.time() >= deadline:
+                return False
+            _time.sleep(0.01)
+        return True
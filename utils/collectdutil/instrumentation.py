@@ -0,0 +1,164 @@
+"""
+Opt-in timing of a plugin's hot path.
+
+Timers record call counts, cumulative time and a fixed-bucket latency
+histogram, and can be reported as internal metrics through the normal
+dispatch path so plugin overhead shows up next to the plugin's own metrics:
+
+from collectdutil.instrumentation import instrumentation
+
+instrumentation.enable_builtin_timers()  # metric dispatch, dimension encoding, Config parsing
+
+@instrumentation.timed('read')
+def read(conf):
+    with instrumentation.timed('fetch'):
+        stats = fetch(conf.url)
+    ...
+    instrumentation.report(plugin='my_plugin')
+
+Nothing is timed unless a timer is used or the built-in timers are enabled, so
+there is no overhead for plugins that do not opt in.
+"""
+from functools import wraps
+from threading import Lock
+from timeit import default_timer
+
+from . import config, metrics
+from .histogram import DEFAULT_BUCKETS, Histogram
+
+
+class Timer(object):
+    """
+    The statistics of a single named timer.  `calls` and `total` are
+    cumulative, while `latency` only covers the calls since the last report.
+    """
+    __slots__ = ('calls', 'total', 'latency')
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.calls = 0
+        self.total = 0.0
+        self.latency = Histogram(bounds)
+
+
+class _Timed(object):
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = default_timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instrumentation.record(self.name, default_timer() - self.start)
+
+    def __call__(self, func):
+        record = self.instrumentation.record
+        name = self.name
+
+        @wraps(func)
+        def timed(*args, **kwargs):
+            start = default_timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, default_timer() - start)
+
+        return timed
+
+
+class Instrumentation(object):
+
+    # (owner, attribute, timer name) of the functions wrapped by enable_builtin_timers
+    builtin_timers = (
+        (metrics.Metric, 'emit', 'metric.emit'),
+        (metrics.MetricBatch, 'dispatch', 'metric_batch.dispatch'),
+        (metrics.MetricFrame, 'emit', 'metric_frame.emit'),
+        (metrics.EncodingCache, 'encode', 'encode_dimensions'),
+        (metrics, 'encode_dimensions', 'encode_dimensions.miss'),
+        (config.ConfigSchema, 'populate', 'config.parse'),
+    )
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.timers = {}
+        self._lock = Lock()
+        self._originals = []
+
+    def record(self, name, elapsed):
+        """
+        Records a single timing, in seconds, for the named timer.
+        """
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = Timer(self.bounds)
+            timer.calls += 1
+            timer.total += elapsed
+            timer.latency.record(elapsed)
+
+    def timed(self, name):
+        """
+        Returns an object that times the named operation, either as a `with`
+        block or as a function decorator.
+        """
+        return _Timed(self, name)
+
+    def enable_builtin_timers(self):
+        """
+        Wraps the dispatch of Metrics, MetricBatches and MetricFrames,
+        dimension encoding (every call, and the cache misses that actually
+        encode) and Config parsing with timers.
+        """
+        if self._originals:
+            return
+        for owner, attr, name in self.builtin_timers:
+            original = owner.__dict__[attr]
+            self._originals.append((owner, attr, original))
+            setattr(owner, attr, self.timed(name)(original))
+
+    def disable_builtin_timers(self):
+        """
+        Restores the functions wrapped by enable_builtin_timers.
+        """
+        while self._originals:
+            owner, attr, original = self._originals.pop()
+            setattr(owner, attr, original)
+
+    def report(self, plugin='collectdutil', plugin_instance='', dimensions=None, interval=None):
+        """
+        Dispatches every timer as internal metrics and starts a new latency
+        window.  For a timer named `read` these are the `read.calls` and
+        `read.time_us` counters and the `read.p50` and `read.p99` gauges (in
+        seconds, over the calls since the previous report).
+
+        Returns the (count, elapsed seconds) of the dispatch.
+        """
+        snapshot = []
+        with self._lock:
+            for name, timer in self.timers.items():
+                percentiles = None
+                if timer.latency.count:
+                    percentiles = (timer.latency.percentile(50), timer.latency.percentile(99))
+                snapshot.append((name, timer.calls, timer.total, percentiles))
+                timer.latency.reset()
+
+        # Built outside the lock, since the built-in timers record while encoding the dimensions
+        batch = metrics.MetricBatch(plugin=plugin, plugin_instance=plugin_instance, interval=interval)
+        for name, calls, total, percentiles in snapshot:
+            batch.add(name + '.calls', 'counter', calls, dimensions=dimensions)
+            batch.add(name + '.time_us', 'counter', int(round(total * 1000000)), dimensions=dimensions)
+            if percentiles is not None:
+                batch.add(name + '.p50', 'gauge', percentiles[0], dimensions=dimensions)
+                batch.add(name + '.p99', 'gauge', percentiles[1], dimensions=dimensions)
+        return batch.dispatch()
+
+    def reset(self):
+        with self._lock:
+            self.timers.clear()
+
+
+# Shared by the plugins of a process that do not need separate instrumentation
+instrumentation = Instrumentation()
@@ -1,6 +1,22 @@
 """
 Common utility functions for dealing with metrics in collectd
 """
+from array import array
+import hashlib
+import math
+from threading import Lock
+import time as _time
+from timeit import default_timer
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+try:
+    from itertools import izip as zip
+except ImportError:
+    pass
 
 # This is only available when run in the collectd embedded python interpreter
 import collectd
@@ -10,6 +26,8 @@ plugin_instance_max_length = 1024
 
 
 class Metric(object):
+    __slots__ = ('type_instance', 'type', 'value', 'plugin', 'plugin_instance', 'host', 'time', 'interval',
+                 'dimensions', 'encoded_dimensions')
 
     def __init__(self, type_instance, type, value, plugin='', plugin_instance='', dimensions=None, host='',
                  time=None, interval=None):
@@ -24,8 +42,8 @@ class Metric(object):
         self.dimensions = dimensions or {}
         self.encoded_dimensions = ''
         if self.dimensions:
-            self.encoded_dimensions = encode_dimensions(self.dimensions,
-                                                        plugin_instance_max_length - len(plugin_instance) - 2)
+            self.encoded_dimensions = encoding_cache.encode(self.dimensions,
+                                                            plugin_instance_max_length - len(plugin_instance) - 2)
 
     def emit(self):
         kw = dict(plugin=self.plugin, plugin_instance=self.plugin_instance, type_instance=self.type_instance,
@@ -50,6 +68,213 @@ class Metric(object):
     __repr__ = __str__
 
 
+class MetricBatch(object):
+    """
+    Collects the datapoints of a read and dispatches them in a single pass.
+
+    One collectd.Values object is created per (plugin, plugin_instance, type)
+    group and only the per-datapoint fields are updated before each dispatch,
+    so no Metric or Values object is built for every individual value.
+
+    batch = MetricBatch(plugin='my_plugin')
+    batch.add('requests', 'counter', 123, dimensions=dict(queue='a'))
+    batch.add_metric(Metric('latency', 'gauge', 0.5, plugin='my_plugin'))
+    count, elapsed = batch.dispatch()
+
+    `dispatched` and `elapsed` hold the running totals over every dispatch of
+    the batch.
+    """
+
+    def __init__(self, plugin='', plugin_instance='', host='', time=None, interval=None):
+        self.plugin = plugin
+        self.plugin_instance = plugin_instance
+        self.host = host
+        self.time = time
+        self.interval = interval
+        self.dispatched = 0
+        self.elapsed = 0.0
+        self._groups = {}
+
+    def __len__(self):
+        return sum(len(records) for records in self._groups.values())
+
+    def add(self, type_instance, type, value, dimensions=None, plugin=None, plugin_instance=None, host=None,
+            time=None, interval=None):
+        """
+        Queues a single value.  Any of plugin, plugin_instance, host, time and
+        interval that are not given fall back to the batch's values.
+        """
+        plugin = self.plugin if plugin is None else plugin
+        plugin_instance = self.plugin_instance if plugin_instance is None else plugin_instance
+        if dimensions:
+            encoded = encoding_cache.encode(dimensions, plugin_instance_max_length - len(plugin_instance) - 2)
+            plugin_instance += '[{0}]'.format(encoded)
+        self._append(plugin, plugin_instance, type, type_instance, value,
+                     self.host if host is None else host,
+                     self.time if time is None else time,
+                     self.interval if interval is None else interval)
+
+    def add_metric(self, metric):
+        """
+        Queues an already built Metric.
+        """
+        plugin_instance = metric.plugin_instance
+        if metric.encoded_dimensions:
+            plugin_instance += '[{0.encoded_dimensions}]'.format(metric)
+        self._append(metric.plugin, plugin_instance, metric.type, metric.type_instance, metric.value,
+                     metric.host, metric.time, metric.interval)
+
+    def _append(self, plugin, plugin_instance, type, type_instance, value, host, time, interval):
+        key = (plugin, plugin_instance, type)
+        records = self._groups.get(key)
+        if records is None:
+            records = self._groups[key] = []
+        # collectd treats an empty host and a zero time/interval as "use the default"
+        records.append((type_instance, [value], host or '', time or 0, interval or 0))
+
+    def dispatch(self):
+        """
+        Dispatches and clears every queued value.  Returns a (count, elapsed
+        seconds) tuple for this dispatch.
+        """
+        groups, self._groups = self._groups, {}
+        count = 0
+        start = default_timer()
+        for (plugin, plugin_instance, type), records in groups.items():
+            val = collectd.Values(plugin=plugin, plugin_instance=plugin_instance, type=type)
+            val.meta = dict(_=0)
+            dispatch = val.dispatch
+            for type_instance, values, host, time, interval in records:
+                val.type_instance = type_instance
+                val.values = values
+                val.host = host
+                val.time = time
+                val.interval = interval
+                dispatch()
+            count += len(records)
+        elapsed = default_timer() - start
+        self.dispatched += count
+        self.elapsed += elapsed
+        return count, elapsed
+
+
+class MetricFrame(object):
+    """
+    Columnar storage for an interval's worth of metrics that share the same
+    plugin, plugin_instance, host, time and interval.
+
+    Values are kept in an array('d') and the type, type_instance and dimension
+    set of each row are kept as ids into intern tables, so a staged row costs a
+    few bytes instead of a Metric object, its dimension dict and its encoded
+    string.  Each distinct dimension set is encoded once.
+
+    frame = MetricFrame(plugin='my_plugin')
+    for queue, depth in depths.items():
+        frame.add('queue.depth', 'gauge', depth, dimensions=dict(queue=queue))
+    count, elapsed = frame.emit()
+
+    Values are stored as doubles, so counters above 2**53 lose precision.
+    """
+
+    def __init__(self, plugin='', plugin_instance='', host='', time=None, interval=None):
+        self.plugin = plugin
+        self.plugin_instance = plugin_instance
+        self.host = host
+        self.time = time
+        self.interval = interval
+        self.values = array('d')
+        self._type_ids = array('i')
+        self._type_instance_ids = array('i')
+        self._dimension_ids = array('i')
+        self._strings = []
+        self._string_ids = {}
+        self._encoded_dimensions = ['']
+        self._dimension_set_ids = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def _intern(self, string):
+        string_id = self._string_ids.get(string)
+        if string_id is None:
+            string_id = self._string_ids[string] = len(self._strings)
+            self._strings.append(string)
+        return string_id
+
+    def _dimension_set_id(self, dimensions):
+        if not dimensions:
+            return 0
+        max_len = plugin_instance_max_length - len(self.plugin_instance) - 2
+        key = tuple(dimensions.items())
+        try:
+            dimension_id = self._dimension_set_ids.get(key)
+        except TypeError:  # unhashable dimension values, encoded without interning
+            self._encoded_dimensions.append(encoding_cache.encode(dimensions, max_len))
+            return len(self._encoded_dimensions) - 1
+        if dimension_id is None:
+            dimension_id = self._dimension_set_ids[key] = len(self._encoded_dimensions)
+            self._encoded_dimensions.append(encoding_cache.encode(dimensions, max_len))
+        return dimension_id
+
+    def add(self, type_instance, type, value, dimensions=None):
+        """
+        Stages a single row.
+        """
+        self.values.append(value)
+        self._type_ids.append(self._intern(type))
+        self._type_instance_ids.append(self._intern(type_instance))
+        self._dimension_ids.append(self._dimension_set_id(dimensions))
+
+    def emit(self):
+        """
+        Dispatches every staged row in order, reusing one collectd.Values per
+        (dimension set, type) pair.  Returns a (count, elapsed seconds) tuple.
+        """
+        start = default_timer()
+        strings = self._strings
+        plugin_instances = [self.plugin_instance + '[{0}]'.format(encoded) if encoded else self.plugin_instance
+                            for encoded in self._encoded_dimensions]
+        kw = dict(plugin=self.plugin)
+        for attr in ('time', 'host', 'interval'):
+            val = getattr(self, attr)
+            if val is not None:
+                kw[attr] = val
+
+        templates = {}
+        rows = zip(self.values, self._type_ids, self._type_instance_ids, self._dimension_ids)
+        for value, type_id, type_instance_id, dimension_id in rows:
+            val = templates.get((dimension_id, type_id))
+            if val is None:
+                val = templates[(dimension_id, type_id)] = collectd.Values(
+                    plugin_instance=plugin_instances[dimension_id], type=strings[type_id], **kw)
+                val.meta = dict(_=0)
+            val.type_instance = strings[type_instance_id]
+            val.values = [value]
+            val.dispatch()
+        return len(self.values), default_timer() - start
+
+    def clear(self):
+        """
+        Drops every staged row while keeping the intern tables, which are
+        usually still valid for the next interval.
+        """
+        del self.values[:]
+        del self._type_ids[:]
+        del self._type_instance_ids[:]
+        del self._dimension_ids[:]
+
+
+def dispatch_many(metrics):
+    """
+    Dispatches an iterable of Metric objects through a MetricBatch.  Returns a
+    (count, elapsed seconds) tuple.
+    """
+    batch = MetricBatch()
+    for metric in metrics:
+        batch.add_metric(metric)
+    return batch.dispatch()
+
+
 def dispatch_values(values=None, dimensions=None,
                     plugin=None, plugin_instance=None,
                     type=None, type_instance=None,
@@ -59,10 +284,19 @@ def dispatch_values(values=None, dimensions=None,
     Dispatch a collectd value list with the given fields, using the special
     SignalFx dimension encoding.
     """
+    plugin_instance = plugin_instance or ''
+    if dimensions:
+        encoded = encoding_cache.encode(dimensions, plugin_instance_max_length - len(plugin_instance) - 2)
+        plugin_instance += '[{0}]'.format(encoded)
 
-    value = Metric(host=host, plugin=plugin, plugin_instance=plugin_instance, time=time, type=type,
-                   dimensions=dimensions, type_instance=type_instance, values=values, interval=interval)
-    value.emit()
+    kw = dict(plugin=plugin or '', plugin_instance=plugin_instance, type=type, type_instance=type_instance or '',
+              values=values)
+    for attr, val in (('time', time), ('host', host), ('interval', interval)):
+        if val is not None:
+            kw[attr] = val
+    val = collectd.Values(**kw)
+    val.meta = dict(_=0)
+    val.dispatch()
 
 
 def dispatch_datapoint(metric_name, value, dimensions, plugin):
@@ -74,16 +308,588 @@ def dispatch_datapoint(metric_name, value, dimensions, plugin):
                            plugin=plugin, type=metric_name)
 
 
-def encode_dimensions(dimensions=None, max_len=plugin_instance_max_length - 2):
+def encode_dimensions(dimensions=None, max_len=plugin_instance_max_length - 2, encoder=None):
     """
     Encodes a dictionary of key/value pairs as a comma-delimited list of
     key=value tokens.  This string is suitable for use in the `[]` suffix
     syntax in `plugin_instance`, `host`, and `type_instance` fields.
+
+    `encoder` is a DimensionEncoder that decides the order of the pairs and
+    what to do when they don't fit in max_len.  By default the dict order is
+    kept and the string is cut at max_len.
     """
     if dimensions:
-        encoded_dimensions = ','.join(['='.join((str(k), str(v))) for (k, v) in dimensions.items()])
-        if len(encoded_dimensions) > max_len:
-            collectd.warning('Truncating encoded dimensions: {0}'.format(encoded_dimensions))
-            encoded_dimensions = encoded_dimensions[:max_len]
-        return encoded_dimensions
+        return (encoder or default_encoder).encode(dimensions, max_len)
     return ''
+
+
+class DimensionEncoder(object):
+    """
+    A dimension encoding strategy.
+
+    `order` is either 'insertion' (the dict order) or 'sorted' (by key), which
+    always gives the same string for the same dimensions no matter how the dict
+    was built, so it caches well.  Keys listed in `priority` are placed first,
+    in that order.
+
+    `overflow` decides what happens when the encoded pairs don't fit in
+    max_len:
+     - 'truncate' cuts the string at max_len, which can split a pair in half
+     - 'drop' leaves out whole pairs, starting with the last ones
+     - 'hash' replaces the pairs that don't fit by a single
+       `<hash_key>=<digest>` pair, so the series stays unique
+
+    The cost is linear in the size of the dimensions, plus the sort for
+    'sorted'.
+
+    encoder = DimensionEncoder(order='sorted', priority=('host',), overflow='hash')
+    encoding_cache.set_encoder(encoder)  # used by Metric, MetricBatch and dispatch_values
+    """
+
+    def __init__(self, order='insertion', priority=(), overflow='truncate', hash_key='dims_hash', digest_size=12):
+        if order not in ('insertion', 'sorted'):
+            raise ValueError('Unknown dimension order "{0}"'.format(order))
+        if overflow not in ('truncate', 'drop', 'hash'):
+            raise ValueError('Unknown dimension overflow strategy "{0}"'.format(overflow))
+        self.order = order
+        self.priority = tuple(priority)
+        self.overflow = overflow
+        self.hash_key = hash_key
+        self.digest_size = digest_size
+
+    def pairs(self, dimensions):
+        """
+        Returns the encoded `key=value` strings in encoding order.
+        """
+        items = dimensions.items()
+        if self.order == 'sorted':
+            items = sorted(items, key=lambda item: str(item[0]))
+        if self.priority:
+            first = [(k, dimensions[k]) for k in self.priority if k in dimensions]
+            items = first + [item for item in items if item[0] not in self.priority]
+        return ['='.join((str(k), str(v))) for (k, v) in items]
+
+    def encode(self, dimensions, max_len=plugin_instance_max_length - 2):
+        pairs = self.pairs(dimensions)
+        encoded = ','.join(pairs)
+        if len(encoded) <= max_len:
+            return encoded
+
+        if self.overflow == 'truncate':
+            collectd.warning('Truncating encoded dimensions: {0}'.format(encoded))
+            return encoded[:max_len]
+
+        budget = max_len
+        if self.overflow == 'hash':
+            budget -= len(self.hash_key) + self.digest_size + 2  # ',' + '='
+        kept = []
+        overflow = []
+        length = -1  # no comma before the first pair
+        for pair in pairs:
+            if length + len(pair) + 1 <= budget:
+                kept.append(pair)
+                length += len(pair) + 1
+            else:
+                overflow.append(pair)
+
+        if self.overflow == 'hash':
+            digest = hashlib.sha1(','.join(overflow).encode('utf-8')).hexdigest()[:self.digest_size]
+            kept.append('{0}={1}'.format(self.hash_key, digest))
+            collectd.warning('Hashing encoded dimensions that do not fit: {0}'.format(','.join(overflow)))
+        else:
+            collectd.warning('Dropping encoded dimensions that do not fit: {0}'.format(','.join(overflow)))
+        return ','.join(kept)[:max_len]
+
+
+default_encoder = DimensionEncoder()
+
+
+class EncodingCache(object):
+    """
+    A bounded LRU cache of encoded dimension strings, keyed on the dimension
+    items and the length budget.  Series sets are mostly stable between reads,
+    so most lookups skip the join and string conversion entirely.  A
+    truncation warning is only logged when a key is encoded, i.e. once per
+    distinct key rather than on every interval.
+
+    `hits`, `misses` and `evictions` can be used to size the cache.  A size of
+    0 disables caching.  Misses are encoded with `encoder`, a DimensionEncoder
+    (see encode_dimensions).
+    """
+
+    def __init__(self, size=4096, encoder=None):
+        self.size = size
+        self.encoder = encoder
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def encode(self, dimensions=None, max_len=plugin_instance_max_length - 2):
+        """
+        Same as encode_dimensions, but memoized.
+        """
+        if not dimensions:
+            return ''
+        try:
+            key = (tuple(dimensions.items()), max_len)
+            hash(key)
+        except TypeError:  # unhashable dimension values
+            return encode_dimensions(dimensions, max_len, self.encoder)
+
+        with self._lock:
+            encoded = self._entries.pop(key, None)
+            if encoded is not None:
+                self._entries[key] = encoded
+                self.hits += 1
+                return encoded
+            self.misses += 1
+
+        encoded = encode_dimensions(dimensions, max_len, self.encoder)
+        if self.size > 0:
+            with self._lock:
+                self._entries[key] = encoded
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return encoded
+
+    def resize(self, size):
+        """
+        Changes the maximum number of cached keys, evicting the least recently
+        used ones if the cache is now too big.
+        """
+        with self._lock:
+            self.size = size
+            while len(self._entries) > max(size, 0):
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def set_encoder(self, encoder):
+        """
+        Switches to another DimensionEncoder, dropping the cached entries that
+        were encoded with the previous one.
+        """
+        with self._lock:
+            self.encoder = encoder
+            self._entries.clear()
+
+    def clear(self):
+        """
+        Drops every cached entry and resets the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+
+# Shared by Metric, MetricBatch and dispatch_values
+encoding_cache = EncodingCache()
+
+
+class RateTracker(object):
+    """
+    Turns cumulative counters into deltas or per-second rates, keeping the
+    previous sample of each series.
+
+    Series are keyed by (plugin_instance, type, type_instance, encoded
+    dimensions).  Previous samples are stored in two array('d') columns with a
+    dict of slot indexes, and series not updated for `ttl` seconds are evicted
+    so that churning series don't grow the state forever.
+
+    A value lower than the previous one is a counter reset: the new value
+    becomes the baseline and no rate is produced.  If `counter_bits` is set
+    (e.g. 32 or 64), a decrease from the upper half of that range is treated
+    as a wrap instead.  Values are stored as doubles, so 64 bit counters above
+    2**53 lose precision.
+
+    rates = RateTracker(ttl=600)
+
+    def read():
+        for queue, total in fetch_totals().items():
+            rates.emit(Metric('queue.messages', 'counter', total, dimensions=dict(queue=queue)))
+    """
+
+    def __init__(self, ttl=600, counter_bits=None):
+        self.ttl = ttl
+        self.counter_bits = counter_bits
+        self.resets = 0
+        self.wraps = 0
+        self.evictions = 0
+        self._slots = {}
+        self._free = []
+        self._values = array('d')
+        self._times = array('d')
+        self._next_sweep = None
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._slots)
+
+    def update(self, key, value, timestamp=None):
+        """
+        Records a sample of the series `key` and returns a (delta, rate per
+        second) tuple, or None for the first sample of a series, a reset, or a
+        sample that is not newer than the previous one.
+        """
+        now = _time.time() if timestamp is None else timestamp
+        with self._lock:
+            if self._next_sweep is None or now >= self._next_sweep:
+                self._expire(now)
+
+            slot = self._slots.get(key)
+            if slot is None:
+                if self._free:
+                    slot = self._free.pop()
+                    self._values[slot] = value
+                    self._times[slot] = now
+                else:
+                    slot = len(self._values)
+                    self._values.append(value)
+                    self._times.append(now)
+                self._slots[key] = slot
+                return None
+
+            previous = self._values[slot]
+            elapsed = now - self._times[slot]
+            if elapsed <= 0:
+                return None
+            self._values[slot] = value
+            self._times[slot] = now
+
+            delta = value - previous
+            if delta < 0:
+                limit = 2 ** self.counter_bits if self.counter_bits else None
+                if limit is None or previous < limit / 2 or value >= limit / 2:
+                    self.resets += 1
+                    return None
+                self.wraps += 1
+                delta += limit
+        return delta, delta / elapsed
+
+    def to_rate(self, metric, type='gauge', per_second=True):
+        """
+        Replaces the value of a cumulative Metric by its rate per second (or
+        its delta) and its type by `type`.  Returns the Metric, or None when
+        there is no rate to report yet.
+        """
+        key = (metric.plugin_instance, metric.type, metric.type_instance, metric.encoded_dimensions)
+        result = self.update(key, metric.value, metric.time)
+        if result is None:
+            return None
+        metric.value = result[1] if per_second else result[0]
+        metric.type = type
+        return metric
+
+    def emit(self, metric, type='gauge', per_second=True):
+        """
+        Emits the rate of a cumulative Metric, if there is one.  Returns True
+        if a value was emitted.
+        """
+        metric = self.to_rate(metric, type, per_second)
+        if metric is None:
+            return False
+        metric.emit()
+        return True
+
+    def expire(self, now=None):
+        """
+        Evicts the series that were not updated in the last `ttl` seconds.
+        This also happens automatically during updates.
+        """
+        with self._lock:
+            self._expire(_time.time() if now is None else now)
+
+    def _expire(self, now):
+        cutoff = now - self.ttl
+        times = self._times
+        stale = [key for key, slot in self._slots.items() if times[slot] < cutoff]
+        for key in stale:
+            self._free.append(self._slots.pop(key))
+        self.evictions += len(stale)
+        self._next_sweep = now + self.ttl / 2.0
+
+
+class Aggregator(object):
+    """
+    Rolls up the Metrics of an interval before they are dispatched, for
+    per-object datapoints (per queue, per connection, ...) that are only ever
+    looked at in aggregate.
+
+    Metrics are grouped by plugin, plugin_instance, type, type_instance and
+    the subset of their dimensions named in `group_by`; the other dimensions
+    are dropped.  flush() then emits one Metric per group and stat, named
+    `<type_instance>.<stat>`.  Stats are 'sum', 'count', 'min', 'max', 'mean'
+    and percentiles such as 'p50' or 'p99' (nearest rank).  Sums keep the
+    original type, so summed counters stay cumulative, and the other stats are
+    gauges.
+
+    agg = Aggregator(group_by=('cluster',), stats=('sum', 'max', 'p99'))
+    for queue in queues:
+        agg.add(Metric('queue.depth', 'gauge', queue.depth, dimensions=dict(cluster=c, queue=queue.name)))
+    agg.flush()  # one queue.depth.sum/max/p99 series per cluster
+    """
+
+    def __init__(self, group_by=(), stats=('sum', 'count', 'min', 'max')):
+        self.group_by = tuple(group_by)
+        self.stats = tuple(stats)
+        self._percentiles = {}
+        for stat in self.stats:
+            if stat in ('sum', 'count', 'min', 'max', 'mean'):
+                continue
+            try:
+                percent = float(stat[1:]) if stat[0] == 'p' else None
+            except ValueError:
+                percent = None
+            if percent is None or not 0 < percent <= 100:
+                raise ValueError('Unknown aggregation stat "{0}"'.format(stat))
+            self._percentiles[stat] = percent
+        self._groups = {}
+
+    def __len__(self):
+        return len(self._groups)
+
+    def add(self, metric):
+        dimensions = metric.dimensions
+        group = tuple([(k, dimensions[k]) for k in self.group_by if k in dimensions])
+        key = (metric.plugin, metric.plugin_instance, metric.type, metric.type_instance, group, metric.host,
+               metric.interval)
+        values = self._groups.get(key)
+        if values is None:
+            values = self._groups[key] = array('d')
+        values.append(metric.value)
+
+    def metrics(self):
+        """
+        Returns the aggregated Metrics and starts a new interval.
+        """
+        groups, self._groups = self._groups, {}
+        out = []
+        for (plugin, plugin_instance, type, type_instance, group, host, interval), values in groups.items():
+            ordered = sorted(values) if self._percentiles else values
+            for stat in self.stats:
+                if stat == 'sum':
+                    value = math.fsum(values)
+                elif stat == 'count':
+                    value = len(values)
+                elif stat == 'min':
+                    value = min(values)
+                elif stat == 'max':
+                    value = max(values)
+                elif stat == 'mean':
+                    value = math.fsum(values) / len(values)
+                else:
+                    rank = int(math.ceil(self._percentiles[stat] / 100.0 * len(ordered)))
+                    value = ordered[max(rank, 1) - 1]
+                out.append(Metric('{0}.{1}'.format(type_instance, stat), type if stat == 'sum' else 'gauge', value,
+                                  plugin=plugin, plugin_instance=plugin_instance, dimensions=dict(group), host=host,
+                                  interval=interval))
+        return out
+
+    def flush(self):
+        """
+        Dispatches the aggregated Metrics and starts a new interval.  Returns
+        a (count, elapsed seconds) tuple.
+        """
+        return dispatch_many(self.metrics())
+
+
+class DedupFilter(object):
+    """
+    Suppresses dispatches of series whose value has not changed since it was
+    last sent, for gauges such as config flags, capacities or versions.  To
+    keep series alive, an unchanged value is still sent every `heartbeat`
+    intervals, i.e. after `heartbeat - 1` consecutive suppressions (None never
+    forces a resend).
+
+    The last sent values live in an array('d') indexed through an LRU ordered
+    dict of series, bounded to `max_series`; the least recently seen series is
+    forgotten first, which at worst causes one extra dispatch.
+
+    dedup = DedupFilter(heartbeat=30)
+
+    def read():
+        dedup.emit(Metric('disk.capacity', 'gauge', capacity, dimensions=dims))
+    """
+
+    def __init__(self, heartbeat=10, max_series=100000):
+        self.heartbeat = heartbeat
+        self.max_series = max_series
+        self.sent = 0
+        self.suppressed = 0
+        self._slots = OrderedDict()
+        self._values = array('d')
+        self._skipped = array('i')
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._slots)
+
+    def should_send(self, key, value):
+        """
+        Returns True if the value of series `key` must be sent, and records it
+        as sent if so.
+        """
+        with self._lock:
+            slot = self._slots.pop(key, None)
+            if slot is None:
+                if len(self._slots) >= self.max_series:
+                    _, slot = self._slots.popitem(last=False)
+                    self._values[slot] = value
+                    self._skipped[slot] = 0
+                else:
+                    slot = len(self._values)
+                    self._values.append(value)
+                    self._skipped.append(0)
+                self._slots[key] = slot
+                self.sent += 1
+                return True
+
+            self._slots[key] = slot
+            if self._values[slot] == value and (self.heartbeat is None or self._skipped[slot] < self.heartbeat - 1):
+                self._skipped[slot] += 1
+                self.suppressed += 1
+                return False
+            self._values[slot] = value
+            self._skipped[slot] = 0
+            self.sent += 1
+            return True
+
+    def emit(self, metric):
+        """
+        Emits the Metric unless it repeats the last sent value of its series.
+        Returns True if it was emitted.
+        """
+        key = (metric.plugin, metric.plugin_instance, metric.type, metric.type_instance, metric.encoded_dimensions,
+               metric.host)
+        if not self.should_send(key, metric.value):
+            return False
+        metric.emit()
+        return True
+
+
+class HyperLogLog(object):
+    """
+    A HyperLogLog distinct counter with 2**precision one byte registers
+    (4KiB and about 1.6% standard error by default).  Hashes come from
+    Python's hash(), so estimates are only meaningful within one process.
+    """
+    __slots__ = ('precision', 'registers')
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, item):
+        # splitmix64 finalizer, since hash() of small ints and similar tuples is far from uniform
+        h = (hash(item) + 0x9e3779b97f4a7c15) & 0xffffffffffffffff
+        h = ((h ^ (h >> 30)) * 0xbf58476d1ce4e5b9) & 0xffffffffffffffff
+        h = ((h ^ (h >> 27)) * 0x94d049bb133111eb) & 0xffffffffffffffff
+        h ^= h >> 31
+        index = h >> (64 - self.precision)
+        rank = 64 - self.precision - (h & ((1 << (64 - self.precision)) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum([2.0 ** -r for r in self.registers])
+        zeros = self.registers.count(b'\x00')
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(float(m) / zeros)
+        return estimate
+
+    def clear(self):
+        self.registers = bytearray(len(self.registers))
+
+
+class CardinalityGuard(object):
+    """
+    Caps the number of distinct series a plugin dispatches per interval, so
+    a misbehaving target emitting unbounded dimension values (request ids in
+    a dimension, ...) cannot flood collectd's write queue.
+
+    The first `max_series` distinct series of an interval are let through.
+    Series beyond that are either dropped, or with overflow='collapse' have
+    their dimensions replaced by `overflow_dimensions`, folding them into a
+    single series per metric name.  A HyperLogLog estimates how many distinct
+    series were attempted in total.  Call report() at the end of each read to
+    dispatch `cardinality.series`, `cardinality.estimate`,
+    `cardinality.dropped` and `cardinality.collapsed` and start a new interval.
+
+    guard = CardinalityGuard(max_series=10000)
+
+    def read():
+        for metric in collect():
+            guard.emit(metric)
+        guard.report(plugin='my_plugin')
+    """
+
+    def __init__(self, max_series=10000, overflow='drop', overflow_dimensions=None, precision=12):
+        if overflow not in ('drop', 'collapse'):
+            raise ValueError('Unknown cardinality overflow strategy "{0}"'.format(overflow))
+        self.max_series = max_series
+        self.overflow = overflow
+        self.overflow_dimensions = overflow_dimensions or dict(cardinality_overflow='true')
+        self.dropped = 0
+        self.collapsed = 0
+        self.estimator = HyperLogLog(precision)
+        self._series = set()
+        self._lock = Lock()
+
+    def admit(self, metric):
+        """
+        Returns the Metric if it may be dispatched (possibly collapsed), or
+        None if it must be dropped.
+        """
+        key = (metric.plugin_instance, metric.type, metric.type_instance, metric.encoded_dimensions)
+        with self._lock:
+            self.estimator.add(key)
+            if key in self._series:
+                return metric
+            if len(self._series) < self.max_series:
+                self._series.add(key)
+                return metric
+            if self.overflow == 'drop':
+                self.dropped += 1
+                return None
+            self.collapsed += 1
+        metric.dimensions = self.overflow_dimensions
+        metric.encoded_dimensions = encoding_cache.encode(
+            self.overflow_dimensions, plugin_instance_max_length - len(metric.plugin_instance) - 2)
+        return metric
+
+    def emit(self, metric):
+        """
+        Emits the Metric if it is admitted.  Returns True if it was emitted.
+        """
+        metric = self.admit(metric)
+        if metric is None:
+            return False
+        metric.emit()
+        return True
+
+    def series(self):
+        """
+        Returns the number of distinct series let through this interval.
+        """
+        return len(self._series)
+
+    def report(self, plugin='collectdutil', plugin_instance='', dimensions=None, interval=None):
+        """
+        Dispatches the guard's internal metrics and starts a new interval.
+        Returns a (count, elapsed seconds) tuple.
+        """
+        batch = MetricBatch(plugin=plugin, plugin_instance=plugin_instance, interval=interval)
+        with self._lock:
+            batch.add('cardinality.series', 'gauge', len(self._series), dimensions=dimensions)
+            batch.add('cardinality.estimate', 'gauge', int(round(self.estimator.estimate())), dimensions=dimensions)
+            batch.add('cardinality.dropped', 'counter', self.dropped, dimensions=dimensions)
+            batch.add('cardinality.collapsed', 'counter', self.collapsed, dimensions=dimensions)
+            self._series = set()
+            self.estimator.clear()
+        return batch.dispatch()
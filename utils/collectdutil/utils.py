@@ -1,4 +1,29 @@
-from shlex import shlex
+import re
+
+# A quoted string, a comment, a bare word (which may contain quotes after its
+# first character, like shlex allows) or a stray character such as an
+# unterminated quote.
+_token_re = re.compile(r'"[^"]*"|\'[^\']*\'|#.*|[^\s"\'#][^\s#]*|\S')
+_booleans = dict(true=True, false=False)
+
+
+def _tokenize(properties_string):
+    tokens = []
+    for token in _token_re.findall(properties_string):
+        if token[0] == '#':
+            break
+        if token in ('"', "'"):
+            raise ValueError('No closing quotation')
+        tokens.append(token)
+    return tokens
+
+
+def _typed_value(token):
+    if '"' in token:
+        return token.replace('"', '')
+    if token in _booleans:
+        return _booleans[token]
+    return float(token)
 
 
 class ParsedConfig(object):
@@ -6,29 +31,52 @@ class ParsedConfig(object):
     cfg_str = '''
     DescriptorOne "one" "two" "three"
     DescriptorTwo 123 true "test"
+    <Node "first">
+      Host "localhost"
+    </Node>
     '''
     cfg = ParsedConfig(cfg_str)
     assert cfg.children[0].values == ['one', 'two', 'three']
     assert cfg.children[1].values == [123.0, True, 'test']
+    assert cfg.children[2].key == 'Node'
+    assert cfg.children[2].values == ['first']
+    assert cfg.children[2].children[0].values == ['localhost']
+
+    Every line is tokenized with one precompiled regex rather than a shlex instance per line.
     """
 
     class Child(object):
 
-        def __init__(self, properties_string):
-            boolean = dict(true=True, false=False)
-            sh = shlex(properties_string)
-            sh.whitespace_split = True
-            items = list(iter(sh.get_token, ''))
-            self.key = items[0]
-            self.values = items[1:]
-            for i, item in enumerate(self.values):
-                if '"' in item:
-                    self.values[i] = item.replace('"', '')
-                elif item in ('true', 'false'):
-                    self.values[i] = boolean[item]
-                else:
-                    self.values[i] = float(item)
+        def __init__(self, properties_string, parent=None):
+            tokens = _tokenize(properties_string)
+            self.key = tokens[0]
+            self.values = [_typed_value(token) for token in tokens[1:]]
+            self.children = []
+            self.parent = parent
 
     def __init__(self, config_string=''):
-        properties = [p.lstrip() for p in config_string.split('\n') if p.lstrip()]
-        self.children = [self.Child(prop) for prop in properties]
+        self.children = []
+        stack = [self]
+        for line in config_string.split('\n'):
+            line = line.strip()
+            if not line or line[0] == '#':
+                continue
+            if line[0] != '<':
+                stack[-1].children.append(self.Child(line, stack[-1]))
+                continue
+
+            closing = line.startswith('</')
+            line = line[2 if closing else 1:].rstrip()
+            if not line.endswith('>'):
+                raise ValueError('Unterminated block tag: {0}'.format(line))
+            line = line[:-1]
+            if closing:
+                if len(stack) == 1 or stack[-1].key.lower() != line.strip().lower():
+                    raise ValueError('Unexpected closing tag: </{0}>'.format(line.strip()))
+                stack.pop()
+            else:
+                block = self.Child(line, stack[-1])
+                stack[-1].children.append(block)
+                stack.append(block)
+        if len(stack) > 1:
+            raise ValueError('Unclosed block: <{0}>'.format(stack[-1].key))
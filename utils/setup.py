@@ -11,5 +11,8 @@ setup(
     install_requires=[
         'six',
     ],
+    extras_require={
+        'fanout': ['futures; python_version < "3"'],
+    },
     python_requires='>=2.6',
 )
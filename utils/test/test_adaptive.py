@@ -0,0 +1,110 @@
+import pytest
+
+from collectdutil import fauxllectd
+from collectdutil.adaptive import AdaptiveScheduler
+from collectdutil.config import Config
+from collectdutil.metrics import Metric
+from collectdutil.utils import ParsedConfig
+
+
+@pytest.fixture(autouse=True)
+def runtime():
+    fauxllectd.reset(clock=1000.0)
+    yield
+    fauxllectd.reset()
+
+
+class Timer(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Group(object):
+
+    def __init__(self, timer, cost=0.0, changing=True, type_instances=('value',)):
+        self.timer = timer
+        self.cost = cost
+        self.changing = changing
+        self.type_instances = type_instances
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        self.timer.now += self.cost
+        value = self.calls if self.changing else 1
+        return [Metric(ti, 'gauge', value, plugin='p') for ti in self.type_instances]
+
+
+def test_hot_groups_run_every_interval_and_static_ones_back_off():
+    timer = Timer()
+    scheduler = AdaptiveScheduler(timer=timer)
+    hot = Group(timer)
+    static = Group(timer, changing=False)
+    scheduler.add_group('hot', hot)
+    scheduler.add_group('static', static, max_every=4)
+    scheduler.register(interval=10)
+
+    fauxllectd.run_reads(intervals=16)
+    assert hot.calls == 16
+    # Runs at intervals 1, 2 (unchanged so far, every=2), 4 (every=4), 8, 12 and 16
+    assert static.calls == 6
+    stats = scheduler.stats()
+    assert stats['static'].every == 4
+    assert stats['static'].skips == 10
+    assert stats['hot'].every == 1
+    assert stats['hot'].last_change == 1.0
+
+
+def test_costly_groups_are_sampled_less_often():
+    timer = Timer()
+    scheduler = AdaptiveScheduler(cost_budget=0.5, timer=timer)
+    cheap = Group(timer, cost=0.1)
+    costly = Group(timer, cost=2.0)
+    scheduler.add_group('cheap', cheap)
+    scheduler.add_group('costly', costly, max_every=3)
+    scheduler.register()
+
+    fauxllectd.run_reads(intervals=10)
+    assert cheap.calls == 10
+    assert costly.calls == 4  # intervals 1, 3, 6 and 9: every 2, then capped at every 3
+    stats = scheduler.stats()['costly']
+    assert stats.last_cost == pytest.approx(2.0)
+    assert stats.mean_cost == pytest.approx(2.0)
+    assert stats.every == 3
+
+
+def test_config_metrics_select_groups_and_metrics():
+    metrics = {
+        'heap_used': ('heap.used', 'gauge', True),
+        'gc_count': ('gc.count', 'counter', True),
+        'version': ('version', 'gauge', True),
+    }
+    cfg = Config(ParsedConfig('Metric "gc_count" false\nMetric "version" false'), metrics=metrics)
+    timer = Timer()
+    scheduler = AdaptiveScheduler(cfg, timer=timer)
+    heap = Group(timer, type_instances=('heap.used', 'gc.count'))
+    info = Group(timer, type_instances=('version',))
+    scheduler.add_group('heap', heap, metrics=('heap_used', 'gc_count'))
+    scheduler.add_group('info', info, metrics=('version',))
+    scheduler.register()
+
+    fauxllectd.run_reads(intervals=2)
+    assert heap.calls == 2
+    assert info.calls == 0
+    assert [d.type_instance for d in fauxllectd.dispatched()] == ['heap.used', 'heap.used']
+
+
+def test_failed_groups_are_logged_and_counted():
+    def broken():
+        raise IOError('unreachable')
+
+    scheduler = AdaptiveScheduler()
+    scheduler.add_group('broken', broken)
+    scheduler.register()
+    fauxllectd.run_reads(intervals=3)
+    assert scheduler.stats()['broken'].errors == 3
+    assert scheduler.stats()['broken'].runs == 0
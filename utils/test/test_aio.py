@@ -0,0 +1,55 @@
+from timeit import default_timer
+
+import pytest
+
+asyncio = pytest.importorskip('asyncio')
+
+from collectdutil import fauxllectd  # noqa: E402
+from collectdutil.aio import AsyncCollector  # noqa: E402
+from collectdutil.metrics import Metric  # noqa: E402
+
+
+@pytest.fixture
+def collector():
+    fauxllectd.reset()
+    collector = AsyncCollector(timeout=2)
+    yield collector
+    collector.stop()
+    fauxllectd.reset()
+
+
+def test_gather_runs_concurrently(collector):
+    fetches = dict([('target{0}'.format(i), asyncio.sleep(0.2, result=i)) for i in range(5)])
+    start = default_timer()
+    results, errors = collector.gather(fetches)
+    assert default_timer() - start < 0.8
+    assert results == dict([('target{0}'.format(i), i) for i in range(5)])
+    assert errors == {}
+
+
+def test_gather_timeouts_and_errors(collector):
+    fetches = {
+        'fast': asyncio.sleep(0, result='ok'),
+        'slow': asyncio.sleep(10, result='late'),
+        'broken': 'not a coroutine',
+    }
+    start = default_timer()
+    results, errors = collector.gather(fetches, timeout=0.2)
+    assert default_timer() - start < 2
+    assert results == {'fast': 'ok'}
+    assert isinstance(errors['slow'], asyncio.TimeoutError)
+    assert isinstance(errors['broken'], TypeError)
+
+
+def test_dispatch_from_calling_thread(collector):
+    fetches = dict([(name, asyncio.sleep(0, result=value)) for name, value in (('a', 1), ('b', 2))])
+    fetches['slow'] = asyncio.sleep(10)
+
+    def to_metrics(target, result):
+        return [Metric('value', 'gauge', result, plugin='p', dimensions=dict(target=target))]
+
+    count, errors = collector.dispatch(fetches, to_metrics, timeout=0.1)
+    assert count == 2
+    assert list(errors) == ['slow']
+    assert sorted((d.plugin_instance, d.values) for d in fauxllectd.dispatched()) == [
+        ('[target=a]', (1,)), ('[target=b]', (2,))]
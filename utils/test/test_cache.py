@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+from collectdutil.cache import TTLCache, cache_descriptors
+from collectdutil.config import Config
+from collectdutil.utils import ParsedConfig
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Loader(object):
+
+    def __init__(self, delay=0):
+        self.calls = 0
+        self.delay = delay
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        return self.calls
+
+
+def wait_until(test):
+    for _ in range(100):
+        if test():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_fresh_stale_and_expired():
+    clock = Clock()
+    cache = TTLCache(ttl=10, max_stale=5, clock=clock)
+    loader = Loader()
+    assert cache.get('topics', loader) == 1
+    assert cache.get('topics', loader) == 1
+    assert (cache.misses, cache.hits) == (1, 1)
+
+    clock.now += 12  # stale: served while refreshing in the background
+    assert cache.get('topics', loader) == 1
+    assert wait_until(lambda: cache.get('topics', loader) == 2)
+    assert cache.refreshes == 1
+    assert loader.calls == 2
+
+    clock.now += 20  # too stale: loaded in the caller's thread
+    assert cache.get('topics', loader) == 3
+    assert cache.misses == 2
+
+
+def test_per_key_ttl_and_size_limit():
+    clock = Clock()
+    cache = TTLCache(ttl=10, max_size=2, clock=clock)
+    cache.get('a', Loader(), ttl=100)
+    cache.get('b', Loader())
+    cache.get('c', Loader())
+    assert len(cache) == 2
+    assert cache.evictions == 1
+    clock.now += 50
+    loader = Loader()
+    assert cache.get('a', loader) == 1 and loader.calls == 1  # a was evicted
+    cache.invalidate('a')
+    cache.get('a', loader, ttl=100)
+    clock.now += 50
+    assert cache.get('a', loader) == 2 and loader.calls == 2
+
+
+def test_concurrent_loads_are_deduplicated():
+    cache = TTLCache()
+    loader = Loader(delay=0.1)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('key', loader))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [1] * 5
+    assert loader.calls == 1
+
+
+def test_errors():
+    clock = Clock()
+    cache = TTLCache(ttl=10, clock=clock)
+
+    def broken():
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError):
+        cache.get('key', broken)
+    assert cache.get('key', Loader()) == 1
+    clock.now += 15
+    assert cache.get('key', broken) == 1  # stale value kept when the refresh fails
+    assert wait_until(lambda: cache.errors == 2)
+
+
+def test_from_config():
+    descriptors = cache_descriptors('Discovery', ttl='5m')
+    cfg = Config(ParsedConfig('DiscoveryTTL "30s"\nDiscoveryCacheSize 10'), descriptors=descriptors)
+    cache = TTLCache.from_config(cfg, 'Discovery')
+    assert (cache.ttl, cache.max_size, cache.max_stale) == (30.0, 10, 30.0)
+    cfg = Config(ParsedConfig('DiscoveryMaxStale "1h"'), descriptors=descriptors)
+    cache = TTLCache.from_config(cfg, 'Discovery')
+    assert (cache.ttl, cache.max_size, cache.max_stale) == (300.0, 1024, 3600.0)
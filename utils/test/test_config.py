@@ -1,7 +1,9 @@
+import collectd
 import pytest
 
 from collectdutil.utils import ParsedConfig
-from collectdutil.config import Config
+from collectdutil.config import (Config, ConfigSchema, config_to_dict, diff_config, to_bool, to_duration, to_regex,
+                                 to_str_list)
 
 
 descriptors = {
@@ -104,3 +106,189 @@ def test_extra_dimensions():
         dimension_two='thing_two',
         dimension_three='two'
     )
+
+
+def test_schema_parse_matches_config():
+    cfg_str = '''
+    DesCriptorOne true
+    DescriptorFive "one" "two" "three"
+    Descriptorfive "four" "five"
+    DesCriptorSix true true 123 false "test"
+    Metric "metric_one" false
+    Metric "metric_two"
+    Metric "unknown" true
+    ExtraDimension "dimension_one" "thing_one"
+    Unknown "value"
+    '''
+    schema = ConfigSchema(descriptors=descriptors, metrics=metrics)
+    expected = Config(ParsedConfig(cfg_str), descriptors=descriptors, metrics=metrics)
+    for _ in range(2):
+        cfg = schema.parse(ParsedConfig(cfg_str))
+        assert isinstance(cfg, Config)
+        assert vars(cfg) == vars(expected)
+    assert str(cfg) == str(expected)
+
+
+def test_schema_parse_without_config():
+    cfg = ConfigSchema(descriptors=descriptors, metrics=metrics).parse()
+    assert cfg.descriptor_three == 234.0
+    assert cfg.metric_two is False
+    assert cfg.extra_dimensions == {}
+
+
+def test_config_recompiles_changed_specs():
+    specs = {'Key': ('key', 'default')}
+    assert Config(ParsedConfig('Key "one"'), descriptors=specs).key == 'one'
+    specs['Other'] = ('other', 2)
+    cfg = Config(ParsedConfig('Other "two"'), descriptors=specs)
+    assert cfg.key == 'default'
+    assert cfg.other == 'two'
+
+
+typed_descriptors = {
+    'Port': ('port', 80, int),
+    'Ratio': ('ratio', 0.5, float),
+    'Enabled': ('enabled', 'no', bool),
+    'Timeout': ('timeout', '10s', to_duration),
+    'Databases': ('databases', [], to_str_list),
+    'Include': ('include', '.*', to_regex),
+    'Name': ('name', None, str),
+}
+
+
+def test_typed_descriptors():
+    cfg_str = '''
+    Port "8080"
+    Ratio 2
+    Enabled "yes"
+    Timeout "250ms"
+    Databases "one" "two"
+    Databases "three"
+    Include "^queue"
+    Name 123
+    '''
+    cfg = Config(ParsedConfig(cfg_str), descriptors=typed_descriptors)
+    assert cfg.port == 8080 and isinstance(cfg.port, int)
+    assert cfg.ratio == 2.0
+    assert cfg.enabled is True
+    assert cfg.timeout == 0.25
+    assert cfg.databases == ['one', 'two', 'three']
+    assert cfg.include.match('queue.depth')
+    assert not cfg.include.match('topic')
+    assert cfg.name == '123.0'
+
+
+def test_typed_descriptor_defaults():
+    cfg = ConfigSchema(descriptors=typed_descriptors).parse(ParsedConfig('Databases "one"'))
+    assert cfg.port == 80
+    assert cfg.enabled is False
+    assert cfg.timeout == 10.0
+    assert cfg.databases == ['one']
+    assert cfg.include.match('anything')
+    assert cfg.name is None
+
+
+def test_invalid_typed_descriptors_use_defaults():
+    cfg_str = '''
+    Port 80.5
+    Enabled "maybe"
+    Timeout "soon"
+    Include "("
+    '''
+    cfg = Config(ParsedConfig(cfg_str), descriptors=typed_descriptors)
+    assert cfg.port == 80
+    assert cfg.enabled is False
+    assert cfg.timeout == 10.0
+    assert cfg.include.pattern == '.*'
+
+
+def test_coercers():
+    assert to_bool(True) is True
+    assert to_bool(0.0) is False
+    assert to_bool('Off') is False
+    assert to_duration(5) == 5.0
+    assert to_duration('1.5m') == 90.0
+    assert to_duration('2h') == 7200.0
+    assert to_str_list('one') == ['one']
+    assert to_str_list([['a'], ['b', 'c']]) == ['a', 'b', 'c']
+
+
+def test_non_finite_int_falls_back_to_default():
+    for value in ('inf', '-inf', 'nan', '"1e400"'):
+        cfg = Config(ParsedConfig('Port {0}'.format(value)), descriptors={'Port': ('port', 80, int)})
+        assert cfg.port == 80
+
+
+nested_config = '''
+Interval 10
+Databases "one" "two"
+Dimension "a"
+Dimension "b"
+<Node "first">
+  Host "one"
+  <Auth>
+    User "admin"
+  </Auth>
+</Node>
+<Node "second">
+  Host "two"
+</Node>
+'''
+
+
+def test_config_to_dict():
+    assert config_to_dict(ParsedConfig(nested_config)) == {
+        'Interval': 10.0,
+        'Databases': ['one', 'two'],
+        'Dimension': ['a', 'b'],
+        'Node': {
+            'first': {'Host': 'one', 'Auth': {'User': 'admin'}},
+            'second': {'Host': 'two'},
+        },
+    }
+
+
+def test_config_to_dict_empty_labelled_block():
+    conf = ParsedConfig('<Node "a">\n  Host "x"\n</Node>\n<Node "b">\n</Node>')
+    assert config_to_dict(conf) == {'Node': {'a': {'Host': 'x'}, 'b': {}}}
+    conf = ParsedConfig('<Node "b">\n</Node>\n<Node "a">\n  Host "x"\n</Node>')
+    assert config_to_dict(conf) == {'Node': {'a': {'Host': 'x'}, 'b': {}}}
+
+
+def test_config_to_dict_duplicate_labels(monkeypatch):
+    warnings = []
+    monkeypatch.setattr(collectd, 'warning', warnings.append)
+    conf = ParsedConfig('<Node "a">\n  Host "x"\n</Node>\n<Node "a">\n  Host "y"\n</Node>\n'
+                        '<Node "a">\n  Host "z"\n</Node>')
+    assert config_to_dict(conf) == {'Node': {'a': [{'Host': 'x'}, {'Host': 'y'}, {'Host': 'z'}]}}
+    assert len(warnings) == 2
+
+    previous = config_to_dict(conf)
+    _, changes = diff_config(previous, ParsedConfig('<Node "a">\n  Host "y"\n</Node>'))
+    assert changes == {('Node', 'a'): {'Host': 'y'}}
+
+
+def test_diff_config():
+    previous, changes = diff_config(None, ParsedConfig(nested_config))
+    assert changes[('Interval',)] == 10.0
+    assert changes[('Node',)] == previous['Node']
+
+    tree, changes = diff_config(previous, ParsedConfig(nested_config))
+    assert tree == previous
+    assert changes == {}
+
+    updated = nested_config.replace('"admin"', '"root"').replace('Host "two"', 'Host "three"')
+    updated = updated.replace('<Node "first">', '<Node "third">')
+    _, changes = diff_config(previous, ParsedConfig(updated))
+    assert changes == {
+        ('Node', 'first'): None,
+        ('Node', 'third'): {'Host': 'one', 'Auth': {'User': 'root'}},
+        ('Node', 'second', 'Host'): 'three',
+    }
+
+    _, changes = diff_config(previous, ParsedConfig(updated), depth=2)
+    assert changes == {
+        ('Node', 'first'): None,
+        ('Node', 'third'): {'Host': 'one', 'Auth': {'User': 'root'}},
+        ('Node', 'second'): {'Host': 'three'},
+    }
@@ -0,0 +1,70 @@
+import time
+from timeit import default_timer
+
+import pytest
+
+pytest.importorskip('concurrent.futures')
+
+from collectdutil import fauxllectd  # noqa: E402
+from collectdutil.fanout import FanOut, TimeoutExceeded  # noqa: E402
+from collectdutil.metrics import Metric  # noqa: E402
+
+
+@pytest.fixture
+def pool():
+    fauxllectd.reset()
+    pool = FanOut(max_workers=4, timeout=2)
+    yield pool
+    fauxllectd.shutdown()
+    fauxllectd.reset()
+
+
+def fetch(target):
+    if target == 'broken':
+        raise ValueError('boom')
+    time.sleep(0.5 if target == 'slow' else 0.1)
+    return target.upper()
+
+
+def test_run_merges_in_target_order(pool):
+    targets = ['d', 'c', 'b', 'a']
+    start = default_timer()
+    results, errors = pool.run(fetch, targets)
+    assert default_timer() - start < 0.35
+    assert results == [('d', 'D'), ('c', 'C'), ('b', 'B'), ('a', 'A')]
+    assert errors == {}
+    assert all(pool.stats[t].calls == 1 and pool.stats[t].latency.min >= 0.1 for t in targets)
+
+
+def test_run_deadline_and_errors(pool):
+    results, errors = pool.run(fetch, ['a', 'slow', 'broken'], timeout=0.3)
+    assert results == [('a', 'A')]
+    assert isinstance(errors['slow'], TimeoutExceeded)
+    assert isinstance(errors['broken'], ValueError)
+    assert pool.stats['slow'].timeouts == 1
+    assert pool.stats['broken'].errors == 1
+
+
+def test_stragglers_are_cancelled(pool):
+    pool = FanOut(max_workers=1)
+    results, errors = pool.run(fetch, ['slow', 'a', 'b'], timeout=0.1)
+    assert results == []
+    assert sorted(errors) == ['a', 'b', 'slow']
+    time.sleep(0.6)
+    assert pool.stats['a'].calls == 0  # cancelled before it started
+    pool.shutdown()
+
+
+def test_dispatch_and_shutdown(pool):
+    def to_metrics(target, result):
+        return [Metric('value', 'gauge', len(result), plugin='p', dimensions=dict(target=target))]
+
+    count, errors = pool.dispatch(fetch, ['b', 'a', 'broken'], to_metrics)
+    assert count == 2
+    assert list(errors) == ['broken']
+    assert [d.plugin_instance for d in fauxllectd.dispatched()] == ['[target=b]', '[target=a]']
+
+    fauxllectd.shutdown()
+    assert pool._executor is None
+    pool.run(fetch, ['a'])  # starts a new pool after shutdown
+    assert pool._executor is not None
@@ -0,0 +1,109 @@
+import time
+
+import pytest
+
+from collectdutil import fauxllectd
+from collectdutil.metrics import Metric
+from collectdutil.utils import ParsedConfig
+
+
+@pytest.fixture(autouse=True)
+def runtime():
+    fauxllectd.reset(buffer_size=5, clock=1000.0)
+    yield
+    fauxllectd.reset()
+
+
+def test_values_dispatch_is_captured():
+    Metric('ti', 'gauge', 1.5, plugin='p', plugin_instance='pi', dimensions=dict(a='b'), interval=10).emit()
+    fauxllectd.Values(type='counter', plugin='p').dispatch(values=[2], time=5)
+    assert fauxllectd.dispatched() == [
+        fauxllectd.Dispatched('', 'p', 'pi[a=b]', 'gauge', 'ti', 1000.0, 10, (1.5,)),
+        fauxllectd.Dispatched('', 'p', '', 'counter', '', 5, 0, (2,)),
+    ]
+
+
+def test_ring_buffer_is_bounded():
+    val = fauxllectd.Values(type='gauge')
+    for i in range(8):
+        val.dispatch(values=[i])
+    assert [d.values[0] for d in fauxllectd.dispatched()] == [3, 4, 5, 6, 7]
+    assert fauxllectd.dispatch_count() == 8
+    fauxllectd.clear_dispatched()
+    assert fauxllectd.dispatched() == []
+    assert fauxllectd.dispatch_count() == 0
+
+
+def test_lifecycle_and_simulated_reads():
+    events = []
+
+    def read(data):
+        events.append((data, fauxllectd.now()))
+        fauxllectd.Values(type='gauge', plugin=data).dispatch(values=[1])
+
+    def configure(conf):
+        for child in conf.children:
+            fauxllectd.register_read(read, interval=child.values[0], data=child.key, name=child.key)
+
+    fauxllectd.register_config(configure)
+    fauxllectd.register_init(lambda: events.append('init'))
+    fauxllectd.register_shutdown(lambda data: events.append(data), data='shutdown')
+    fauxllectd.configure(ParsedConfig('fast 5\nslow 20'))
+    fauxllectd.init()
+
+    assert fauxllectd.run_reads(intervals=2) == 5
+    assert fauxllectd.now() == 1020.0
+    assert events == ['init', ('fast', 1000.0), ('slow', 1000.0), ('fast', 1005.0), ('fast', 1010.0),
+                      ('fast', 1015.0)]
+    stats = fauxllectd.read_stats()
+    assert stats['fast'].calls == 4
+    assert stats['slow'].calls == 1
+    assert fauxllectd.dispatch_count() == 5
+
+    fauxllectd.unregister_read('fast')
+    assert fauxllectd.run_reads(duration=20) == 1
+    fauxllectd.shutdown()
+    assert events[-1] == 'shutdown'
+
+
+def test_failing_read_is_counted():
+    def read():
+        raise ValueError('boom')
+
+    fauxllectd.register_read(read)
+    assert fauxllectd.run_reads(intervals=3) == 3
+    stats = fauxllectd.read_stats()
+    assert list(stats.values())[0].errors == 3
+
+
+def test_read_scheduler_counts_missed_intervals():
+    def fast():
+        fauxllectd.Values(type='gauge', plugin='fast').dispatch(values=[1])
+
+    def slow():
+        time.sleep(0.05)
+
+    fauxllectd.register_read(fast, interval=1, name='fast')
+    fauxllectd.register_read(slow, interval=1, name='slow')
+    stats = fauxllectd.ReadScheduler(read_threads=2, timeout=0.03, time_scale=0.02).run(0.3)
+
+    assert stats['fast'].calls >= 5
+    assert stats['fast'].missed == 0
+    assert stats['fast'].latency.count == stats['fast'].calls
+    assert stats['slow'].calls >= 2
+    assert stats['slow'].missed >= stats['slow'].calls - 1
+    assert stats['slow'].timeouts == stats['slow'].calls
+    assert stats['slow'].latency.percentile(50) >= 0.05
+    assert fauxllectd.dispatch_count() == stats['fast'].calls
+
+
+def test_read_scheduler_jitter_does_not_drift():
+    def read():
+        pass
+
+    fauxllectd.register_read(read, interval=1, name='jittered')
+    stats = fauxllectd.ReadScheduler(jitter=0.05, time_scale=0.05, seed=1).run(1.5)
+
+    # One call per 50ms interval, whatever the jitter of each call
+    assert 28 <= stats['jittered'].calls <= 31
+    assert stats['jittered'].missed == 0
@@ -0,0 +1,34 @@
+import pytest
+
+from collectdutil.histogram import Histogram, exponential_buckets
+
+
+def test_exponential_buckets():
+    assert exponential_buckets(1, 2, 4) == [1, 2, 4, 8]
+
+
+def test_histogram_percentiles():
+    hist = Histogram([1, 2, 4, 8])
+    assert hist.percentile(50) == 0.0
+    for value in [0.5] * 50 + [3] * 49 + [20]:
+        hist.record(value)
+    assert hist.count == 100
+    assert hist.min == 0.5
+    assert hist.max == 20
+    assert hist.percentile(50) == 1
+    assert hist.percentile(99) == 4
+    assert hist.percentile(100) == 20
+    assert hist.mean == pytest.approx((25 + 147 + 20) / 100.0)
+
+
+def test_histogram_merge():
+    one = Histogram([1, 2])
+    two = Histogram([1, 2])
+    one.record(0.5)
+    two.record(1.5)
+    two.record(5)
+    one.merge(two)
+    assert one.counts == [1, 1, 1]
+    assert (one.count, one.min, one.max) == (3, 0.5, 5)
+    with pytest.raises(ValueError):
+        one.merge(Histogram([1]))
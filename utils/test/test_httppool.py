@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+
+server = pytest.importorskip('http.server')
+
+import socketserver  # noqa: E402
+
+from collectdutil import fauxllectd  # noqa: E402
+from collectdutil.httppool import PoolTimeout, SessionManager  # noqa: E402
+
+
+class Handler(server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        Handler.connections.add(self.client_address)
+        if self.path == '/close':
+            self.close_connection = True
+        body = self.path.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        if self.path == '/close':
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Server(socketserver.ThreadingMixIn, server.HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def url():
+    Handler.connections = set()
+    httpd = _Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, kwargs=dict(poll_interval=0.05))
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:{0}'.format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_connections_are_reused(url):
+    sessions = SessionManager()
+    for i in range(5):
+        resp = sessions.get(url + '/stats?i={0}'.format(i))
+        assert resp.status == 200
+        assert resp.body == '/stats?i={0}'.format(i).encode('utf-8')
+        assert resp.headers['content-length'] == str(len(resp.body))
+    assert len(Handler.connections) == 1
+    assert (sessions.created, sessions.reused) == (1, 4)
+    sessions.close()
+
+
+def test_closed_and_idle_connections_are_replaced(url):
+    sessions = SessionManager(idle_timeout=60)
+    sessions.get(url + '/close')
+    sessions.get(url + '/')
+    assert sessions.created == 2
+
+    sessions.evict_idle(now=time.time() + 120)
+    assert sessions.evicted == 1
+    sessions.get(url + '/')
+    assert sessions.created == 3
+    assert len(Handler.connections) == 3
+
+
+def test_pool_size_is_bounded(url):
+    sessions = SessionManager(max_per_host=1, timeout=0.2)
+    pool = sessions._pool(('http', '127.0.0.1', int(url.rsplit(':', 1)[1])))
+    pool.slots.acquire()
+    with pytest.raises(PoolTimeout):
+        sessions.get(url + '/')
+    pool.slots.release()
+    assert sessions.get(url + '/').status == 200
+
+
+def test_lifecycle_registration(url):
+    fauxllectd.reset()
+    sessions = SessionManager()
+    sessions.register()
+    fauxllectd.init()
+    sessions.get(url + '/')
+    fauxllectd.shutdown()
+    pool = list(sessions._pools.values())[0]
+    assert pool.idle == []
+    fauxllectd.reset()
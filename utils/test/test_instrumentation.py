@@ -0,0 +1,89 @@
+import pytest
+
+from collectdutil import fauxllectd
+from collectdutil.config import Config
+from collectdutil.instrumentation import Instrumentation
+from collectdutil.metrics import Metric, MetricBatch, MetricFrame, encoding_cache
+from collectdutil.utils import ParsedConfig
+
+
+@pytest.fixture(autouse=True)
+def runtime():
+    fauxllectd.reset()
+    yield
+    fauxllectd.reset()
+
+
+def test_timed_decorator_and_context_manager():
+    instr = Instrumentation()
+
+    @instr.timed('read')
+    def read():
+        with instr.timed('fetch'):
+            pass
+        return 'done'
+
+    assert read() == 'done'
+    assert read.__name__ == 'read'
+    read()
+    assert instr.timers['read'].calls == 2
+    assert instr.timers['fetch'].calls == 2
+    assert instr.timers['read'].total >= instr.timers['fetch'].total
+
+
+def test_builtin_timers():
+    instr = Instrumentation()
+    original_emit = Metric.emit
+    encoding_cache.clear()
+    instr.enable_builtin_timers()
+    try:
+        for _ in range(200):
+            Metric('ti', 'gauge', 1, dimensions=dict(unique='builtin_timers')).emit()
+        batch = MetricBatch()
+        batch.add('ti', 'gauge', 1, dimensions=dict(unique='builtin_timers'))
+        batch.dispatch()
+        frame = MetricFrame()
+        frame.add('ti', 'gauge', 1, dimensions=dict(unique='builtin_timers_frame'))
+        frame.emit()
+        Config(ParsedConfig('Key "value"'), descriptors=dict(Key=('key', None)))
+    finally:
+        instr.disable_builtin_timers()
+    assert Metric.emit is original_emit
+    assert sorted(instr.timers) == ['config.parse', 'encode_dimensions', 'encode_dimensions.miss', 'metric.emit',
+                                    'metric_batch.dispatch', 'metric_frame.emit']
+    assert instr.timers['metric.emit'].calls == 200
+    assert instr.timers['encode_dimensions'].calls == 202
+    assert instr.timers['encode_dimensions.miss'].calls == 2
+    assert instr.timers['metric_batch.dispatch'].calls == 1
+    assert instr.timers['metric_frame.emit'].calls == 1
+    assert instr.timers['config.parse'].calls == 1
+
+
+def test_report_dispatches_internal_metrics():
+    instr = Instrumentation()
+    instr.record('read', 0.001)
+    instr.record('read', 0.003)
+    count, _ = instr.report(plugin='my_plugin', dimensions=dict(plugin='test'))
+    assert count == 4
+    reported = dict((d.type_instance, (d.type, d.values[0])) for d in fauxllectd.dispatched())
+    assert set(d.plugin_instance for d in fauxllectd.dispatched()) == set(['[plugin=test]'])
+    assert reported['read.calls'] == ('counter', 2)
+    assert reported['read.time_us'] == ('counter', 4000)
+    assert reported['read.p50'][1] <= reported['read.p99'][1] <= 0.003
+
+    fauxllectd.clear_dispatched()
+    assert instr.report()[0] == 2  # no new calls, so no percentiles
+
+
+def test_report_with_builtin_timers():
+    instr = Instrumentation()
+    instr.enable_builtin_timers()
+    try:
+        Metric('ti', 'gauge', 1, dimensions=dict(unique='report_builtin')).emit()
+        count, _ = instr.report(plugin='my_plugin', dimensions=dict(host='h'))
+    finally:
+        instr.disable_builtin_timers()
+    assert count >= 8
+    reported = dict((d.type_instance, d.values[0]) for d in fauxllectd.dispatched() if d.plugin == 'my_plugin')
+    assert reported['metric.emit.calls'] == 1
+    assert instr.timers['metric_batch.dispatch'].calls == 1
@@ -5,7 +5,34 @@ except ImportError:
 
 from time import time
 
-from collectdutil.metrics import Metric, encode_dimensions
+import pytest
+
+from collectdutil import metrics
+from collectdutil.metrics import (Aggregator, CardinalityGuard, DedupFilter, DimensionEncoder, EncodingCache,
+                                  HyperLogLog, Metric, MetricBatch, MetricFrame, RateTracker, dispatch_many,
+                                  dispatch_values, encode_dimensions)
+
+
+class RecordingValues(object):
+    instances = []
+    dispatched = []
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+        RecordingValues.instances.append(self)
+
+    def dispatch(self):
+        RecordingValues.dispatched.append((self.plugin, self.plugin_instance, self.type, self.type_instance,
+                                           list(self.values), getattr(self, 'host', ''),
+                                           getattr(self, 'time', 0), getattr(self, 'interval', 0)))
+
+
+@pytest.fixture
+def recorded(monkeypatch):
+    RecordingValues.instances = []
+    RecordingValues.dispatched = []
+    monkeypatch.setattr(metrics.collectd, 'Values', RecordingValues, raising=False)
+    return RecordingValues
 
 
 def test_encode_dimensions():
@@ -44,3 +71,310 @@ def test_encoded_metric_dimensions():
                     dimensions=dimensions)
     assert metric.encoded_dimensions == 'one=one_val,two=two_val,three=three_val'
     assert str(metric)  # confirm no exceptions from __str__()
+
+
+def test_metric_batch_reuses_values_per_group(recorded):
+    batch = MetricBatch(plugin='p', plugin_instance='pi', interval=10)
+    batch.add('one', 'gauge', 1, dimensions=dict(a='b'))
+    batch.add('two', 'gauge', 2, dimensions=dict(a='b'))
+    batch.add('three', 'counter', 3, dimensions=dict(a='b'), time=123)
+    batch.add('four', 'gauge', 4, host='other')
+    assert len(batch) == 4
+
+    count, elapsed = batch.dispatch()
+    assert count == 4
+    assert elapsed >= 0
+    assert len(recorded.instances) == 3
+    assert sorted(recorded.dispatched) == sorted([
+        ('p', 'pi[a=b]', 'gauge', 'one', [1], '', 0, 10),
+        ('p', 'pi[a=b]', 'gauge', 'two', [2], '', 0, 10),
+        ('p', 'pi[a=b]', 'counter', 'three', [3], '', 123, 10),
+        ('p', 'pi', 'gauge', 'four', [4], 'other', 0, 10),
+    ])
+    assert len(batch) == 0
+    assert batch.dispatch()[0] == 0
+    assert batch.dispatched == 4
+
+
+def test_dispatch_many_matches_emit(recorded):
+    dims = OrderedDict()
+    dims['one'] = 1
+    dims['two'] = 2
+    built = [Metric('ti{0}'.format(i), 'gauge', i, plugin='p', plugin_instance='pi', dimensions=dims, time=5)
+             for i in range(3)]
+    for metric in built:
+        metric.emit()
+    emitted = list(recorded.dispatched)
+    recorded.dispatched = []
+
+    count, _ = dispatch_many(built)
+    assert count == 3
+    assert recorded.dispatched == emitted
+
+
+def test_encoding_cache_lru():
+    cache = EncodingCache(size=2)
+    assert cache.encode(dict(a=1)) == 'a=1'
+    assert cache.encode(dict(a=1)) == 'a=1'
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.encode(dict(b=2))
+    cache.encode(dict(a=1))  # a is now the most recently used
+    cache.encode(dict(c=3))
+    assert cache.evictions == 1
+    assert len(cache) == 2
+    cache.encode(dict(a=1))
+    assert cache.hits == 3
+    cache.encode(dict(b=2))
+    assert cache.misses == 4
+
+    cache.resize(1)
+    assert len(cache) == 1
+    assert cache.evictions == 3
+
+
+def test_encoding_cache_keys_on_max_len():
+    cache = EncodingCache()
+    assert cache.encode(dict(key='value'), 5) == 'key=v'
+    assert cache.encode(dict(key='value'), 100) == 'key=value'
+    assert cache.misses == 2
+
+
+def test_encoding_cache_warns_once_per_key(monkeypatch):
+    warnings = []
+    monkeypatch.setattr(metrics.collectd, 'warning', warnings.append)
+    cache = EncodingCache()
+    for _ in range(3):
+        assert cache.encode(dict(key='value'), 5) == 'key=v'
+    assert len(warnings) == 1
+
+
+def test_dispatch_values(recorded):
+    dispatch_values(values=[1, 2], dimensions=dict(a='b'), plugin='p', type='t', type_instance='ti', interval=10)
+    assert recorded.dispatched == [('p', '[a=b]', 't', 'ti', [1, 2], '', 0, 10)]
+
+
+def test_metric_has_no_dict():
+    metric = Metric('ti', 'gauge', 1)
+    assert not hasattr(metric, '__dict__')
+    with pytest.raises(AttributeError):
+        metric.unknown = True
+
+
+def test_metric_frame_matches_emit(recorded):
+    rows = [('ti{0}'.format(i % 3), 'gauge' if i % 2 else 'counter', float(i), dict(idx=str(i % 4)))
+            for i in range(20)]
+    for type_instance, type, value, dims in rows:
+        Metric(type_instance, type, value, plugin='p', plugin_instance='pi', dimensions=dims, interval=10).emit()
+    emitted = list(recorded.dispatched)
+    recorded.dispatched = []
+    recorded.instances = []
+
+    frame = MetricFrame(plugin='p', plugin_instance='pi', interval=10)
+    for row in rows:
+        frame.add(*row)
+    assert len(frame) == 20
+
+    count, _ = frame.emit()
+    assert count == 20
+    assert recorded.dispatched == emitted
+    assert len(recorded.instances) == 4  # idx determines the type
+
+    frame.clear()
+    assert len(frame) == 0
+    assert frame.emit()[0] == 0
+
+
+def test_metric_frame_unhashable_dimensions(recorded):
+    dims = dict(tags=['a', 'b'])
+    Metric('ti', 'gauge', 1, plugin='p', dimensions=dims).emit()
+    emitted = list(recorded.dispatched)
+    recorded.dispatched = []
+
+    frame = MetricFrame(plugin='p')
+    frame.add('ti', 'gauge', 1, dimensions=dims)
+    assert frame.emit()[0] == 1
+    assert recorded.dispatched == emitted
+
+
+def test_dimension_encoder_sorted():
+    encoder = DimensionEncoder(order='sorted')
+    one = OrderedDict([('b', 2), ('a', 1), ('c', 3)])
+    two = OrderedDict([('c', 3), ('b', 2), ('a', 1)])
+    assert encoder.encode(one) == encoder.encode(two) == 'a=1,b=2,c=3'
+    assert encode_dimensions(one, encoder=encoder) == 'a=1,b=2,c=3'
+
+
+def test_dimension_encoder_drop_by_priority():
+    encoder = DimensionEncoder(order='sorted', priority=('host', 'zone'), overflow='drop')
+    dims = dict(aaa='x' * 10, host='h1', zone='z', b='y')
+    assert encoder.encode(dims) == 'host=h1,zone=z,aaa=xxxxxxxxxx,b=y'
+    assert encoder.encode(dims, 20) == 'host=h1,zone=z,b=y'
+    assert encoder.encode(dims, 8) == 'host=h1'
+
+
+def test_dimension_encoder_hash():
+    encoder = DimensionEncoder(order='sorted', overflow='hash', digest_size=8)
+    dims = dict(a='1', b='2', c='x' * 30)
+    encoded = encoder.encode(dims, 30)
+    assert len(encoded) <= 30
+    assert encoded.startswith('a=1,b=2,dims_hash=')
+    assert encoder.encode(dict(dims), 30) == encoded
+    assert encoder.encode(dict(dims, c='y' * 30), 30) != encoded
+
+
+def test_dimension_encoder_truncate_is_default():
+    assert encode_dimensions(OrderedDict([('key', 'value'), ('other', 'value')]), 10) == 'key=value,'
+    with pytest.raises(ValueError):
+        DimensionEncoder(overflow='explode')
+
+
+def test_encoding_cache_set_encoder():
+    cache = EncodingCache()
+    dims = OrderedDict([('b', 2), ('a', 1)])
+    assert cache.encode(dims) == 'b=2,a=1'
+    cache.set_encoder(DimensionEncoder(order='sorted'))
+    assert cache.encode(dims) == 'a=1,b=2'
+
+
+def test_rate_tracker():
+    rates = RateTracker(ttl=100)
+    assert rates.update('a', 100, 0) is None
+    assert rates.update('a', 150, 10) == (50, 5.0)
+    assert rates.update('a', 150, 10) is None  # not newer
+    assert rates.update('a', 20, 20) is None  # reset
+    assert rates.resets == 1
+    assert rates.update('a', 40, 30) == (20, 2.0)
+
+
+def test_rate_tracker_wraps():
+    rates = RateTracker(counter_bits=32)
+    rates.update('a', 2 ** 32 - 10, 0)
+    assert rates.update('a', 10, 10) == (20, 2.0)
+    assert rates.wraps == 1
+    rates.update('b', 1000, 0)
+    assert rates.update('b', 10, 10) is None
+    assert rates.resets == 1
+
+
+def test_rate_tracker_expires_series():
+    rates = RateTracker(ttl=10)
+    for i in range(5):
+        rates.update(i, 1, 0)
+    assert len(rates) == 5
+    rates.update('new', 1, 20)
+    assert len(rates) == 1
+    assert rates.evictions == 5
+    for i in range(5):
+        rates.update(i, 1, 21)
+    assert len(rates._values) == 6  # freed slots are reused
+
+
+def test_rate_tracker_metrics(recorded):
+    rates = RateTracker()
+    dims = dict(queue='a')
+    assert not rates.emit(Metric('messages', 'counter', 10, plugin='p', dimensions=dims, time=100))
+    assert rates.emit(Metric('messages', 'counter', 30, plugin='p', dimensions=dims, time=110))
+    assert not rates.emit(Metric('messages', 'counter', 30, plugin='p', dimensions=dict(queue='b'), time=110))
+    assert recorded.dispatched == [('p', '[queue=a]', 'gauge', 'messages', [2.0], '', 110, 0)]
+    metric = rates.to_rate(Metric('messages', 'counter', 35, plugin='p', dimensions=dims, time=120),
+                           type='derive', per_second=False)
+    assert (metric.type, metric.value) == ('derive', 5)
+
+
+def test_aggregator(recorded):
+    agg = Aggregator(group_by=('cluster',), stats=('sum', 'count', 'min', 'max', 'mean', 'p50', 'p99'))
+    for i in range(1, 101):
+        agg.add(Metric('depth', 'gauge', i, plugin='p', dimensions=dict(cluster='a', queue=str(i))))
+    agg.add(Metric('depth', 'gauge', 7, plugin='p', dimensions=dict(cluster='b', queue='x')))
+    agg.add(Metric('total', 'counter', 3, plugin='p', dimensions=dict(queue='x')))
+    assert len(agg) == 3
+
+    count, _ = agg.flush()
+    assert count == 21
+    assert len(agg) == 0
+    out = dict(((pi, ti), (type, values[0])) for _, pi, type, ti, values, _, _, _ in recorded.dispatched)
+    assert out[('[cluster=a]', 'depth.sum')] == ('gauge', 5050)
+    assert out[('[cluster=a]', 'depth.count')] == ('gauge', 100)
+    assert out[('[cluster=a]', 'depth.min')] == ('gauge', 1)
+    assert out[('[cluster=a]', 'depth.max')] == ('gauge', 100)
+    assert out[('[cluster=a]', 'depth.mean')] == ('gauge', 50.5)
+    assert out[('[cluster=a]', 'depth.p50')] == ('gauge', 50)
+    assert out[('[cluster=a]', 'depth.p99')] == ('gauge', 99)
+    assert out[('[cluster=b]', 'depth.p99')] == ('gauge', 7)
+    assert out[('', 'total.sum')] == ('counter', 3)
+
+
+def test_aggregator_rejects_unknown_stats():
+    for stat in ('median', 'p0', 'p101', 'pxx'):
+        with pytest.raises(ValueError):
+            Aggregator(stats=(stat,))
+
+
+def test_dedup_filter_heartbeat():
+    dedup = DedupFilter(heartbeat=2)
+    sent = [dedup.should_send('a', value) for value in (1, 1, 1, 1, 1, 2, 2, 1)]
+    assert sent == [True, False, True, False, True, True, False, True]
+    assert (dedup.sent, dedup.suppressed) == (5, 3)
+
+    every = DedupFilter(heartbeat=1)
+    assert all(every.should_send('a', 1) for _ in range(3))
+
+    never = DedupFilter(heartbeat=None)
+    assert [never.should_send('a', 1) for _ in range(5)] == [True, False, False, False, False]
+
+
+def test_dedup_filter_is_bounded():
+    dedup = DedupFilter(max_series=2)
+    for key in ('a', 'b', 'a', 'c'):  # b is the least recently seen when c arrives
+        dedup.should_send(key, 1)
+    assert len(dedup) == 2
+    assert not dedup.should_send('a', 1)
+    assert dedup.should_send('b', 1)
+
+
+def test_dedup_filter_metrics(recorded):
+    dedup = DedupFilter()
+    assert dedup.emit(Metric('capacity', 'gauge', 10, plugin='p', dimensions=dict(disk='a')))
+    assert not dedup.emit(Metric('capacity', 'gauge', 10, plugin='p', dimensions=dict(disk='a')))
+    assert dedup.emit(Metric('capacity', 'gauge', 10, plugin='p', dimensions=dict(disk='b')))
+    assert len(recorded.dispatched) == 2
+
+
+def test_hyperloglog_estimate():
+    hll = HyperLogLog()
+    assert hll.estimate() == 0
+    for i in range(20000):
+        hll.add(('series', i))
+        hll.add(('series', i))
+    assert 18000 < hll.estimate() < 22000
+    hll.clear()
+    assert hll.estimate() == 0
+
+
+def test_cardinality_guard_drops(recorded):
+    guard = CardinalityGuard(max_series=3)
+    emitted = [guard.emit(Metric('requests', 'counter', 1, plugin='p', dimensions=dict(id=str(i % 5))))
+               for i in range(10)]
+    assert emitted == [True, True, True, False, False] * 2
+    assert guard.series() == 3
+    assert guard.dropped == 4
+
+    recorded.dispatched = []
+    assert guard.report(plugin='p')[0] == 4
+    reported = dict((d[3], d[4][0]) for d in recorded.dispatched)
+    assert reported.pop('cardinality.estimate') in (4, 5)  # 4 if two series share a register
+    assert reported == {'cardinality.series': 3, 'cardinality.dropped': 4, 'cardinality.collapsed': 0}
+    assert guard.series() == 0
+    assert guard.emit(Metric('requests', 'counter', 1, plugin='p', dimensions=dict(id='4')))
+
+
+def test_cardinality_guard_collapses(recorded):
+    guard = CardinalityGuard(max_series=1, overflow='collapse')
+    for i in range(3):
+        assert guard.emit(Metric('requests', 'counter', i, plugin='p', dimensions=dict(id=str(i))))
+    assert [d[1] for d in recorded.dispatched] == ['[id=0]', '[cardinality_overflow=true]',
+                                                   '[cardinality_overflow=true]']
+    assert guard.collapsed == 2
+    with pytest.raises(ValueError):
+        CardinalityGuard(overflow='explode')
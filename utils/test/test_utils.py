@@ -1,3 +1,5 @@
+import pytest
+
 from collectdutil.utils import ParsedConfig
 
 
@@ -29,3 +31,37 @@ def test_parsed_config():
     child = children[6]
     assert child.key == 'Key6'
     assert child.values == ['multiple component', 'strings with spaces']
+
+
+def test_parsed_config_blocks():
+    config_string = '''
+    Key1 "Value1"  # trailing comment
+    # full line comment
+    <Node "first" 1>
+      Host "localhost"
+      <Inner>
+        Port 8080
+      </Inner>
+    </Node>
+    <Node "second">
+    </Node>
+    Key2 true
+    '''
+    children = ParsedConfig(config_string).children
+    assert [c.key for c in children] == ['Key1', 'Node', 'Node', 'Key2']
+    assert children[0].values == ['Value1']
+    assert children[0].children == []
+    first = children[1]
+    assert first.values == ['first', 1.0]
+    assert first.children[0].key == 'Host'
+    assert first.children[0].parent is first
+    assert first.children[1].children[0].values == [8080.0]
+    assert children[2].values == ['second']
+    assert children[2].children == []
+    assert children[3].values == [True]
+
+
+def test_parsed_config_errors():
+    for config_string in ('Key "unterminated', '<Node "x">', '</Node>', '<Node "x">\n</Other>', 'Key value'):
+        with pytest.raises(ValueError):
+            ParsedConfig(config_string)